@@ -14,6 +14,8 @@ from pathlib import Path
 import config
 import os
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -152,6 +154,9 @@ elif config.ENV == 'PROD':
 
     CORS_ALLOWED_ORIGINS = ['https://*.crashthegame.com', 'https://crashthegame.com']
 
+# the save key is sent in a header to the endpoints that read a game, so it's kept out of urls and logs
+CORS_ALLOW_HEADERS = (*default_headers, 'x-save-key')
+
 # configure logging
 if config.ENV == 'DEV':
     LOGGING = {
@@ -0,0 +1,198 @@
+''' 
+Benchmarks the formats game text can be stored in - bytes stored, and time to save and load per turn.
+Run from the backend directory, with the usual environment: 
+
+    python -m benchmarks.codec --turns 200
+
+Prints the results as json.
+'''
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+import django
+
+# the game modules use the database models, so django has to be set up before they're imported
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import config
+
+from games.cache import cache
+from games.load_game import load_history
+from games.save_game import commit_turn
+from games.storage import get_storage
+
+
+def story_text(words, rng, length=200):
+    '''
+    Generates a pseudo-story - random sentences, made from a vocabulary of real words.
+
+    Parameters
+    ----------
+    words : list
+        The vocabulary.
+    rng : random.Random
+        The random number generator.
+    length : int | 200
+        The number of words.
+
+    Returns
+    -------
+    str
+    '''
+
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < length:
+        sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(6, 18)))
+        sentences.append(sentence.capitalize() + '.')
+
+    return ' '.join(sentences)
+
+def make_turns(num_turns, seed=0):
+    '''
+    Generates the user input, response and summary for a number of turns.
+
+    Parameters
+    ----------
+    num_turns : int
+        The number of turns.
+    seed : int | 0
+        The random seed.
+
+    Returns
+    -------
+    list
+        The turns - each a tuple of user input, response and summary.
+    '''
+
+    # use the words in the prompts as the vocabulary
+    with open(os.path.join(config.llm['prompts_path'], f'{config.llm["provider"].lower()}.yaml')) as f:
+        words = re.findall(r"[a-z']+", f.read().lower())
+
+    rng = random.Random(seed)
+
+    return [(story_text(words, rng, 15), story_text(words, rng, 200), story_text(words, rng, 50))
+            for _ in range(num_turns)]
+
+def bench_legacy(turns):
+    '''
+    Benchmarks the original format - a json list per chunk, loaded and rewritten for every record.
+
+    Parameters
+    ----------
+    turns : list
+        The turns to save.
+
+    Returns
+    -------
+    dict
+        The results.
+    '''
+
+    storage = get_storage('memory')
+    storage.files.clear()
+
+    chunks = {'full_text': [[]], 'summaries': [[]]}
+
+    start = time.perf_counter()
+    for turn, (user_input, response, summary) in enumerate(turns):
+        for type, text in [('full_text', user_input), ('summaries', user_input),
+                           ('full_text', response), ('summaries', summary)]:
+            # start a new chunk once the latest is too big
+            num = len(chunks[type]) - 1
+            path = f'bench/{type}/{num}.json'
+            if storage.exists(path) and storage.size(path) > config.file_save['max_size']:
+                chunks[type].append([])
+                num += 1
+                path = f'bench/{type}/{num}.json'
+
+            # read, modify, write
+            data = json.loads(storage.read(path)) if storage.exists(path) else []
+            data.append({'writer': 'ai', 'text': text, 'turn': turn})
+            storage.write(path, json.dumps(data).encode('utf-8'))
+    save_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for type, type_chunks in chunks.items():
+        for num in range(len(type_chunks)):
+            json.loads(storage.read(f'bench/{type}/{num}.json'))
+    load_time = time.perf_counter() - start
+
+    return results('legacy json', storage, turns, save_time, load_time)
+
+def bench_codec(turns, codec):
+    '''
+    Benchmarks the append-only format, with a codec.
+
+    Parameters
+    ----------
+    turns : list
+        The turns to save.
+    codec : str
+        The codec to use.
+
+    Returns
+    -------
+    dict
+        The results.
+    '''
+
+    storage = get_storage('memory')
+    storage.files.clear()
+    config.file_save['codec'] = codec
+
+    start = time.perf_counter()
+    for turn, (user_input, response, summary) in enumerate(turns):
+        commit_turn('bench', turn, response, summary, user_input=user_input)
+    save_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_history('bench')
+    load_history('bench', summaries=True)
+    load_time = time.perf_counter() - start
+
+    return results(f'jsonl, codec={codec}', storage, turns, save_time, load_time)
+
+def results(format, storage, turns, save_time, load_time):
+    '''
+    Formats the results of a benchmark.
+    '''
+
+    stored = sum(len(data) for path, data in storage.files.items() if 'manifest' not in path)
+
+    return {
+        'format': format,
+        'turns': len(turns),
+        'bytes_stored': stored,
+        'bytes_per_turn': round(stored / len(turns)),
+        'save_ms_per_turn': round(save_time / len(turns) * 1000, 4),
+        'load_ms_all_history': round(load_time * 1000, 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=200)
+    args = parser.parse_args()
+
+    # everything runs in memory, so only the format is being measured
+    config.file_save['backend'] = 'memory'
+    config.file_save['path'] = ''
+    config.file_save['write_behind'] = False
+    # and nothing is cached, so every load reads the stored format
+    cache.max_bytes = 0
+
+    turns = make_turns(args.turns)
+
+    print(json.dumps([
+        bench_legacy(turns),
+        bench_codec(turns, 'none'),
+        bench_codec(turns, 'zlib'),
+    ], indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+Benchmarks a new game's initialization calls against the LLM API - the time to the first token of the wakeup scene,
+with the start of the prompts shared through the cache, and without (as every call was made before).
+Makes real LLM calls, so it needs an API key and costs money. Run from the backend directory, with the usual environment:
+
+    python -m benchmarks.initialization --games 5 --output initialization.json
+
+Prints the results as json (or writes them to a file), with sorted keys.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import django
+
+# the game modules use the database models, so django has to be set up before they're imported
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import config
+
+from games.initialization import (create_characters, create_crash, create_location, create_skills, create_title,
+                                  create_wakeup, random_setup)
+
+
+async def collect(stream):
+    '''
+    Reads a streamed call to the end.
+
+    Parameters
+    ----------
+    stream : async generator
+        The stream, from aprompt.
+
+    Returns
+    -------
+    str
+        The text.
+    float | None
+        The seconds until the first text arrived.
+    '''
+
+    start = time.perf_counter()
+    first = None
+    text = ''
+
+    async for chunk in stream:
+        if chunk['type'] == 'text':
+            if first is None:
+                first = time.perf_counter() - start
+            text += chunk['text']
+
+    return text, first
+
+async def initialize_game():
+    '''
+    Makes a new game's initialization calls in order, timing the wakeup scene.
+
+    Returns
+    -------
+    dict
+        The seconds to the first token of the wakeup scene, to its end, and for the calls before it.
+    '''
+
+    theme, timeframe, details = random_setup()
+    start = time.perf_counter()
+
+    title, _ = await create_title(theme, timeframe, details)
+    crash_story, _ = await collect(await create_crash(title, theme, timeframe, details))
+    location_description, _ = await create_location(crash_story, title, theme, timeframe, details)
+    skills, _, _ = await create_skills(crash_story, location_description, title, theme, timeframe, details)
+    characters, _, _ = await create_characters(crash_story, location_description, skills,
+                                               title, theme, timeframe, details)
+
+    setup = time.perf_counter() - start
+
+    # the wakeup scene is what the player waits on - the call that reads the most from the cache
+    start = time.perf_counter()
+    _, first_token = await collect(await create_wakeup(crash_story, location_description, skills, characters,
+                                                       title, theme, timeframe, details))
+
+    return {
+        'wakeup_first_token_s': round(first_token, 3),
+        'wakeup_total_s': round(time.perf_counter() - start, 3),
+        'setup_s': round(setup, 3),
+    }
+
+def summarize_runs(runs):
+    '''
+    Summarizes the runs of one mode.
+
+    Parameters
+    ----------
+    runs : list
+        The results of each game, from initialize_game.
+
+    Returns
+    -------
+    dict
+        The median and mean of each measurement.
+    '''
+
+    summary = {'games': len(runs)}
+
+    for key in runs[0]:
+        values = sorted(run[key] for run in runs)
+        summary[f'{key}_median'] = values[len(values) // 2]
+        summary[f'{key}_mean'] = round(sum(values) / len(values), 3)
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--games', type=int, default=5, help='The number of games to initialize in each mode.')
+    parser.add_argument('--output', default=None, help='A file to write the results to, rather than printing them.')
+    args = parser.parse_args()
+
+    runs = {'cached': [], 'uncached': []}
+
+    # the modes take turns, so a slow patch of the API doesn't land on just one of them
+    for _ in range(args.games):
+        for mode in runs:
+            config.llm['initialization_caching'] = mode == 'cached'
+            runs[mode].append(asyncio.run(initialize_game()))
+
+    output = json.dumps({
+        'settings': {
+            'model': config.llm['model'],
+        },
+        'results': {mode: summarize_runs(mode_runs) for mode, mode_runs in runs.items()},
+        'runs': runs,
+    }, indent=4, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+'''
+Benchmarks the storage layer - latency, storage operations and bytes transferred for save_text, load_latest_file,
+load_history and remove_turn, on synthetic games of several lengths and chunk sizes.
+Runs against the local file system and an in-process fake S3. Run from the backend directory, with the usual environment:
+
+    python -m benchmarks.storage --turns 10 100 1000 --max-sizes 1000 10000 100000 --output storage.json
+
+Prints the results as json (or writes them to a file), with sorted keys - so the results of two releases can be diffed.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import django
+
+# the game modules use the database models, so django has to be set up before they're imported
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+django.setup()
+
+import config
+
+import games.storage
+from games.cache import cache
+from games.load_game import load_history, load_latest_file
+from games.save_game import save_text, remove_turn
+from games.storage import LocalStorage, MemoryStorage
+
+from benchmarks.codec import make_turns
+
+
+class FakeS3Storage(MemoryStorage):
+    '''
+    Stores game files in memory, the way S3 would - objects can't be appended to.
+    '''
+
+    supports_append = False
+
+
+class CountingStorage:
+    '''
+    Wraps a storage backend, counting the requests made to it and the bytes read and written.
+    Each request can be given a latency, to stand in for a round trip over the network.
+    '''
+
+    def __init__(self, backend, latency=0):
+        self.backend = backend
+        self.latency = latency
+        self.supports_append = backend.supports_append
+        # chunks are fetched from a pool of threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.ops = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def count(self, name, read=0, written=0):
+        with self.lock:
+            self.ops[name] = self.ops.get(name, 0) + 1
+            self.bytes_read += read
+            self.bytes_written += written
+
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read(self, path):
+        data = self.backend.read(path)
+        self.count('read', read=len(data))
+        return data
+
+    def read_if_exists(self, path):
+        data = self.backend.read_if_exists(path)
+        self.count('read_if_exists', read=len(data) if data is not None else 0)
+        return data
+
+    def read_range(self, path, start, end):
+        data = self.backend.read_range(path, start, end)
+        self.count('read_range', read=len(data))
+        return data
+
+    def write(self, path, data):
+        self.count('write', written=len(data))
+        return self.backend.write(path, data)
+
+    def append(self, path, data):
+        self.count('append', written=len(data))
+        return self.backend.append(path, data)
+
+    def size(self, path):
+        self.count('size')
+        return self.backend.size(path)
+
+    def exists(self, path):
+        self.count('exists')
+        return self.backend.exists(path)
+
+    def list(self, path):
+        self.count('list')
+        return self.backend.list(path)
+
+    def delete(self, path):
+        self.count('delete')
+        return self.backend.delete(path)
+
+
+def measure(storage, function, calls):
+    '''
+    Calls a function a number of times, measuring each call.
+
+    Parameters
+    ----------
+    storage : CountingStorage
+        The storage the function uses.
+    function : callable
+        The function - called with the number of the call.
+    calls : int
+        The number of calls.
+
+    Returns
+    -------
+    dict
+        The latency of the calls, and the storage requests and bytes per call.
+    '''
+
+    times = []
+    storage.reset()
+
+    for i in range(calls):
+        start = time.perf_counter()
+        function(i)
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+
+    return {
+        'calls': calls,
+        'ms_mean': round(sum(times) / calls * 1000, 4),
+        'ms_p50': round(times[calls // 2] * 1000, 4),
+        'ms_p95': round(times[min(calls - 1, int(calls * 0.95))] * 1000, 4),
+        'requests_per_call': {name: round(count / calls, 2) for name, count in storage.ops.items()},
+        'bytes_read_per_call': round(storage.bytes_read / calls),
+        'bytes_written_per_call': round(storage.bytes_written / calls),
+    }
+
+def bench_game(storage, turns, max_size, loads, removals):
+    '''
+    Saves a synthetic game record by record, then loads it, and rolls back its latest turns.
+
+    Parameters
+    ----------
+    storage : CountingStorage
+        The storage backend in use.
+    turns : list
+        The game's turns - from make_turns.
+    max_size : int
+        The chunk size to use.
+    loads : int
+        The number of times to load the game.
+    removals : int
+        The number of turns to roll back.
+
+    Returns
+    -------
+    dict
+        The results for each function.
+    '''
+
+    config.file_save['max_size'] = max_size
+    game_id = f'bench-{len(turns)}-{max_size}'
+
+    # each record of each turn is saved on its own
+    records = [(type, writer, text, turn)
+               for turn, (user_input, response, summary) in enumerate(turns)
+               for type, writer, text in [('full_text', 'user', user_input), ('summaries', 'user', user_input),
+                                          ('full_text', 'ai', response), ('summaries', 'ai', summary)]]
+
+    def save(i):
+        type, writer, text, turn = records[i]
+        save_text(game_id, text, turn=turn, writer=writer, type=type)
+
+    results = {'save_text': measure(storage, save, len(records))}
+
+    results['load_latest_file'] = measure(storage, lambda i: load_latest_file(game_id), loads)
+    results['load_history'] = measure(storage, lambda i: load_history(game_id, summaries=i % 2 == 1), loads)
+    results['remove_turn'] = measure(storage, lambda i: remove_turn(game_id, len(turns) - 1 - i),
+                                     min(removals, len(turns)))
+
+    # reading the game back once turns have been rolled back
+    results['load_history_after_remove'] = measure(storage, lambda i: load_history(game_id), loads)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--max-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--backends', nargs='+', default=['local', 's3'], choices=['local', 's3'])
+    parser.add_argument('--loads', type=int, default=10, help='The number of times to load each game.')
+    parser.add_argument('--removals', type=int, default=5, help='The number of turns to roll back in each game.')
+    parser.add_argument('--s3-latency', type=float, default=0,
+                        help='The latency of each fake S3 request, in milliseconds.')
+    parser.add_argument('--output', default=None, help='A file to write the results to, rather than printing them.')
+    args = parser.parse_args()
+
+    # nothing is cached, and everything is saved straight away - so every call goes to storage
+    cache.max_bytes = 0
+    config.file_save['write_behind'] = False
+    config.file_save['history_backend'] = 'files'
+
+    turns = make_turns(max(args.turns))
+    results = []
+
+    for backend in args.backends:
+        if backend == 'local':
+            path = tempfile.mkdtemp(prefix='crash-bench-')
+            storage = CountingStorage(LocalStorage())
+        else:
+            path = 'bench'
+            storage = CountingStorage(FakeS3Storage(), latency=args.s3_latency / 1000)
+
+        # the game code gets the counting backend
+        games.storage.backends['bench'] = storage
+        config.file_save['backend'] = 'bench'
+        config.file_save['path'] = path
+
+        try:
+            for num_turns in args.turns:
+                for max_size in args.max_sizes:
+                    game = bench_game(storage, turns[:num_turns], max_size, args.loads, args.removals)
+
+                    for function, measured in game.items():
+                        results.append({
+                            'backend': backend,
+                            'turns': num_turns,
+                            'max_size': max_size,
+                            'function': function,
+                            **measured,
+                        })
+        finally:
+            if backend == 'local':
+                shutil.rmtree(path, ignore_errors=True)
+
+    output = json.dumps({
+        'settings': {
+            'codec': config.file_save['codec'],
+            'fetch_workers': config.file_save['fetch_workers'],
+            's3_latency_ms': args.s3_latency,
+        },
+        'results': results,
+    }, indent=4, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,30 @@ def set_value(name, decrypt=False, env=ENV):
     else:
         raise ValueError('Invalid environment.')
     
+def set_optional_value(name, default=None, decrypt=False, env=ENV):
+    '''
+    Returns a value from the environment or parameter store,
+    or a default if it hasn't been set.
+
+    Parameters
+    ----------
+    name : str
+        The name of the value to retrieve.
+    default : any | None
+        The value to return if it hasn't been set.
+    decrypt : bool
+        Whether to decrypt the value.
+    env : str
+        The environment to retrieve the value from.
+    '''
+
+    try:
+        value = set_value(name, decrypt=decrypt, env=env)
+    except SSM.exceptions.ParameterNotFound:
+        return default
+
+    return value if value is not None else default
+
 def set_llm_value(name, decrypt=False, env=ENV):
     '''
     Returns a value for the LLM API from the environment or parameter store.
@@ -92,16 +116,81 @@ llm = {
     'api_key': set_llm_value('API_KEY', decrypt=True),
     'model': set_llm_value('MODEL'),
     'prompts_path': set_value('PROMPTS_PATH', env='ALL'),
+    # the shared LLM client's connection pool, timeouts (in seconds) and retries
+    'max_connections': int(set_optional_value('LLM_MAX_CONNECTIONS', default=20)),
+    'max_keepalive_connections': int(set_optional_value('LLM_MAX_KEEPALIVE_CONNECTIONS', default=10)),
+    'keepalive_expiry': float(set_optional_value('LLM_KEEPALIVE_EXPIRY', default=60)),
+    'connect_timeout': float(set_optional_value('LLM_CONNECT_TIMEOUT', default=5)),
+    'read_timeout': float(set_optional_value('LLM_READ_TIMEOUT', default=120)),
+    'max_retries': int(set_optional_value('LLM_MAX_RETRIES', default=2)),
+    # summaries are written in the background - at most this many at once
+    'summary_workers': int(set_optional_value('LLM_SUMMARY_WORKERS', default=8)),
+    # the longest (in seconds) building a prompt waits for an earlier turn's summary, before using its full text instead
+    'summary_wait': float(set_optional_value('LLM_SUMMARY_WAIT', default=10)),
+    # the older turns' summaries are folded into acts, and the older acts into an arc, so the prompt stays the same size
+    ## the prompt has the arc, the latest acts, and the summaries of the turns since - at least the latest few
+    'act_turns': int(set_optional_value('LLM_ACT_TURNS', default=10)),
+    'recent_turns': int(set_optional_value('LLM_RECENT_TURNS', default=6)),
+    'recent_acts': int(set_optional_value('LLM_RECENT_ACTS', default=3)),
+    'act_target_word_count': int(set_optional_value('LLM_ACT_TARGET_WORD_COUNT', default=150)),
+    'arc_target_word_count': int(set_optional_value('LLM_ARC_TARGET_WORD_COUNT', default=300)),
+    # the most input tokens (estimated) the main loop prompt should take up - the oldest history is dropped to fit
+    'prompt_budget': int(set_optional_value('LLM_PROMPT_BUDGET', default=12000)),
+    # the longest a main loop response should be, in words - its max tokens are worked out from this
+    'main_loop_words': int(set_optional_value('LLM_MAIN_LOOP_WORDS', default=250)),
+    # whether to record the token usage of every LLM call in the database - for the cache report
+    'record_usage': set_optional_value('LLM_RECORD_USAGE', default='true').lower() == 'true',
+    # whether a new game's initialization calls cache the start of their prompts, which they share
+    'initialization_caching': set_optional_value('LLM_INITIALIZATION_CACHING', default='true').lower() == 'true',
 }
 
 file_save = {
     'path': set_value('FILE_SAVE_PATH', env='ALL'),
     'max_size': int(set_value('MAX_FILE_SIZE', env='ALL')),
     'game_setup_path': set_value('GAME_SETUP_PATH', env='ALL'),
+    # where game files are stored - 'local', 's3' or 'memory'
+    ## if not set, local in DEV and s3 everywhere else
+    'backend': set_optional_value('STORAGE_BACKEND'),
+    # how game files are encoded - 'zlib' compresses them, 'none' stores plain json
+    'codec': set_optional_value('STORAGE_CODEC', default='zlib'),
+    # write-behind saving - turns go into a local journal, and get written to storage in the background
+    'write_behind': set_optional_value('WRITE_BEHIND', default='false').lower() == 'true',
+    'journal_path': set_optional_value('WRITE_BEHIND_JOURNAL_PATH', default='write_behind.sqlite3'),
+    'flush_workers': int(set_optional_value('WRITE_BEHIND_WORKERS', default=4)),
+    # how often (in seconds) to check the journal for turns that need writing
+    'flush_interval': float(set_optional_value('WRITE_BEHIND_INTERVAL', default=5)),
+    # where the full text and summaries are kept - 'files' (in the storage backend) or 'database'
+    'history_backend': set_optional_value('HISTORY_BACKEND', default='files'),
+    # the most chunks to fetch at once when loading a game
+    'fetch_workers': int(set_optional_value('FETCH_WORKERS', default=8)),
+    # the most blocking storage and database calls the async views can have running at once
+    'io_workers': int(set_optional_value('IO_WORKERS', default=32)),
+    # the in-process cache of game data - its size in bytes (0 turns it off), and how long (in seconds) entries last
+    ## with more than one process, register a cache invalidation hook, or keep the time short
+    'cache_max_bytes': int(set_optional_value('CACHE_MAX_BYTES', default=64 * 1024 * 1024)),
+    'cache_ttl': float(set_optional_value('CACHE_TTL', default=300)),
+    # cold storage for games that haven't been played in a while - each is kept as a single compressed archive
+    ## if the path isn't set, archives go in an 'archive' directory under the file save path
+    'archive_path': set_optional_value('ARCHIVE_PATH'),
+    'archive_after_days': float(set_optional_value('ARCHIVE_AFTER_DAYS', default=21)),
 }
 
 s3 = {
     'data_bucket': set_value('DATA_BUCKET'),
+    # the shared s3 client's connection pool, timeouts (in seconds) and retries
+    'max_pool_connections': int(set_optional_value('S3_MAX_POOL_CONNECTIONS', default=50)),
+    'connect_timeout': float(set_optional_value('S3_CONNECT_TIMEOUT', default=2)),
+    'read_timeout': float(set_optional_value('S3_READ_TIMEOUT', default=10)),
+    'max_attempts': int(set_optional_value('S3_MAX_ATTEMPTS', default=3)),
+}
+
+# sending a loaded game's history to the player
+streaming = {
+    # a pause before the first item, so the player can read the title
+    'load_delay': float(set_optional_value('LOAD_STREAM_DELAY', default=1)),
+    # the items are spread over at most this many seconds, with at most load_interval seconds between them
+    'load_seconds': float(set_optional_value('LOAD_STREAM_SECONDS', default=4)),
+    'load_interval': float(set_optional_value('LOAD_STREAM_INTERVAL', default=0.3)),
 }
 
 email = {
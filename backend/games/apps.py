@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class GamesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'games'
+
+    def ready(self):
+        import config
+
+        # in write-behind mode, start flushing any turns left in the journal by a previous process
+        if config.file_save['write_behind']:
+            from games.write_behind import start
+            start()
@@ -0,0 +1,229 @@
+'''
+Cold storage for games that haven't been played in a while.
+An idle game's chunks, prompt state and initialization data are packed into a single compressed archive,
+and its files are removed - apart from a small stub manifest, which tells readers where the game went.
+The next time the game is loaded, it's rehydrated from the archive - with a single chunk for each type of records.
+'''
+
+import json
+import os
+import threading
+
+import config
+
+import games.journal as journal
+from games.cache import cache, notify_write
+from games.codec import decode, encode
+from games.load_game import load_initialization, load_prompt_state, load_stream
+from games.models import Game
+from games.save_game import describe_chunk, index_records, save_json, save_manifest, save_records
+from games.storage import get_storage
+
+
+# archives hold the committed records, with the tombstones already folded in
+VERSION = 1
+
+# the types of records in a game's chunks
+TYPES = ['full_text', 'summaries', 'prompt']
+
+# only one thread in the process rehydrates a game at a time
+lock = threading.Lock()
+
+
+def get_archive_path(game_id):
+    '''
+    Returns the path of a game's archive.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    str
+    '''
+
+    archive_dir = config.file_save['archive_path'] or os.path.join(config.file_save['path'], 'archive')
+
+    return os.path.join(archive_dir, f'{game_id}.archive')
+
+def list_files(game_id):
+    '''
+    Lists the files a game has in storage, apart from its manifest.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    list
+        The paths of the files.
+    '''
+
+    storage = get_storage()
+    game_dir = os.path.join(config.file_save['path'], str(game_id))
+
+    files = [os.path.join(game_dir, type, name) for type in TYPES
+             for name in storage.list(os.path.join(game_dir, type))]
+
+    if storage.exists(os.path.join(game_dir, 'initialization.json')):
+        files.append(os.path.join(game_dir, 'initialization.json'))
+
+    return files
+
+def archive_game(game_id, idle_since=None):
+    '''
+    Moves a game to cold storage - its committed records, prompt state and initialization data
+    are written as a single compressed archive, then its files are removed, leaving a stub manifest.
+    Only for games that aren't being played - a turn saved while it's being archived would be lost.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    idle_since : float | None
+        If given, the game is only archived if it hasn't been saved since this time (from time.time()).
+
+    Returns
+    -------
+    dict | None
+        The number of objects and bytes the game's files took up in storage, and the reads it took to load the game,
+        before and after (and once it's been rehydrated) - or None if the game wasn't archived.
+    '''
+
+    # the history is in the database, or turns are still waiting in the journal
+    if config.file_save['history_backend'] == 'database':
+        return None
+    if config.file_save['write_behind'] and journal.get_pending_turns(game_id):
+        return None
+
+    storage = get_storage()
+    manifest_path = os.path.join(config.file_save['path'], str(game_id), 'manifest.json')
+
+    raw_manifest = storage.read_if_exists(manifest_path)
+    if raw_manifest is None:
+        return None
+
+    manifest = json.loads(decode(raw_manifest))
+    if manifest.get('archived'):
+        return None
+    if idle_since is not None and manifest.get('modified', 0) > idle_since:
+        return None
+
+    files = list_files(game_id)
+    before = {
+        'objects': len(files) + 1,
+        'bytes': sum(storage.size(path) for path in files) + len(raw_manifest),
+        # the manifest, every chunk and the initialization data
+        'load_reads': 1 + sum(len(manifest.get(type, [])) for type in TYPES) + 1,
+    }
+
+    # the prompt state is kept if it's up to date - otherwise it gets rebuilt after the game is rehydrated
+    prompt_state = load_prompt_state(game_id)
+    records = {type: load_stream(game_id, type=type)['records'] for type in ['full_text', 'summaries']}
+    records['prompt'] = prompt_state['messages'] if prompt_state else []
+
+    archive = {
+        'version': VERSION,
+        'records': records,
+        'prompt_state': {'last': prompt_state['last'], 'summaries': len(records['summaries'])}
+            if prompt_state else None,
+        'journal': manifest.get('journal', {}),
+        'initialization': load_initialization(game_id)
+            if os.path.join(config.file_save['path'], str(game_id), 'initialization.json') in files else None,
+    }
+
+    # cold data is read rarely, so it's worth compressing it as much as possible
+    data = encode(json.dumps(archive).encode('utf-8'), codec='zlib', level=9)
+    storage.write(get_archive_path(game_id), data)
+
+    # if the game was saved while it was being archived, leave it where it is
+    if storage.read_if_exists(manifest_path) != raw_manifest:
+        storage.delete(get_archive_path(game_id))
+        return None
+
+    # the stub manifest is the commit - from here on, loading the game rehydrates it from the archive
+    save_json(manifest_path, {'archived': True})
+    Game.objects.filter(id=game_id).update(archived=True)
+
+    for path in files:
+        storage.delete(path)
+
+    cache.invalidate(game_id)
+    notify_write(game_id)
+
+    return {
+        'objects_before': before['objects'],
+        'bytes_before': before['bytes'],
+        'load_reads_before': before['load_reads'],
+        # the archive, and the stub manifest
+        'objects_after': 2,
+        'bytes_after': len(data) + storage.size(manifest_path),
+        'load_reads_after': 2,
+        # once it's rehydrated - the manifest, a chunk for each type of records and the initialization data
+        'load_reads_rehydrated': 1 + sum(1 for type in TYPES if records[type])
+            + (1 if archive['initialization'] is not None else 0),
+    }
+
+def rehydrate_game(game_id):
+    '''
+    Moves an archived game back out of cold storage - each type of records is written as a single chunk,
+    then the manifest is saved, and the archive is removed.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    dict
+        The game's manifest.
+    '''
+
+    storage = get_storage()
+    game_dir = os.path.join(config.file_save['path'], str(game_id))
+
+    with lock:
+        data = storage.read_if_exists(get_archive_path(game_id))
+
+        if data is None:
+            # another process got there first
+            manifest = json.loads(decode(storage.read(os.path.join(game_dir, 'manifest.json'))))
+            if manifest.get('archived'):
+                raise FileNotFoundError(f'The archive for game id={game_id} is missing.')
+            return manifest
+
+        archive = json.loads(decode(data))
+
+        manifest = {'index': {}}
+
+        for type in TYPES:
+            records = archive['records'][type]
+            manifest[type] = []
+
+            if records:
+                size = save_records(os.path.join(game_dir, type, '0.jsonl'), records)
+                manifest[type].append(describe_chunk('0.jsonl', records, size))
+
+            if type != 'prompt':
+                manifest['index'][type] = []
+                index_records(manifest['index'][type], '0.jsonl', records)
+
+        manifest['prompt_state'] = archive['prompt_state']
+        manifest['journal'] = archive['journal']
+
+        if archive['initialization'] is not None:
+            save_json(os.path.join(game_dir, 'initialization.json'), archive['initialization'])
+
+        # commit
+        save_manifest(game_id, manifest)
+
+        Game.objects.filter(id=game_id).update(archived=False)
+
+        storage.delete(get_archive_path(game_id))
+
+    return manifest
@@ -0,0 +1,272 @@
+''' An in-process cache of game data - so a game that's being played doesn't get re-read from storage every turn. '''
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    '''
+    A thread-safe, least recently used cache, bounded by the total size of its values in bytes.
+    Entries expire after a time to live, which bounds how stale they can get if another process writes the same game.
+    Keys are tuples that start with the game id, e.g. ('12', 'summaries').
+    '''
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        # when each game was last written by this process
+        ## a read that started before a write mustn't cache what it read - it could be out of date
+        self.written = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def now(self):
+        ''' Returns the current time - pass it to put, when caching something read from storage. '''
+        return time.monotonic()
+
+    def get(self, key):
+        ''' Returns the value for a key, or None if it isn't cached (or has expired). '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def peek(self, key):
+        ''' Returns the value for a key without counting a hit or miss, or changing its recency. '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[2] < time.monotonic():
+                return None
+
+            return entry[0]
+
+    def put(self, key, value, size, since=None):
+        '''
+        Caches a value.
+
+        Parameters
+        ----------
+        key : tuple
+            The key - starting with the game id.
+        value : object
+            The value. It mustn't be changed once it's cached.
+        size : int
+            The size of the value in bytes (roughly).
+        since : float | None
+            For values read from storage - when the read started, from now().
+            If the game has been written since then, the value isn't cached.
+            None for values being written, which always replace what's cached.
+
+        Returns
+        -------
+        None
+        '''
+
+        with self.lock:
+            if since is not None and self.written.get(key[0], float('-inf')) >= since:
+                return
+
+            if since is None:
+                self.mark_written(key[0])
+
+            if key in self.entries:
+                self.remove(key)
+
+            # too big to cache (or the cache is off) - but anything cached before is out of date
+            if size > self.max_bytes or self.max_bytes <= 0:
+                return
+
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+
+            # evict the least recently used entries until we're back under the limit
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, game_id, name=None):
+        '''
+        Removes a game's entries from the cache.
+
+        Parameters
+        ----------
+        game_id : int | str
+            The game id.
+        name : str | None
+            The entry to remove, e.g. 'summaries'. If None, removes all of the game's entries.
+
+        Returns
+        -------
+        None
+        '''
+
+        game_id = str(game_id)
+
+        with self.lock:
+            keys = [key for key in self.entries
+                    if key[0] == game_id and (name is None or key[1] == name)]
+
+            for key in keys:
+                self.remove(key)
+
+            # entries that were being read when this was called mustn't be cached either
+            self.mark_written(game_id)
+
+    def clear(self):
+        ''' Removes everything from the cache. '''
+
+        with self.lock:
+            self.entries.clear()
+            self.written.clear()
+            self.bytes = 0
+
+    def stats(self):
+        ''' Returns the cache's hit and miss counts, evictions, and size. '''
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+            }
+
+    def remove(self, key):
+        # must hold the lock
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def mark_written(self, game_id):
+        # must hold the lock
+        now = time.monotonic()
+        self.written[game_id] = now
+
+        # forget old writes - a read that started before them has long since finished
+        if len(self.written) > 1024:
+            self.written = {id: t for id, t in self.written.items() if t > now - self.ttl}
+
+
+# the game data cache, shared by the whole process
+cache = LRUCache(config.file_save['cache_max_bytes'], config.file_save['cache_ttl'])
+
+# functions called with the game id whenever this process writes a game
+## in a multi-process deployment, use these to tell the other processes to call invalidate_game
+invalidation_hooks = []
+
+def reset():
+    '''
+    Empties the cache in a forked child process - and gives it a lock of its own.
+
+    Returns
+    -------
+    None
+    '''
+
+    cache.lock = threading.Lock()
+    cache.clear()
+
+os.register_at_fork(after_in_child=reset)
+
+def enabled():
+    ''' Returns whether the cache is turned on. '''
+    return cache.max_bytes > 0
+
+def add_invalidation_hook(hook):
+    '''
+    Registers a function to be called with the game id whenever this process writes a game.
+
+    Parameters
+    ----------
+    hook : callable
+        The function.
+
+    Returns
+    -------
+    None
+    '''
+
+    invalidation_hooks.append(hook)
+
+def notify_write(game_id):
+    '''
+    Calls the invalidation hooks for a game that this process has written.
+    A failing hook is logged, but doesn't fail the write.
+
+    Parameters
+    ----------
+    game_id : int | str
+        The game id.
+
+    Returns
+    -------
+    None
+    '''
+
+    for hook in invalidation_hooks:
+        try:
+            hook(str(game_id))
+        except Exception:
+            logger.exception(f'Error calling cache invalidation hook for game id={game_id}')
+
+def invalidate_game(game_id):
+    '''
+    Removes everything cached for a game - for when another process has written it.
+
+    Parameters
+    ----------
+    game_id : int | str
+        The game id.
+
+    Returns
+    -------
+    None
+    '''
+
+    cache.invalidate(game_id)
+
+def records_size(records):
+    '''
+    Estimates the size of a list of records (or LLM messages) in bytes.
+
+    Parameters
+    ----------
+    records : list
+        The records.
+
+    Returns
+    -------
+    int
+    '''
+
+    # the text, plus a rough allowance for the dict and its other values
+    return sum(len(record['text'] if 'text' in record else record['content'][0]['text']) + 100
+               for record in records)
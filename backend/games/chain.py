@@ -0,0 +1,83 @@
+'''
+Runs a chain of async steps - LLM calls, database and storage writes - as soon as the steps they depend on have finished,
+so steps that don't depend on each other overlap. Logs how long each step took, and how long the chain took overall.
+'''
+
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run_chain(steps, name='chain'):
+    '''
+    Runs a chain of steps, each one starting as soon as its dependencies have finished.
+
+    Parameters
+    ----------
+    steps : dict
+        The steps, keyed by name - each a tuple of a coroutine function and the names of the steps it depends on.
+        The function is called with its dependencies' results, as keyword arguments named after them.
+        A step can only depend on steps that come before it.
+    name : str | 'chain'
+        The name of the chain, for the logs.
+
+    Returns
+    -------
+    dict
+        The result of each step, keyed by name.
+
+    Raises
+    ------
+    ValueError
+        If a step depends on a step that doesn't come before it.
+    Exception
+        The first exception raised by a step - the steps still running are cancelled.
+    '''
+
+    # a step can only depend on an earlier one - so there can't be a cycle
+    defined = set()
+    for step, (function, dependencies) in steps.items():
+        missing = [dependency for dependency in dependencies if dependency not in defined]
+        if missing:
+            raise ValueError(f'Step {step} of {name} depends on {missing}, which come after it or are missing.')
+        defined.add(step)
+
+    started = time.perf_counter()
+    # when each step started (relative to the start of the chain), and how long it took
+    timings = {}
+    tasks = {}
+
+    async def run_step(step, function, dependencies):
+        # every task exists by the time this runs - tasks don't start until the chain waits on them
+        arguments = {dependency: await tasks[dependency] for dependency in dependencies}
+
+        start = time.perf_counter()
+        try:
+            return await function(**arguments)
+        finally:
+            timings[step] = (start - started, time.perf_counter() - start)
+
+    for step, (function, dependencies) in steps.items():
+        tasks[step] = asyncio.ensure_future(run_step(step, function, dependencies))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        # let the cancelled steps finish unwinding before giving up on the chain
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    finally:
+        total = time.perf_counter() - started
+
+        for step, (start, duration) in sorted(timings.items(), key=lambda item: item[1][0]):
+            logger.info(f'{name}: {step} started at {start:.2f}s and took {duration:.2f}s')
+
+        logger.info(f'{name} took {total:.2f}s - its steps took {sum(duration for _, duration in timings.values()):.2f}s '
+                    'between them, which is how long it would take running them one after another')
+
+    return {step: task.result() for step, task in tasks.items()}
@@ -0,0 +1,118 @@
+''' Encoding and decoding of stored game files - compressing them, in versioned frames. '''
+
+import struct
+import zlib
+
+import config
+
+
+# every encoded frame starts with a header:
+## the magic bytes, the format version, the codec, and the length of the payload that follows
+MAGIC = b'CRZ'
+VERSION = 1
+HEADER = struct.Struct('>3sBBI')
+
+# the codecs, and their ids in the header
+CODECS = {
+    'none': 0,
+    'zlib': 1,
+}
+
+def encode(data, codec=None, level=6):
+    '''
+    Encodes data for storage.
+    Encoded frames can be concatenated - so they can be appended to the end of a chunk.
+
+    Parameters
+    ----------
+    data : bytes
+        The data to encode.
+    codec : str | None
+        The codec to use - 'zlib', or 'none' to store the data as is, with no frame.
+        If None, uses the configured codec.
+    level : int | 6
+        The compression level.
+
+    Returns
+    -------
+    bytes
+        The encoded data.
+    '''
+
+    if codec is None:
+        codec = config.file_save['codec']
+
+    # unencoded data is stored exactly as it was before there were codecs
+    if codec == 'none':
+        return data
+
+    if codec == 'zlib':
+        payload = zlib.compress(data, level)
+    else:
+        raise ValueError(f'Invalid codec: {codec}')
+
+    return HEADER.pack(MAGIC, VERSION, CODECS[codec], len(payload)) + payload
+
+def decode(data):
+    '''
+    Decodes stored data - any number of concatenated frames.
+    Data that isn't framed (e.g. legacy plain json) is returned as is.
+
+    Parameters
+    ----------
+    data : bytes
+        The stored data.
+
+    Returns
+    -------
+    bytes
+        The decoded data.
+    '''
+
+    # plain json never starts with the magic bytes
+    if not data.startswith(MAGIC):
+        return data
+
+    decoded = []
+    offset = 0
+
+    while offset < len(data):
+        magic, version, codec, length = HEADER.unpack_from(data, offset)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Invalid frame at byte {offset}.')
+
+        offset += HEADER.size
+        payload = data[offset:offset + length]
+        offset += length
+
+        if codec == CODECS['zlib']:
+            decoded.append(zlib.decompress(payload))
+        elif codec == CODECS['none']:
+            decoded.append(payload)
+        else:
+            raise ValueError(f'Invalid codec id: {codec}')
+
+    return b''.join(decoded)
+
+def detect(data):
+    '''
+    Returns the codec that stored data was encoded with.
+
+    Parameters
+    ----------
+    data : bytes
+        The stored data.
+
+    Returns
+    -------
+    str
+        The codec - 'none' if the data isn't framed.
+    '''
+
+    if not data.startswith(MAGIC):
+        return 'none'
+
+    _, _, codec, _ = HEADER.unpack_from(data)
+
+    return {id: name for name, id in CODECS.items()}[codec]
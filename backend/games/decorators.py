@@ -1,6 +1,8 @@
 ''' Decorators for the games app. '''
 
+import asyncio
 from functools import wraps
+import inspect
 import logging
 import time
 
@@ -10,6 +12,17 @@ logger = logging.getLogger(__name__)
 
 # decorator to catch exceptions and log them
 def catch_and_log(func):
+    # coroutine functions get an async wrapper, so the exception is caught when they're awaited
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                logger.exception(f'Error in {func.__name__}')
+                raise
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
@@ -23,6 +36,23 @@ def catch_and_log(func):
 ## used for functions that call the LLM - in case it has overload problems, etc.
 def retry_on_exception(max_retries=3, delay=3):
     def decorator(func):
+        # coroutine functions wait between retries without blocking the event loop
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+
+                for i in range(max_retries):
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception:
+                        logger.exception(f'Error in {func.__name__}')
+                        await asyncio.sleep(delay)
+
+                logger.exception(f'Max retries reached for function {func.__name__}.')
+                raise Exception(f'Max retries reached for function {func.__name__}.')
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
 
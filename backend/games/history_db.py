@@ -0,0 +1,218 @@
+''' Functions for storing a game's history (full text and summaries) in the database, rather than in files. '''
+
+from django.db import transaction
+from django.db.models import Max
+
+from games.models import StoryEntry
+
+
+def to_record(entry):
+    '''
+    Converts a story entry into a record, in the same format as records stored in files.
+
+    Parameters
+    ----------
+    entry : dict
+        The story entry's writer, text and turn.
+
+    Returns
+    -------
+    dict
+        The record.
+    '''
+
+    turn = entry['turn']
+
+    # turns in the main loop are numbers - the rest are words, e.g. 'crash'
+    return {
+        'writer': entry['writer'],
+        'text': entry['text'],
+        'turn': int(turn) if turn.isdigit() else turn,
+    }
+
+def add_entries(game_id, kind, records):
+    '''
+    Adds records to the end of a game's history of a given kind.
+    Should be called inside a transaction.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str
+        The kind of records - 'full_text' or 'summaries'.
+    records : list
+        The records to add.
+
+    Returns
+    -------
+    None
+    '''
+
+    last_position = (StoryEntry.objects.filter(game_id=game_id, kind=kind)
+                     .aggregate(last=Max('position'))['last'])
+    position = last_position + 1 if last_position is not None else 0
+
+    StoryEntry.objects.bulk_create([
+        StoryEntry(game_id=game_id, kind=kind, position=position + i,
+                   turn=str(record.get('turn', '')), writer=record['writer'], text=record['text'])
+        for i, record in enumerate(records)
+    ])
+
+def load_history(game_id, kind='full_text'):
+    '''
+    Loads a game's history of a given kind - a single indexed query.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str | 'full_text'
+        The kind of records - 'full_text' or 'summaries'.
+
+    Returns
+    -------
+    list
+        The records, in order.
+    '''
+
+    entries = (StoryEntry.objects.filter(game_id=game_id, kind=kind)
+               .order_by('position').values('writer', 'text', 'turn'))
+
+    return [to_record(entry) for entry in entries]
+
+def count_entries(game_id, kind='full_text'):
+    '''
+    Returns the number of entries in a game's history of a given kind.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str | 'full_text'
+        The kind of records - 'full_text' or 'summaries'.
+
+    Returns
+    -------
+    int
+    '''
+
+    return StoryEntry.objects.filter(game_id=game_id, kind=kind).count()
+
+def load_latest_turn(game_id, kind='full_text'):
+    '''
+    Loads the records for the latest turn in a game's history of a given kind.
+    This stands in for the latest chunk, when the history is stored in files.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str | 'full_text'
+        The kind of records - 'full_text' or 'summaries'.
+
+    Returns
+    -------
+    list | None
+        The records, in order - or None if there aren't any.
+    '''
+
+    latest = (StoryEntry.objects.filter(game_id=game_id, kind=kind)
+              .order_by('-position').values_list('turn', flat=True).first())
+
+    if latest is None:
+        return None
+
+    entries = (StoryEntry.objects.filter(game_id=game_id, kind=kind, turn=latest)
+               .order_by('position').values('writer', 'text', 'turn'))
+
+    return [to_record(entry) for entry in entries]
+
+def add_records(game_id, kind, records):
+    '''
+    Adds records to the end of a game's history of a given kind.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str
+        The kind of records - 'full_text' or 'summaries'.
+    records : list
+        The records to add.
+
+    Returns
+    -------
+    None
+    '''
+
+    with transaction.atomic():
+        add_entries(game_id, kind, records)
+
+def replace_latest_turn(game_id, kind, records):
+    '''
+    Replaces the records for the latest turn in a game's history of a given kind.
+    This stands in for overwriting the latest chunk, when the history is stored in files.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    kind : str
+        The kind of records - 'full_text' or 'summaries'.
+    records : list
+        The new records.
+
+    Returns
+    -------
+    None
+    '''
+
+    with transaction.atomic():
+        latest = (StoryEntry.objects.filter(game_id=game_id, kind=kind)
+                  .order_by('-position').values_list('turn', flat=True).first())
+
+        if latest is not None:
+            StoryEntry.objects.filter(game_id=game_id, kind=kind, turn=latest).delete()
+
+        add_entries(game_id, kind, records)
+
+def commit_turn(game_id, records):
+    '''
+    Saves a whole turn, full text and summaries, in one transaction.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    records : dict
+        The turn's records, keyed by kind.
+
+    Returns
+    -------
+    None
+    '''
+
+    with transaction.atomic():
+        for kind, kind_records in records.items():
+            add_entries(game_id, kind, kind_records)
+
+def remove_turn(game_id, turn, kinds=('full_text', 'summaries')):
+    '''
+    Removes a turn from a game - a single delete.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    turn : int | str
+        The turn to remove.
+    kinds : tuple | ('full_text', 'summaries')
+        The kinds of records to remove the turn from.
+
+    Returns
+    -------
+    None
+    '''
+
+    StoryEntry.objects.filter(game_id=game_id, kind__in=kinds, turn=str(turn)).delete()
@@ -1,15 +1,114 @@
-''' Functions for initializing a game. '''
+''' 
+Functions for initializing a game. 
+Each call's prompt starts with what it shares with the calls after it - the game's setup, then the crash story, 
+location, skills and characters as they're made - so a new game's calls read the start of their prompts from the cache.
+'''
 
 import random
 
 import config
 
-from games.prompting import prompt
+from games.prompting import PROMPTS, aprompt
 from games.utils import add_info_to_initialization_prompt
 from games.decorators import catch_and_log, retry_on_exception
 
+def describe_setup(title=None, theme=None, timeframe=None, details=None):
+    '''
+    Describes a game's setup - the start of every initialization prompt once the game has a title.
+
+    Parameters
+    ----------
+    title : str | None
+        The title of the story.
+    theme : str | None
+        The theme of the story.
+    timeframe : str | None
+        The timeframe of the story.
+    details : str | None
+        The details of the story.
+
+    Returns
+    -------
+    str
+    '''
+
+    setup = f"The title of this scenario is {title}. " if title else 'There is no specified title. '
+
+    return add_info_to_initialization_prompt(theme, timeframe, details, prompt=setup)
+
+def describe_crash(crash_story):
+    return f'The characters have just crashed, and here is the crash story: \n{crash_story}\n'
+
+def describe_location(location_description):
+    return f'The description of the starting location for the game is: \n{location_description}\n'
+
+def describe_skills(skills):
+    return f'The skills in the game are the following: \n{skills}\n'
+
+def describe_characters(characters):
+    return f'The characters in the game are the following: \n{characters}\n'
+
+def initialization_messages(context, shared, instructions, reprompted=False):
+    '''
+    Builds the message for an initialization call - the parts of the prompt it shares with the calls after it, 
+    then the call's own instructions. The shared parts are marked for caching, so the next call reads them from the cache.
+
+    Parameters
+    ----------
+    context : str
+        The call's context - its instructions from the prompts file go after the shared parts.
+    shared : list
+        The parts of the prompt shared with later calls, in order - e.g. the setup, then the crash story.
+    instructions : str
+        What to generate - the end of the prompt.
+    reprompted : bool | False
+        Whether the call is made again until its output is formatted right - then the whole prompt is cached.
+
+    Returns
+    -------
+    list
+        The message, in the LLM's format.
+    '''
+
+    content = [{'type': 'text', 'text': text} for text in shared]
+    content.append({'type': 'text', 'text': PROMPTS[context] + instructions})
+
+    if config.llm['initialization_caching']:
+        # a prompt can have 4 cache breakpoints - the system prompt, the same for every call, has one
+        ## the rest go on the latest parts - the longest starts the next calls can read
+        marked = content[-3:] if reprompted else content[:-1][-3:]
+
+        for block in marked:
+            block['cache_control'] = {'type': 'ephemeral'}
+
+    return [{'role': 'user', 'content': content}]
+
+async def prompt_initialization(messages, context, **kwargs):
+    '''
+    Prompts the LLM for an initialization call, from initialization_messages.
+    The system prompt is the main prompt alone, so it's the same for every call.
+
+    Parameters
+    ----------
+    messages : list
+        The message.
+    context : str
+        The call's context - for the usage records.
+    **kwargs
+        Passed to aprompt - e.g. max_tokens and stream.
+
+    Returns
+    -------
+    tuple | async generator
+        See aprompt.
+    '''
+
+    # the breakpoints are already on the message
+    return await aprompt(messages, caching=config.llm['initialization_caching'], stable_messages=0, 
+                         label=context, **kwargs)
+
 @retry_on_exception(max_retries=3, delay=3)
-def create_title(theme=None, timeframe=None, details=None):
+async def create_title(theme=None, timeframe=None, details=None):
     ''' 
     Creates the title of a story, given a theme, timeframe, and details.
 
@@ -31,12 +130,12 @@ def create_title(theme=None, timeframe=None, details=None):
     '''
 
     # create the prompt, using the theme and details
-    title_prompt = add_info_to_initialization_prompt(theme, timeframe, details)
-
-    title_prompt += 'Now generate the title of the scenario.'
+    messages = initialization_messages('create_scenario_title', 
+                                       [add_info_to_initialization_prompt(theme, timeframe, details)],
+                                       'Now generate the title of the scenario.')
     
     # prompt the LLM
-    title, cost = prompt(title_prompt, max_tokens=50, context='create_scenario_title', caching=False)
+    title, cost = await prompt_initialization(messages, 'create_scenario_title', max_tokens=50)
 
     # return the title and the cost to generate it
     return title, cost
@@ -86,7 +185,7 @@ def random_setup(num_details=[1, 2, 3]):
     return theme, timeframe, details
 
 @catch_and_log
-def create_crash(title=None, theme=None, timeframe=None, details=None):
+async def create_crash(title=None, theme=None, timeframe=None, details=None):
     ''' 
     Prompts an LLM for the description of the crash 
     - the first thing the player will read -
@@ -105,28 +204,23 @@ def create_crash(title=None, theme=None, timeframe=None, details=None):
 
     Returns
     -------
-    prompt : generator
+    prompt : async generator
         The generator for the crash story.
     '''
 
-    crash_prompt = (
-        f"The title of this scenario is {title}. Don't include the title in your response, please. "
-        if title else 'There is no specified title. '
-    )
-
-    # add the theme and details to the prompt
-    crash_prompt = add_info_to_initialization_prompt(theme, timeframe, details, prompt=crash_prompt)
-
-    crash_prompt += 'Now generate the opening crash scene for the game.'
+    # the setup starts every prompt from here on
+    messages = initialization_messages('create_crash', [describe_setup(title, theme, timeframe, details)],
+                                       "Don't include the title in your response, please. "
+                                       'Now generate the opening crash scene for the game.')
     
     # return the prompt function as a generator, for streaming
-    return prompt(crash_prompt, max_tokens=800, 
-                    stream=True, context='create_crash', caching=False)
+    return await prompt_initialization(messages, 'create_crash', max_tokens=800, stream=True)
 
 @retry_on_exception(max_retries=3, delay=3)
-def create_location(crash_story, title=None, theme=None, timeframe=None, details=None):
+async def create_location(crash_story, title=None, theme=None, timeframe=None, details=None):
     '''
     Prompts an LLM for the description of the location, given a crash story and other game info.
+    The name comes from a separate call (create_location_name) - nothing else has to wait for it.
 
     Parameters
     ----------
@@ -143,40 +237,49 @@ def create_location(crash_story, title=None, theme=None, timeframe=None, details
     
     Returns
     -------
-    location_name : str
-        The name of the location.
     location_description : str
         The description of the location.
-    total_cost : int
-        The total cost to generate the location name and description.
+    cost : int
+        The cost to generate the location description.
     '''
 
-    # add the title, theme, details, timeframe to the prompt
-    location_prompt = f"The title of this scenario is {title}. " if title else 'There is no specified title. '
-    location_prompt = add_info_to_initialization_prompt(theme, timeframe, details, prompt=location_prompt)
-
-    # add the crash story
-    location_prompt += f'''The characters have just crashed, and here is the crash story: 
-{crash_story}
-Now generate the starting location for the game - we don't need any intro, or filler. 
-Just the description of the location.'''
+    # add the title, theme, details, timeframe, and the crash story
+    messages = initialization_messages('create_location', 
+                                       [describe_setup(title, theme, timeframe, details), describe_crash(crash_story)],
+                                       '''Now generate the starting location for the game - we don't need any intro, or filler. 
+Just the description of the location.''')
 
     # prompt the LLM for the location description
-    location_description, description_cost = prompt(location_prompt, max_tokens=300, context='create_location', caching=False)
+    return await prompt_initialization(messages, 'create_location', max_tokens=300)
+
+@retry_on_exception(max_retries=3, delay=3)
+async def create_location_name(location_description):
+    '''
+    Prompts an LLM for the name of the location, given its description.
+
+    Parameters
+    ----------
+    location_description : str
+        The description of the location.
+
+    Returns
+    -------
+    location_name : str
+        The name of the location.
+    cost : int
+        The cost to generate the location name.
+    '''
 
-    # get a name for the location
     location_name_prompt = f'''Come up with a short, intriguing name for a location, 
 based off the following description: {location_description}. 
 Remember - this name should be very short - only a few words. 
 Something like 'The Red Forest' or 'The Crystal Caves'. Don't say anything else other than the name.'''
 
     # prompt the LLM for the location name
-    location_name, name_cost = prompt(location_name_prompt, max_tokens=20, caching=False)
-
-    return location_name, location_description, description_cost + name_cost
+    return await aprompt(location_name_prompt, max_tokens=20, caching=False, label='create_location_name')
 
 @retry_on_exception(max_retries=3, delay=3)
-def create_skills(crash_story, location_description, 
+async def create_skills(crash_story, location_description, 
                   title=None, theme=None, timeframe=None, details=None):
     '''
     Prompts an LLM for the skills needed to survive in the location, given a crash story and other game info.
@@ -206,18 +309,12 @@ def create_skills(crash_story, location_description,
         The total cost to generate the skills.
     '''
 
-    # add the title, theme, details, timeframe to the prompt
-    skills_prompt = f"The title of this scenario is {title}. " if title else 'There is no specified title. '
-    skills_prompt = add_info_to_initialization_prompt(theme, timeframe, details, prompt=skills_prompt)
-
-    # add the crash story and location
-    skills_prompt += f'''The characters have just crashed, and here is the crash story: 
-{crash_story}
-The description of the starting location for the game is: 
-{location_description}'''
-    
-    skills_prompt += '''Now generate 5-10 skills that the characters will need to survive in this location.
-    Be sure to use the format that I specified.'''
+    # add the title, theme, details, timeframe, the crash story and location
+    messages = initialization_messages('create_skills', 
+                                       [describe_setup(title, theme, timeframe, details), describe_crash(crash_story),
+                                        describe_location(location_description)],
+                                       '''Now generate 5-10 skills that the characters will need to survive in this location.
+    Be sure to use the format that I specified.''', reprompted=True)
 
     # prompt the LLM for the skills
     # sometimes it gets the formatting wrong - so we'll re-prompt until it gets it right
@@ -228,7 +325,7 @@ The description of the starting location for the game is:
     while not formatting_correct:
         attempts += 1
         # prompt the LLM for the skills
-        raw_skills, cost = prompt(skills_prompt, max_tokens=500, context='create_skills', caching=False)
+        raw_skills, cost = await prompt_initialization(messages, 'create_skills', max_tokens=500)
         # add the cost
         total_cost += cost
 
@@ -270,7 +367,7 @@ The description of the starting location for the game is:
     return skills_str, skills_list, total_cost
 
 @retry_on_exception(max_retries=3, delay=3)
-def create_characters(crash_story, location_description, skills_str,
+async def create_characters(crash_story, location_description, skills_str,
                       title=None, theme=None, timeframe=None, details=None):
     '''
     Prompts an LLM for the characters, given a crash story, location description, skills, and other game info.
@@ -304,22 +401,13 @@ def create_characters(crash_story, location_description, skills_str,
         The total cost to generate the characters.
     '''
 
-    # add the title, theme, details, timeframe to the prompt
-    characters_prompt = f"The title of this scenario is {title}. " if title else 'There is no specified title. '
-    characters_prompt = add_info_to_initialization_prompt(theme, timeframe, details, prompt=characters_prompt)
-
-    # add the crash story and location
-    characters_prompt += f'''The characters have just crashed, and here is the crash story: 
-{crash_story}
-The description of the starting location for the game is: 
-{location_description}
-The skills in the game are the following: 
-{skills_str}
-'''
-    
-    characters_prompt += '''Now generate the 3 starting characters - 
+    # add the title, theme, details, timeframe, the crash story, location and skills
+    messages = initialization_messages('create_characters', 
+                                       [describe_setup(title, theme, timeframe, details), describe_crash(crash_story),
+                                        describe_location(location_description), describe_skills(skills_str)],
+                                       '''Now generate the 3 starting characters - 
 be sure that these are consistent with any characters 
-named thus far. Be sure to use the format that I specified.'''
+named thus far. Be sure to use the format that I specified.''', reprompted=True)
 
     # prompt the LLM for the characters
     # sometimes it gets the formatting wrong - so we'll re-prompt until it gets it right
@@ -331,7 +419,7 @@ named thus far. Be sure to use the format that I specified.'''
         attempts += 1
         
         # prompt the LLM for the characters
-        raw_characters, cost = prompt(characters_prompt, max_tokens=1000, context='create_characters')
+        raw_characters, cost = await prompt_initialization(messages, 'create_characters', max_tokens=1000)
         # add the cost
         total_cost += cost
         
@@ -389,7 +477,7 @@ named thus far. Be sure to use the format that I specified.'''
     return characters_str, characters_list, total_cost
 
 @catch_and_log
-def create_wakeup(crash_story, location_description, skills, characters, 
+async def create_wakeup(crash_story, location_description, skills, characters, 
                   title=None, theme=None, timeframe=None, details=None):
     '''
     Prompts an LLM for the wakeup scene, given a crash story, 
@@ -416,28 +504,20 @@ def create_wakeup(crash_story, location_description, skills, characters,
         
     Returns
     -------
-    prompt : generator
+    prompt : async generator
         The generator for the wakeup scene.
     '''
 
-    # add the title, theme, details, timeframe to the prompt
-    wakeup_prompt = f"The title of this scenario is {title}. " if title else 'There is no specified title. '
-    wakeup_prompt = add_info_to_initialization_prompt(theme, timeframe, details, prompt=wakeup_prompt)
-
-    # add the crash story, location, skills, and characters
-    wakeup_prompt += f'''The characters have just crashed, and here is the crash story: 
-{crash_story}
-The description of the starting location for the game is: 
-{location_description}
-The skills in the game are the following: 
-{skills}
-The characters in the game are the following: 
-{characters}'''
-    
-    wakeup_prompt += '''Now generate the wakeup scene for the game. 
+    # add the title, theme, details, timeframe, the crash story, location, skills, and characters
+    ## everything but the characters was in the characters' prompt, so it's read from the cache
+    messages = initialization_messages('create_wakeup', 
+                                       [describe_setup(title, theme, timeframe, details), describe_crash(crash_story),
+                                        describe_location(location_description), describe_skills(skills),
+                                        describe_characters(characters)],
+                                       '''Now generate the wakeup scene for the game. 
 Remember that the player will read this, and it should be engaging and interesting. 
-Don't start it with a title or intro or anything - just jump right into the scene.'''
+Don't start it with a title or intro or anything - just jump right into the scene.''')
 
     # return the prompt function as a generator, for streaming
-    return prompt(wakeup_prompt, max_tokens=1000, stream=True, context='create_wakeup', caching=False)
+    return await prompt_initialization(messages, 'create_wakeup', max_tokens=1000, stream=True)
 
@@ -0,0 +1,92 @@
+'''
+The game intro - the same text for every game, apart from the characters' names.
+It's stored as a reference to its template, with the names, and expanded when it's read.
+'''
+
+
+# the intro templates, keyed by id
+## stored intros refer to these ids, so a template can't be changed or removed once it's been used - add a new one
+TEMPLATES = {
+    'v1': '''{starting_str} need your help!
+They're lost in a strange world, the unwitting and unwilling heroes of a story that they didn't want to be a part of.
+Now you - that's right, YOU - need to guide them through that story.
+
+Think of yourself as an angel (or devil), sitting on their shoulders, whispering in their ears.
+Each turn, you'll make suggestions and interact with your characters.
+
+Speaking of the characters - on the right -> of the screen, you can see more info about your characters - their histories, personalities, skills.
+Be creative, be bold, be kind, be cruel. Do whatever you like - the world is your oyster!
+
+Speaking of the right of the screen - in the bottom right you should see a button that says 'Save Key'. 
+Click it.
+
+So - what will you do next?''',
+}
+
+# the template new games use
+TEMPLATE = 'v1'
+
+
+def render_intro(names, template=TEMPLATE):
+    '''
+    Renders the game intro.
+
+    Parameters
+    ----------
+    names : list | None
+        The first names of the game's three characters. If None, they aren't named.
+    template : str | TEMPLATE
+        The id of the template.
+
+    Returns
+    -------
+    str
+        The intro.
+    '''
+
+    if not names:
+        starting_str = 'Some poor souls'
+    else:
+        starting_str = f'{names[0]}, {names[1]}, and {names[2]}'
+
+    return TEMPLATES[template].format(starting_str=starting_str)
+
+def make_intro_record(names):
+    '''
+    Creates the full_text record for the game intro - a reference to the template, rather than the text.
+
+    Parameters
+    ----------
+    names : list | None
+        The first names of the game's three characters.
+
+    Returns
+    -------
+    dict
+        The record.
+    '''
+
+    return {'writer': 'intro', 'text': '', 'turn': 'intro', 'template': TEMPLATE, 'names': names}
+
+def expand_record(item):
+    '''
+    Returns a copy of a record - with the intro's text filled in from its template, if it's an intro.
+
+    Parameters
+    ----------
+    item : dict
+        The record.
+
+    Returns
+    -------
+    dict
+        The copy.
+    '''
+
+    if 'template' not in item:
+        return dict(item)
+
+    record = {key: value for key, value in item.items() if key not in ['template', 'names']}
+    record['text'] = render_intro(item['names'], item['template'])
+
+    return record
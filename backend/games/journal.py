@@ -0,0 +1,192 @@
+''' A durable, local journal of turns waiting to be written to storage - for write-behind saving. '''
+
+import json
+import sqlite3
+import time
+import uuid
+
+import config
+
+
+# the journals whose tables have been created by this process, and their ids
+initialized = set()
+journal_ids = {}
+
+def connect():
+    '''
+    Opens a connection to the journal, creating its tables if they don't exist.
+    Each call gets its own connection, so the journal can be used from any thread.
+
+    Returns
+    -------
+    sqlite3.Connection
+    '''
+
+    path = config.file_save['journal_path']
+    connection = sqlite3.connect(path, timeout=30)
+
+    if path in initialized:
+        return connection
+
+    # write-ahead logging lets readers and the writer work at the same time
+    connection.execute('PRAGMA journal_mode=WAL')
+
+    with connection:
+        connection.execute('''CREATE TABLE IF NOT EXISTS turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_id TEXT NOT NULL,
+            records TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0
+        )''')
+        connection.execute('CREATE INDEX IF NOT EXISTS turns_game_id ON turns (game_id, id)')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+        # each journal has a unique id -
+        # the manifest records which of this journal's turns it already holds
+        connection.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('journal_id', uuid.uuid4().hex))
+
+    initialized.add(path)
+
+    return connection
+
+def get_journal_id():
+    '''
+    Returns the unique id of the journal.
+
+    Returns
+    -------
+    str
+    '''
+
+    path = config.file_save['journal_path']
+
+    # the id never changes, so it only needs to be read once
+    if path not in journal_ids:
+        connection = connect()
+        try:
+            journal_ids[path] = connection.execute("SELECT value FROM meta WHERE key = 'journal_id'").fetchone()[0]
+        finally:
+            connection.close()
+
+    return journal_ids[path]
+
+def add_turn(game_id, records):
+    '''
+    Adds a turn to the journal. Once this returns, the turn is on disk.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    records : dict
+        The turn's full_text and summaries records, keyed by type.
+
+    Returns
+    -------
+    int
+        The id of the turn in the journal.
+    '''
+
+    connection = connect()
+    try:
+        with connection:
+            cursor = connection.execute('INSERT INTO turns (game_id, records) VALUES (?, ?)',
+                                        (str(game_id), json.dumps(records)))
+        return cursor.lastrowid
+    finally:
+        connection.close()
+
+def get_pending_turns(game_id):
+    '''
+    Returns a game's turns that haven't been written to storage yet, in order.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    list
+        The turns - each a tuple of the journal id and the records, keyed by type.
+    '''
+
+    connection = connect()
+    try:
+        rows = connection.execute('SELECT id, records FROM turns WHERE game_id = ? ORDER BY id',
+                                  (str(game_id),)).fetchall()
+    finally:
+        connection.close()
+
+    return [(id, json.loads(records)) for id, records in rows]
+
+def get_due_games():
+    '''
+    Returns the games with turns that are due to be written to storage.
+
+    Returns
+    -------
+    list
+        The game ids.
+    '''
+
+    connection = connect()
+    try:
+        rows = connection.execute('SELECT DISTINCT game_id FROM turns WHERE next_attempt <= ?',
+                                  (time.time(),)).fetchall()
+    finally:
+        connection.close()
+
+    return [game_id for game_id, in rows]
+
+def remove_turns(ids):
+    '''
+    Removes turns from the journal, once they've been written to storage.
+
+    Parameters
+    ----------
+    ids : list
+        The journal ids of the turns.
+
+    Returns
+    -------
+    None
+    '''
+
+    connection = connect()
+    try:
+        with connection:
+            connection.executemany('DELETE FROM turns WHERE id = ?', [(id,) for id in ids])
+    finally:
+        connection.close()
+
+def record_failure(ids, backoff=2, max_delay=300):
+    '''
+    Records a failed attempt to write turns to storage,
+    and pushes back their next attempt - exponentially, up to a maximum delay.
+
+    Parameters
+    ----------
+    ids : list
+        The journal ids of the turns.
+    backoff : float | 2
+        The delay after the first failure, in seconds. It doubles with every failure after that.
+    max_delay : float | 300
+        The maximum delay, in seconds.
+
+    Returns
+    -------
+    None
+    '''
+
+    connection = connect()
+    try:
+        with connection:
+            for id in ids:
+                attempts, = connection.execute('SELECT attempts FROM turns WHERE id = ?', (id,)).fetchone()
+                delay = min(backoff * 2 ** attempts, max_delay)
+                connection.execute('UPDATE turns SET attempts = ?, next_attempt = ? WHERE id = ?',
+                                   (attempts + 1, time.time() + delay, id))
+    finally:
+        connection.close()
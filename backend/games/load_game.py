@@ -1,18 +1,27 @@
 ''' Functions for loading game data from the system. '''
+import copy
 import json
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import config
 
+import games.history_db as history_db
+import games.journal as journal
+from games.cache import cache, enabled as cache_enabled, records_size
+from games.codec import decode
 from games.decorators import retry_on_exception
-from games.s3 import read_object
+from games.intro import expand_record
+from games.storage import get_storage
 from games.utils import get_gamefile_listdir
 
 
 @retry_on_exception(max_retries=3, delay=2)
 def load_json(filepath):
     '''
-    Loads a json file, either from the local system or S3, determined by the environment.
+    Loads a json file from the configured storage backend.
 
     Parameters
     ----------
@@ -25,11 +34,282 @@ def load_json(filepath):
         The data in the file.
     '''
 
-    if config.ENV == 'DEV':
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    else:
-        return json.loads(read_object(config.s3['data_bucket'], filepath))
+    return json.loads(decode(get_storage().read(filepath)))
+
+def parse_records(raw):
+    '''
+    Parses the raw contents of a game text chunk into a list of records.
+    Chunks are either legacy json lists, or newline-delimited json - one record per line.
+
+    Parameters
+    ----------
+    raw : bytes
+        The raw contents of the chunk, as stored - encoded or not.
+
+    Returns
+    -------
+    list
+        The records in the chunk.
+    '''
+
+    raw = decode(raw).decode('utf-8')
+
+    # legacy chunks are a single json list
+    if raw.lstrip().startswith('['):
+        return json.loads(raw)
+
+    # otherwise, there's one record per line
+    return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+@retry_on_exception(max_retries=3, delay=2)
+def load_raw(filepath, size=None):
+    '''
+    Loads the raw contents of a file from the configured storage backend.
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the file.
+    size : int | None
+        If given, only the first size bytes are loaded.
+
+    Returns
+    -------
+    bytes
+        The contents of the file, as stored.
+    '''
+
+    if size is None:
+        return get_storage().read(filepath)
+
+    return get_storage().read_range(filepath, 0, size)
+
+def load_records(filepath, size=None):
+    '''
+    Loads the records in a game text chunk (full_text or summaries).
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the chunk.
+    size : int | None
+        The committed size of the chunk, from the manifest.
+        Anything written past it belongs to a turn that was never committed, so it isn't loaded.
+
+    Returns
+    -------
+    list
+        The records in the chunk.
+    '''
+
+    return parse_records(load_raw(filepath, size=size))
+
+@retry_on_exception(max_retries=3, delay=2)
+def load_manifest(game_id, fresh=False):
+    '''
+    Loads the manifest for a game - the record of every full_text and summaries chunk,
+    with its name, size in bytes, number of records and range of turns.
+    The manifest lets us find chunks without listing directories or downloading them.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    fresh : bool | False
+        Whether to read it from storage, rather than the cache - for saving, 
+        where a manifest another process has since replaced would lose what that process committed.
+
+    Returns
+    -------
+    dict | None
+        The manifest, keyed by type, or None if the game doesn't have one yet
+        (i.e. it was saved before manifests existed).
+    '''
+
+    # callers update the manifest they're given, so they get their own copy of the cached one
+    if not fresh:
+        manifest = cache.get((str(game_id), 'manifest'))
+        if manifest is not None:
+            return copy.deepcopy(manifest)
+
+    since = cache.now()
+
+    filepath = os.path.join(config.file_save['path'], str(game_id), 'manifest.json')
+
+    # a single read - a missing manifest comes back as None
+    data = get_storage().read_if_exists(filepath)
+
+    if data is None:
+        return None
+
+    data = decode(data)
+    manifest = json.loads(data)
+
+    # an archived game is moved back out of cold storage the first time it's loaded
+    ## imported here, since archiving uses the functions in this module
+    if manifest.get('archived'):
+        from games.archive import rehydrate_game
+        return copy.deepcopy(rehydrate_game(game_id))
+
+    # if another process has saved the game since it was cached, nothing cached for it can be built on
+    if fresh:
+        cached = cache.peek((str(game_id), 'manifest'))
+        if cached is not None and cached.get('modified') != manifest.get('modified'):
+            cache.invalidate(game_id)
+
+    if cache_enabled():
+        cache.put((str(game_id), 'manifest'), copy.deepcopy(manifest), len(data), since=since)
+
+    return manifest
+
+def list_chunks(game_id, type='full_text', manifest=None):
+    '''
+    Returns a game's chunks, in order.
+    Uses the manifest if the game has one, otherwise lists the directory.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    type : str | 'full_text'
+        The type of chunks (full_text or summaries).
+    manifest : dict | None
+        The game's manifest, if it's already been loaded.
+
+    Returns
+    -------
+    list
+        The chunks - each a dict with its name, and its committed size 
+        (None for legacy games without a manifest, where the whole chunk is used).
+    '''
+
+    if manifest is None:
+        manifest = load_manifest(game_id)
+
+    if manifest is not None:
+        return [{'name': chunk['name'], 'size': chunk['size']} for chunk in manifest[type]]
+
+    # legacy games, saved before manifests, have to be listed
+    files = get_gamefile_listdir(os.path.join(config.file_save['path'], str(game_id), type))
+
+    return [{'name': file, 'size': None} for file in files]
+
+# the pool that fetches chunks concurrently - shared by every request, and started the first time it's needed
+fetch_executor = None
+fetch_lock = threading.Lock()
+
+def reset_fetch_executor():
+    '''
+    Forgets the fetch pool - its threads don't survive into a forked child process,
+    so a new one gets started there on first use.
+
+    Returns
+    -------
+    None
+    '''
+
+    global fetch_executor, fetch_lock
+
+    fetch_executor = None
+    fetch_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_fetch_executor)
+
+def get_fetch_executor():
+    '''
+    Returns the pool that fetches chunks, starting it if it isn't running already.
+
+    Returns
+    -------
+    ThreadPoolExecutor
+    '''
+
+    global fetch_executor
+
+    with fetch_lock:
+        if fetch_executor is None:
+            fetch_executor = ThreadPoolExecutor(max_workers=config.file_save['fetch_workers'],
+                                                thread_name_prefix='fetch-chunks')
+
+        return fetch_executor
+
+def fetch_chunks(game_id, type='full_text', manifest=None, newest_first=False):
+    '''
+    Loads a game's chunks concurrently, yielding each one's records in order, as soon as it and every chunk before it have arrived.
+    On s3 every chunk is a round trip, so this keeps up to the configured number of them in flight, rather than waiting for each in turn.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    type : str | 'full_text'
+        The type of chunks (full_text or summaries).
+    manifest : dict | None
+        The game's manifest, if it's already been loaded.
+    newest_first : bool | False
+        If True, the latest chunk comes first.
+
+    Yields
+    ------
+    list
+        The records in each chunk.
+    '''
+
+    file_path = os.path.join(config.file_save['path'], str(game_id), type)
+
+    chunks = list_chunks(game_id, type=type, manifest=manifest)
+    if newest_first:
+        chunks = chunks[::-1]
+
+    yield from fetch_records(file_path, chunks)
+
+def fetch_records(file_path, chunks):
+    '''
+    Loads chunks concurrently, yielding each one's records in order - see fetch_chunks.
+
+    Parameters
+    ----------
+    file_path : str
+        The directory the chunks are in.
+    chunks : list
+        The chunks - each a dict with its name and committed size.
+
+    Yields
+    ------
+    list
+        The records in each chunk.
+    '''
+
+    in_flight = config.file_save['fetch_workers']
+
+    # nothing to gain from the pool with a single chunk
+    if in_flight <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield load_records(os.path.join(file_path, chunk['name']), size=chunk['size'])
+        return
+
+    executor = get_fetch_executor()
+    remaining = iter(chunks)
+    futures = deque()
+
+    def submit():
+        chunk = next(remaining, None)
+        if chunk is not None:
+            futures.append(executor.submit(load_records, os.path.join(file_path, chunk['name']), size=chunk['size']))
+
+    for _ in range(in_flight):
+        submit()
+
+    try:
+        # a sliding window - as the oldest chunk is handed over, the next one is requested
+        while futures:
+            records = futures.popleft().result()
+            submit()
+            yield records
+    finally:
+        # if the caller stops early, don't fetch the rest
+        for future in futures:
+            future.cancel()
 
 @retry_on_exception(max_retries=3, delay=2)
 def load_latest_file(game_id, type='full_text'):
@@ -43,18 +323,240 @@ def load_latest_file(game_id, type='full_text'):
     type : str | 'full_text'
         The type of file to load (full_text or summaries).
 
+    Returns
+    -------
+    list
+        The records in the file.
+    '''
+
+    if config.file_save['history_backend'] == 'database':
+        return history_db.load_latest_turn(game_id, kind=type)
+
+    stream = cache.get((str(game_id), type))
+    manifest = load_manifest(game_id) if stream is None else None
+
+    # legacy games, saved before manifests, have their chunks listed and read
+    if stream is None and manifest is None:
+        stream = load_stream(game_id, type=type)
+
+    if stream is not None:
+        if stream['latest']:
+            return [expand_record(item) for item in stream['records'][-stream['latest']:]]
+        return None
+
+    # otherwise, only the latest chunk needs reading
+    chunks = manifest[type]
+    if not chunks:
+        return None
+
+    data = load_records(os.path.join(config.file_save['path'], str(game_id), type, chunks[-1]['name']),
+                        size=chunks[-1]['size'])
+
+    tombstones = get_tombstones(manifest, type)
+    start = sum(chunk['records'] for chunk in chunks[:-1])
+    records = [expand_record(item) for position, item in enumerate(data, start)
+               if is_visible(tombstones, position, item)]
+
+    if records:
+        return records
+
+@retry_on_exception(max_retries=3, delay=2)
+def load_last_record(game_id, type='full_text'):
+    '''
+    Loads the last record in a game's full_text or summaries.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    type : str | 'full_text'
+        The type of record (full_text or summaries).
+
+    Returns
+    -------
+    dict | None
+        The record, or None if there aren't any.
+    '''
+
+    if config.file_save['history_backend'] == 'database':
+        records = history_db.load_latest_turn(game_id, kind=type)
+    else:
+        records = load_stream(game_id, type=type)['records']
+
+    return expand_record(records[-1]) if records else None
+
+def load_stream(game_id, type='full_text'):
+    '''
+    Loads all of a game's committed full_text or summaries records - from the cache if they're there,
+    otherwise from storage, and then caches them.
+    Saving a turn adds its records to the cached ones, so a game being played is only read from storage once.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    type : str | 'full_text'
+        The type of records (full_text or summaries).
+
     Returns
     -------
     dict
-        The data in the file.
+        The records, the number of them in the latest chunk, the number of records stored (including removed ones),
+        and the manifest's record of flushed write-behind turns.
+        It's shared with the cache, so it mustn't be changed.
     '''
 
-    file_path = os.path.join(config.file_save['path'], str(game_id), type)
+    stream = cache.get((str(game_id), type))
+    if stream is not None:
+        return stream
 
-    files = get_gamefile_listdir(file_path)
+    since = cache.now()
 
-    if files:
-        return load_json(os.path.join(file_path, files[-1]))
+    manifest = load_manifest(game_id)
+
+    # load every chunk in the game
+    chunks = list(fetch_chunks(game_id, type=type, manifest=manifest))
+
+    return cache_stream(game_id, type, manifest, chunks, since)
+
+def get_tombstones(manifest, type):
+    '''
+    Returns a game's tombstones - the turns that have been rolled back, but not yet compacted away.
+
+    Parameters
+    ----------
+    manifest : dict | None
+        The game's manifest.
+    type : str
+        The type of records (full_text or summaries).
+
+    Returns
+    -------
+    dict
+        For each rolled back turn, the position of its latest tombstone, counting every record in the stream.
+        The turn's records before that position are gone.
+    '''
+
+    tombstones = {}
+
+    for turn, position in (manifest or {}).get('tombstones', {}).get(type, []):
+        tombstones[turn] = max(tombstones.get(turn, -1), position)
+
+    return tombstones
+
+def is_visible(tombstones, position, record):
+    '''
+    Returns whether a record is part of the game - i.e. a tombstone hasn't removed it.
+
+    Parameters
+    ----------
+    tombstones : dict
+        The game's tombstones - from get_tombstones.
+    position : int
+        The position of the record, counting every record in the stream.
+    record : dict
+        The record.
+
+    Returns
+    -------
+    bool
+    '''
+
+    turn = record.get('turn')
+
+    return not (turn in tombstones and position < tombstones[turn])
+
+def cache_stream(game_id, type, manifest, chunks, since):
+    '''
+    Caches all of a game's committed full_text or summaries records, once they've been read from storage.
+    Records removed by tombstones are left out.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    type : str
+        The type of records (full_text or summaries).
+    manifest : dict | None
+        The manifest the records were read with.
+    chunks : list
+        The records in each chunk, in order.
+    since : float
+        When the read started.
+
+    Returns
+    -------
+    dict
+        The cached stream - see load_stream.
+    '''
+
+    tombstones = get_tombstones(manifest, type)
+
+    records = []
+    latest = 0
+    position = 0
+
+    for data in chunks:
+        latest = 0
+        for record in data:
+            if is_visible(tombstones, position, record):
+                records.append(record)
+                latest += 1
+            position += 1
+
+    stream = {
+        'records': records,
+        # the number of records in the latest chunk
+        'latest': latest,
+        # the number of records stored, including the ones tombstones have removed
+        'stored': position,
+        'journal': manifest.get('journal', {}) if manifest else {},
+    }
+
+    cache.put((str(game_id), type), stream, records_size(records), since=since)
+
+    return stream
+
+@retry_on_exception(max_retries=3, delay=2)
+def load_prompt_state(game_id):
+    '''
+    Loads a game's prompt state - its summaries, already fixed and converted into LLM messages,
+    apart from the latest record, which is kept to one side.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    dict | None
+        The settled messages (shared with the cache, so they mustn't be changed), and the latest record.
+        None if the game doesn't have an up to date prompt state - then, the prompt has to be built from the summaries.
+    '''
+
+    # the prompt state only covers committed turns, in files
+    if config.file_save['history_backend'] == 'database':
+        return None
+    if config.file_save['write_behind'] and journal.get_pending_turns(game_id):
+        return None
+
+    manifest = load_manifest(game_id)
+    state = manifest.get('prompt_state') if manifest else None
+
+    if not state or state['summaries'] != sum(chunk['records'] for chunk in manifest['summaries']):
+        return None
+
+    messages = load_stream(game_id, type='prompt')['records']
+
+    # if a turn was committed since the manifest was loaded, the two won't match
+    if len(messages) != sum(chunk['records'] for chunk in manifest['prompt']):
+        return None
+
+    return {
+        'messages': messages,
+        'last': state['last'],
+    }
 
 @retry_on_exception(max_retries=3, delay=2)
 def load_history(game_id, summaries=False):
@@ -71,19 +573,309 @@ def load_history(game_id, summaries=False):
 
     type = 'summaries' if summaries else 'full_text'
 
-    file_path = os.path.join(config.file_save['path'], str(game_id), type)
+    if config.file_save['history_backend'] == 'database':
+        return history_db.load_history(game_id, kind=type)
+
+    # in write-behind mode, some turns may still be waiting in the journal
+    ## read them before the committed records - if they get flushed in between, 
+    ## the committed records will have them, and they get skipped below
+    pending = journal.get_pending_turns(game_id) if config.file_save['write_behind'] else []
 
-    history = []
+    stream = load_stream(game_id, type=type)
 
-    # load every file in the directory
-    for file in get_gamefile_listdir(file_path):
-        data = load_json(os.path.join(file_path, file))
+    # copies - callers are free to change their history
+    history = [expand_record(item) for item in stream['records']]
 
-        for item in data:
-            history.append(item)
+    # then add the pending turns that haven't been flushed yet
+    if pending:
+        flushed = stream['journal'].get(journal.get_journal_id(), 0)
+
+        for id, records in pending:
+            if id > flushed:
+                history += records[type]
 
     return history
 
+def iter_history(game_id, summaries=False, newest_first=False):
+    '''
+    Yields the history of the game item by item - the first items come as soon as the leading chunks arrive,
+    rather than after the whole game has been loaded.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    summaries : bool | False
+        If True, yield the summaries, otherwise the full text.
+    newest_first : bool | False
+        If True, yield the latest items first.
+
+    Yields
+    ------
+    dict
+        The records, in order.
+    '''
+
+    type = 'summaries' if summaries else 'full_text'
+
+    if config.file_save['history_backend'] == 'database':
+        history = history_db.load_history(game_id, kind=type)
+        yield from (history[::-1] if newest_first else history)
+        return
+
+    # as in load_history, the pending write-behind turns are read first
+    pending = journal.get_pending_turns(game_id) if config.file_save['write_behind'] else []
+
+    stream = cache.get((str(game_id), type))
+
+    if stream is not None:
+        flushed = stream['journal'].get(journal.get_journal_id(), 0) if pending else 0
+    else:
+        manifest = load_manifest(game_id)
+        flushed = manifest.get('journal', {}).get(journal.get_journal_id(), 0) if pending and manifest else 0
+
+    # the pending turns come after everything else
+    pending = [record for id, records in pending if id > flushed for record in records[type]]
+
+    if newest_first:
+        yield from pending[::-1]
+
+    if stream is not None:
+        for item in (reversed(stream['records']) if newest_first else stream['records']):
+            yield expand_record(item)
+    else:
+        since = cache.now()
+
+        tombstones = get_tombstones(manifest, type)
+
+        # where each chunk starts, counting every record in the stream
+        starts = []
+        position = 0
+        for chunk in (manifest[type] if manifest else []):
+            starts.append(position)
+            position += chunk['records']
+        if newest_first:
+            starts = starts[::-1]
+
+        chunks = []
+
+        for i, data in enumerate(fetch_chunks(game_id, type=type, manifest=manifest, newest_first=newest_first)):
+            chunks.append(data)
+            start = starts[i] if starts else 0
+
+            records = [item for position, item in enumerate(data, start) if is_visible(tombstones, position, item)]
+
+            for item in (records[::-1] if newest_first else records):
+                yield expand_record(item)
+
+        # it's all been read, so it can be cached for next time
+        cache_stream(game_id, type, manifest, chunks[::-1] if newest_first else chunks, since)
+
+    if not newest_first:
+        yield from pending
+
+def find_page(turns, before=None, limit=10):
+    '''
+    Finds the turns on a page of a game's history - the turns just before a given turn.
+
+    Parameters
+    ----------
+    turns : list
+        All the game's turns, in order.
+    before : int | str | None
+        The page ends just before this turn. A number means every numbered turn before it - 
+        the turns at the start of the game (crash, wakeup, intro) come before all of them.
+        If None, the page ends with the latest turn.
+    limit : int | 10
+        The most turns on the page.
+
+    Returns
+    -------
+    int
+        The position of the page's first turn.
+    int
+        The position just after the page's last turn.
+    '''
+
+    end = len(turns)
+
+    if isinstance(before, int):
+        end = next((i for i, turn in enumerate(turns) if isinstance(turn, int) and turn >= before), end)
+    elif before is not None:
+        end = turns.index(before) if before in turns else 0
+
+    return max(end - limit, 0), end
+
+def paginate(history, before=None, limit=10):
+    '''
+    Takes a page of turns from a game's whole history.
+
+    Parameters
+    ----------
+    history : list
+        The history.
+    before : int | str | None
+        See find_page.
+    limit : int | 10
+        The most turns on the page.
+
+    Returns
+    -------
+    list
+        The items on the page.
+    int | str | None
+        The page's first turn - the cursor for the page before it. None if it's the first page.
+    '''
+
+    # group the items by turn
+    turns = []
+    items = []
+    for item in history:
+        if not turns or item.get('turn') != turns[-1]:
+            turns.append(item.get('turn'))
+            items.append([])
+        items[-1].append(item)
+
+    start, end = find_page(turns, before=before, limit=limit)
+
+    page = [item for turn_items in items[start:end] for item in turn_items]
+
+    return page, (turns[start] if start > 0 and end > start else None)
+
+def load_history_page(game_id, before=None, limit=10, summaries=False):
+    '''
+    Loads a page of a game's history - the turns just before a given turn,
+    so the player can get the latest turns straight away and page back through the rest.
+    The manifest's turn index says which chunks the page is in, so no other chunks are read.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    before : int | str | None
+        The page ends just before this turn. If None, the page ends with the latest turn.
+    limit : int | 10
+        The most turns on the page.
+    summaries : bool | False
+        If True, load the summaries, otherwise the full text.
+
+    Returns
+    -------
+    list
+        The items on the page.
+    int | str | None
+        The page's first turn - the cursor for the page before it. None if it's the first page.
+    '''
+
+    type = 'summaries' if summaries else 'full_text'
+
+    manifest = None
+    if config.file_save['history_backend'] != 'database':
+        manifest = load_manifest(game_id)
+
+    # without an index (in the database, in legacy games, or with turns still waiting in the write-behind journal)
+    ## the page is taken from the whole history
+    ## and with tombstones, until they're compacted away - positions in the index count the records they remove
+    if (manifest is None or type not in manifest.get('index', {}) or get_tombstones(manifest, type)
+            or (config.file_save['write_behind'] and journal.get_pending_turns(game_id))):
+        return paginate(load_history(game_id, summaries=summaries), before=before, limit=limit)
+
+    index = manifest['index'][type]
+    chunks = manifest[type]
+
+    start, end = find_page([entry[0] for entry in index], before=before, limit=limit)
+    if start >= end:
+        return [], None
+
+    # where each chunk starts, counting every record in the game
+    offsets = {}
+    offset = 0
+    for chunk in chunks:
+        offsets[chunk['name']] = offset
+        offset += chunk['records']
+
+    # the page runs from the start of its first turn, to the start of the turn after it
+    first = offsets[index[start][1]] + index[start][2]
+    last = offsets[index[end][1]] + index[end][2] if end < len(index) else offset
+
+    stream = cache.get((str(game_id), type))
+
+    if stream is not None:
+        page = stream['records'][first:last]
+    else:
+        # only the chunks the page is in
+        page_chunks = [chunk for chunk in chunks
+                       if offsets[chunk['name']] < last and offsets[chunk['name']] + chunk['records'] > first]
+
+        file_path = os.path.join(config.file_save['path'], str(game_id), type)
+        records = [item for data in fetch_records(file_path, page_chunks) for item in data]
+
+        base = offsets[page_chunks[0]['name']] if page_chunks else 0
+        page = records[first - base:last - base]
+
+    return [expand_record(item) for item in page], (index[start][0] if start > 0 else None)
+
+def count_history(game_id, summaries=False):
+    '''
+    Returns the number of items in a game's history, without loading it.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    summaries : bool | False
+        If True, count the summaries, otherwise the full text.
+
+    Returns
+    -------
+    int | None
+        The number of items - or None for legacy games without a manifest.
+    '''
+
+    type = 'summaries' if summaries else 'full_text'
+
+    if config.file_save['history_backend'] == 'database':
+        return history_db.count_entries(game_id, kind=type)
+
+    manifest = load_manifest(game_id)
+
+    if manifest is None:
+        return None
+
+    return sum(chunk['records'] for chunk in manifest[type])
+
+@retry_on_exception(max_retries=3, delay=2)
+def load_initialization(game_id):
+    '''
+    Loads a game's initialization data - its location, skills and characters - from the cache, 
+    or from storage if it isn't cached.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    list
+        The initialization records.
+    '''
+
+    data = cache.get((str(game_id), 'initialization'))
+
+    if data is None:
+        since = cache.now()
+        file_path = os.path.join(config.file_save['path'], str(game_id), 'initialization.json')
+
+        raw = get_storage().read_if_exists(file_path)
+
+        if raw is not None:
+            data = json.loads(decode(raw))
+        else:
+            # if the game's been archived, loading its manifest brings the file back
+            load_manifest(game_id)
+            data = load_json(file_path)
 
-    
+        cache.put((str(game_id), 'initialization'), data, records_size(data), since=since)
 
+    return [dict(item) for item in data]
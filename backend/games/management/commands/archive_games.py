@@ -0,0 +1,79 @@
+''' Moves games that haven't been played in a while to cold storage. '''
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+import config
+
+from games.archive import archive_game
+from games.models import Game
+
+
+class Command(BaseCommand):
+    help = ('Packs each game that hasn\'t been played in a while into a single compressed archive, '
+            'and removes its files. Archived games are rehydrated the next time they\'re loaded.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int,
+                            help='The games to archive. If none are given, archives every idle game.')
+        parser.add_argument('--days', type=float, default=config.file_save['archive_after_days'],
+                            help='How many days a game has to have gone unplayed to be archived.')
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running, archiving idle games every this many hours.')
+
+    def handle(self, *args, **options):
+        if config.file_save['history_backend'] == 'database':
+            self.stdout.write('The history is in the database - there are no game files to archive.')
+            return
+
+        while True:
+            self.archive(options['game_ids'], options['days'])
+
+            if options['every'] is None:
+                return
+            time.sleep(options['every'] * 60 * 60)
+
+    def archive(self, game_ids, days):
+        cutoff = timezone.now() - timedelta(days=days)
+
+        # a game's row is saved as it's set up - so a game whose row has changed since the cutoff can't be idle
+        ## the rest are checked against the time their manifest was last saved
+        games = Game.objects.filter(archived=False, modified__lt=cutoff)
+        if game_ids:
+            games = games.filter(id__in=game_ids)
+
+        totals = {}
+
+        for game_id in games.values_list('id', flat=True).iterator():
+            try:
+                results = archive_game(game_id, idle_since=cutoff.timestamp())
+            except Exception as e:
+                self.stderr.write(f'Game {game_id}: failed to archive - {e}')
+                continue
+
+            if results is None:
+                continue
+
+            self.stdout.write(f'Game {game_id}: '
+                              f'{results["objects_before"]} objects, {results["bytes_before"]} bytes, '
+                              f'{results["load_reads_before"]} reads to load -> '
+                              f'{results["objects_after"]} objects, {results["bytes_after"]} bytes, '
+                              f'{results["load_reads_after"]} reads to load '
+                              f'({results["load_reads_rehydrated"]} once rehydrated).')
+
+            for key, value in results.items():
+                totals[key] = totals.get(key, 0) + value
+            totals['games'] = totals.get('games', 0) + 1
+
+        if not totals:
+            self.stdout.write(self.style.SUCCESS('No games to archive.'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {totals["games"]} games: '
+            f'{totals["objects_before"]} -> {totals["objects_after"]} objects, '
+            f'{totals["bytes_before"] - totals["bytes_after"]} bytes saved, '
+            f'{totals["load_reads_before"]} -> {totals["load_reads_after"]} reads to load them all.'))
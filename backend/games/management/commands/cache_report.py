@@ -0,0 +1,83 @@
+''' Reports how often LLM calls read their prompts from the cache, by what the calls were for. '''
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from games.models import PromptUsage
+
+
+def cache_report(since=None):
+    '''
+    Adds up the recorded usage of LLM calls, by label.
+
+    Parameters
+    ----------
+    since : datetime | None
+        Only count calls made since this time. If None, counts every recorded call.
+
+    Returns
+    -------
+    list
+        A dict for each label - the number of calls, the tokens of each kind, and the cost -
+        with the share of input tokens read from the cache, and the share of calls that read from it at all.
+    '''
+
+    usage = PromptUsage.objects.all()
+    if since is not None:
+        usage = usage.filter(created__gte=since)
+
+    rows = (usage.values('label')
+            .annotate(calls=Count('id'),
+                      cached_calls=Count('id', filter=Q(caching=True)),
+                      hits=Count('id', filter=Q(cache_read_tokens__gt=0)),
+                      input_tokens=Sum('input_tokens'),
+                      cache_write_tokens=Sum('cache_write_tokens'),
+                      cache_read_tokens=Sum('cache_read_tokens'),
+                      output_tokens=Sum('output_tokens'),
+                      cost=Sum('cost'))
+            .order_by('label'))
+
+    report = []
+
+    for row in rows:
+        total_input = row['input_tokens'] + row['cache_write_tokens'] + row['cache_read_tokens']
+
+        report.append({
+            **row,
+            'read_rate': round(row['cache_read_tokens'] / total_input, 3) if total_input else None,
+            'hit_rate': round(row['hits'] / row['calls'], 3),
+        })
+
+    return report
+
+
+class Command(BaseCommand):
+    help = ('Reports how much of each kind of LLM call\'s input was read from the prompt cache - '
+            'from the usage recorded with LLM_RECORD_USAGE.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None,
+                            help='Only report on calls made in the last this many days. If not given, reports on every call.')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days']) if options['days'] is not None else None
+
+        report = cache_report(since=since)
+
+        if not report:
+            self.stdout.write(self.style.SUCCESS('No LLM calls recorded.'))
+            return
+
+        for row in report:
+            self.stdout.write(f'{row["label"] or "(none)"}: {row["calls"]} calls ({row["cached_calls"]} caching), '
+                              f'{row["hits"]} read from the cache ({row["hit_rate"]:.1%}) - '
+                              f'input {row["input_tokens"]} uncached, {row["cache_write_tokens"]} written, '
+                              f'{row["cache_read_tokens"]} read '
+                              f'({row["read_rate"] or 0:.1%} read from the cache), '
+                              f'output {row["output_tokens"]}, ${row["cost"]:.4f}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(row["calls"] for row in report)} calls, ${sum(row["cost"] for row in report):.4f} in total.'))
@@ -0,0 +1,37 @@
+''' Folds games' tombstones - turns that have been rolled back - into their chunks. '''
+
+from django.core.management.base import BaseCommand
+
+from games.load_game import load_manifest
+from games.models import Game
+from games.save_game import compact_tombstones
+
+
+class Command(BaseCommand):
+    help = ('Rewrites the chunks that hold rolled back turns without them, and clears the games\' tombstones. '
+            'Run it while the games aren\'t being played.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int,
+                            help='The games to compact. If none are given, compacts every game.')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['game_ids']:
+            games = games.filter(id__in=options['game_ids'])
+
+        compacted = 0
+        total = 0
+
+        for game_id in games.values_list('id', flat=True).iterator():
+            manifest = load_manifest(game_id)
+            if not manifest or not manifest.get('tombstones'):
+                continue
+
+            removed = compact_tombstones(game_id)
+
+            compacted += 1
+            total += removed
+            self.stdout.write(f'Game {game_id}: removed {removed} records.')
+
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted} games, removing {total} records.'))
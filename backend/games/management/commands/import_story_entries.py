@@ -0,0 +1,46 @@
+''' Imports games' full text and summaries from files into the database. '''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from games.intro import expand_record
+from games.load_game import load_stream
+from games.models import Game, StoryEntry
+
+
+class Command(BaseCommand):
+    help = ('Imports games\' full text and summaries from files into the database, '
+            'for use with the database history backend. Safe to run more than once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('game_ids', nargs='*', type=int,
+                            help='The games to import. If none are given, imports every game.')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['game_ids']:
+            games = games.filter(id__in=options['game_ids'])
+
+        total = 0
+
+        for game_id in games.values_list('id', flat=True).iterator():
+            entries = []
+
+            for kind in ['full_text', 'summaries']:
+                # records removed by tombstones are left out, and the intro's text is filled in
+                records = [expand_record(record) for record in load_stream(game_id, type=kind)['records']]
+
+                entries += [
+                    StoryEntry(game_id=game_id, kind=kind, position=position,
+                               turn=str(record.get('turn', '')), writer=record['writer'], text=record['text'])
+                    for position, record in enumerate(records)
+                ]
+
+            # entries that were already imported are skipped
+            with transaction.atomic():
+                StoryEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+            total += len(entries)
+            self.stdout.write(f'Game {game_id}: {len(entries)} entries.')
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {total} entries from {games.count()} games.'))
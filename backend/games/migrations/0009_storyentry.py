@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0008_game_turns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('turn', models.CharField(max_length=20)),
+                ('writer', models.CharField(max_length=20)),
+                ('kind', models.CharField(max_length=20)),
+                ('position', models.IntegerField()),
+                ('text', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='story_entries', to='games.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['game', 'kind', 'position'], name='story_entry_history')],
+                'constraints': [models.UniqueConstraint(fields=('game', 'turn', 'writer', 'kind'), name='unique_story_entry')],
+            },
+        ),
+    ]
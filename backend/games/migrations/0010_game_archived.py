@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0009_storyentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+    ]
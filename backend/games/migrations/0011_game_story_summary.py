@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0010_game_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='story_summary',
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0011_game_story_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=100)),
+                ('caching', models.BooleanField(default=False)),
+                ('input_tokens', models.IntegerField(default=0)),
+                ('output_tokens', models.IntegerField(default=0)),
+                ('cache_write_tokens', models.IntegerField(default=0)),
+                ('cache_read_tokens', models.IntegerField(default=0)),
+                ('cost', models.FloatField(default=0.0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['label', 'created'], name='prompt_usage_label')],
+            },
+        ),
+    ]
@@ -47,6 +47,14 @@ class Game(models.Model):
     # word count - the total word count of the game
     word_count = models.IntegerField(default=0)
 
+    # whether the game's files have been moved to cold storage, as a single archive
+    ## they're moved back the next time the game is loaded
+    archived = models.BooleanField(default=False)
+
+    # the older part of the story, summarized - so the main loop prompt doesn't grow with every turn
+    ## every few turns' summaries are folded into an act, and the older acts into a single arc
+    story_summary = models.JSONField(null=True)
+
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
@@ -97,3 +105,69 @@ class Skill(models.Model):
 
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
+
+
+class StoryEntry(models.Model):
+    ''' 
+    A single entry in a game's story - a piece of full text, or a summary.
+    Used when the game history is stored in the database, rather than in files.
+    '''
+
+    game = models.ForeignKey('Game', on_delete=models.CASCADE, related_name='story_entries')
+
+    # the turn - a number for turns in the main loop, or 'crash', 'wakeup' or 'intro' at the start of the game
+    turn = models.CharField(max_length=20)
+
+    # who wrote it - 'user', 'ai' or 'intro'
+    writer = models.CharField(max_length=20)
+
+    # the kind of entry - 'full_text' or 'summaries'
+    kind = models.CharField(max_length=20)
+
+    # the order of the entry within its kind
+    position = models.IntegerField()
+
+    text = models.TextField()
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'turn', 'writer', 'kind'], name='unique_story_entry'),
+        ]
+        indexes = [
+            # loading a game's history is a single scan of this index
+            models.Index(fields=['game', 'kind', 'position'], name='story_entry_history'),
+        ]
+
+
+class PromptUsage(models.Model):
+    ''' 
+    The token usage of a single LLM call.
+    Used to see how often the prompt cache is hit, and what it saves - see the cache_report command.
+    '''
+
+    # what the call was for - its context (e.g. 'main_loop'), or a label given to it
+    label = models.CharField(max_length=50)
+
+    model = models.CharField(max_length=100)
+
+    # whether the call used prompt caching
+    caching = models.BooleanField(default=False)
+
+    # the input tokens that weren't read from or written to the cache
+    input_tokens = models.IntegerField(default=0)
+    output_tokens = models.IntegerField(default=0)
+    # the input tokens written to the cache, and read from it
+    cache_write_tokens = models.IntegerField(default=0)
+    cache_read_tokens = models.IntegerField(default=0)
+
+    cost = models.FloatField(default=0.0)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the report groups the calls by label, over a time range
+            models.Index(fields=['label', 'created'], name='prompt_usage_label'),
+        ]
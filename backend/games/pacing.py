@@ -0,0 +1,227 @@
+''' Paced sending of server-sent events - spread out over time by a background thread, rather than by sleeping on a request thread. '''
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from django_eventstream import send_event
+
+from games.storage import run_in_background
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sender:
+    '''
+    A background thread that calls functions at scheduled times.
+    One is shared by the whole process - see get_sender.
+    '''
+
+    def __init__(self):
+        # the scheduled calls - a heap of (time, sequence number, function)
+        self.scheduled = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name='paced-sender', daemon=True)
+        self.thread.start()
+
+    def call_at(self, when, function):
+        '''
+        Schedules a function to be called.
+
+        Parameters
+        ----------
+        when : float
+            When to call it, from time.monotonic().
+        function : callable
+            The function - called with no arguments.
+
+        Returns
+        -------
+        None
+        '''
+
+        with self.condition:
+            heapq.heappush(self.scheduled, (when, next(self.counter), function))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                # wait until the earliest call is due - or something earlier is scheduled
+                while not self.scheduled or self.scheduled[0][0] > time.monotonic():
+                    timeout = self.scheduled[0][0] - time.monotonic() if self.scheduled else None
+                    self.condition.wait(timeout)
+
+                _, _, function = heapq.heappop(self.scheduled)
+
+            # sending an event can touch the database
+            try:
+                run_in_background(function)
+            except Exception:
+                logger.exception('Error in a paced send.')
+
+
+class PacedStream:
+    '''
+    Sends events to a channel one at a time, spaced out by an interval.
+    Events can be added as soon as they're ready - the first one goes out straight away (after the delay),
+    and the rest follow at the interval. So the time to the first event doesn't depend on how many there are.
+    '''
+
+    def __init__(self, channel, interval, delay=0):
+        self.channel = channel
+        self.interval = interval
+
+        # when the next event goes out
+        self.next = time.monotonic() + delay
+
+        # set once the events have all been sent - with the waiting views' callbacks, to wake them up
+        self.done = False
+        self.waiters = []
+        self.lock = threading.Lock()
+        self.failed = False
+        self.cancelled = False
+
+    def send(self, data):
+        '''
+        Schedules an event to be sent, after the ones already scheduled.
+
+        Parameters
+        ----------
+        data : dict
+            The event's data.
+
+        Returns
+        -------
+        None
+        '''
+
+        self.next = max(self.next, time.monotonic())
+        get_sender().call_at(self.next, lambda: self.send_now(data))
+        self.next += self.interval
+
+    def send_now(self, data):
+        if self.cancelled or self.failed:
+            return
+
+        try:
+            send_event(self.channel, 'message', data)
+        except Exception:
+            logger.exception(f'Error sending paced event to {self.channel}')
+            self.failed = True
+
+    def close(self):
+        '''
+        Marks the end of the events - done is set once they've all been sent.
+
+        Returns
+        -------
+        None
+        '''
+
+        get_sender().call_at(max(self.next - self.interval, time.monotonic()), self.finish)
+
+    def cancel(self):
+        '''
+        Stops sending - events that haven't gone out yet are dropped.
+
+        Returns
+        -------
+        None
+        '''
+
+        self.cancelled = True
+        self.finish()
+
+    def finish(self):
+        with self.lock:
+            self.done = True
+            waiters, self.waiters = self.waiters, []
+
+        for waiter in waiters:
+            waiter()
+
+    async def wait(self, timeout=None):
+        '''
+        Waits until all the events have been sent - without holding a thread, as the sends are on the sender's.
+
+        Parameters
+        ----------
+        timeout : float | None
+            The longest to wait, in seconds.
+
+        Returns
+        -------
+        bool
+            Whether they were all sent successfully.
+        '''
+
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+
+        with self.lock:
+            if self.done:
+                wake()
+            else:
+                self.waiters.append(wake)
+
+        try:
+            await asyncio.wait_for(finished, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # a view that's stopped waiting can't be woken up
+            with self.lock:
+                if wake in self.waiters:
+                    self.waiters.remove(wake)
+
+        return not self.failed and not self.cancelled
+
+
+# the sender thread - started the first time it's needed
+sender = None
+sender_lock = threading.Lock()
+
+def reset():
+    '''
+    Forgets the sender - its thread doesn't survive into a forked child process,
+    so a new one gets started there on first use.
+
+    Returns
+    -------
+    None
+    '''
+
+    global sender, sender_lock
+
+    sender = None
+    sender_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset)
+
+def get_sender():
+    '''
+    Returns the process's sender, starting it if it isn't running already.
+
+    Returns
+    -------
+    Sender
+    '''
+
+    global sender
+
+    with sender_lock:
+        if sender is None:
+            sender = Sender()
+
+        return sender
@@ -0,0 +1,224 @@
+'''
+The prompt state of a game - its summaries, already fixed and converted into LLM messages.
+It's moved on as each turn is saved, so building the main loop prompt doesn't have to reprocess the whole game.
+Each message carries an estimate of its tokens, worked out once as it's settled - so the prompt can be kept within a budget.
+'''
+
+import math
+
+
+# a rough number of characters per token - the provider's tokenizer isn't available offline
+## the estimates keep the prompt within its budget, so this errs on the side of more tokens
+CHARS_PER_TOKEN = 3.5
+# the tokens each message takes up, on top of its text
+MESSAGE_TOKENS = 4
+# a rough number of tokens per word of english
+TOKENS_PER_WORD = 4 / 3
+
+
+def estimate_tokens(text):
+    '''
+    Estimates the number of tokens in some text.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+
+    Returns
+    -------
+    int
+    '''
+
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def words_to_tokens(words, margin=1.5):
+    '''
+    Estimates the most tokens a response of a given length needs - for max_tokens.
+
+    Parameters
+    ----------
+    words : int
+        The longest the response should be, in words.
+    margin : float | 1.5
+        How much longer than that the response can be, before it's cut off.
+
+    Returns
+    -------
+    int
+    '''
+
+    return math.ceil(words * TOKENS_PER_WORD * margin)
+
+def to_message(item):
+    '''
+    Converts a record into an LLM message.
+
+    Parameters
+    ----------
+    item : dict
+        The record - with the writer and text.
+
+    Returns
+    -------
+    dict
+        The message - with an estimate of its tokens, which is left out when it's sent to the LLM.
+    '''
+
+    return {
+        'role': 'assistant' if item['writer'] == 'ai' else 'user',
+        'content': [
+            {
+                'type': 'text',
+                'text': item['text'],
+            }
+        ],
+        'tokens': estimate_tokens(item['text']) + MESSAGE_TOKENS,
+    }
+
+def message_tokens(message):
+    '''
+    Returns the estimated tokens of an LLM message - as it was worked out when the message was made, if it was.
+
+    Parameters
+    ----------
+    message : dict
+        The message.
+
+    Returns
+    -------
+    int
+    '''
+
+    # messages settled before there were estimates don't have one
+    if 'tokens' in message:
+        return message['tokens']
+
+    return sum(estimate_tokens(block.get('text', '')) for block in message['content']) + MESSAGE_TOKENS
+
+def fixed_message(item):
+    '''
+    Converts a record into an LLM message, the way fix_summary_history would leave it - empty text becomes 'continue'.
+
+    Parameters
+    ----------
+    item : dict
+        The record.
+
+    Returns
+    -------
+    dict
+        The message.
+    '''
+
+    return to_message({'writer': item['writer'], 'text': item['text'] or 'continue'})
+
+def advance(last, records):
+    '''
+    Moves the prompt state on by some new summaries records.
+    A record can only be settled once we know the record after it -
+    the LLM can't take two messages in a row from the same writer, so the first of them is dropped.
+    So the latest record is kept to one side, unconverted.
+
+    Parameters
+    ----------
+    last : dict | None
+        The latest record in the prompt state, not yet settled.
+    records : list
+        The new records.
+
+    Returns
+    -------
+    list
+        The newly settled messages.
+    dict | None
+        The new latest record.
+    '''
+
+    settled = []
+
+    for record in records:
+        if last is not None and last['writer'] != record['writer']:
+            settled.append(fixed_message(last))
+        last = record
+
+    return settled, last
+
+def build_messages(messages, last, full_text, user_message, pending=()):
+    '''
+    Builds the main loop prompt from the prompt state.
+    Gives the same messages as fixing the summaries, with the last AI summary replaced by the full text,
+    and the user's message on the end.
+
+    Parameters
+    ----------
+    messages : list
+        The settled messages in the prompt state. Not changed.
+    last : dict | None
+        The latest summaries record.
+    full_text : dict
+        The last full text AI response - it replaces the last AI summary.
+    user_message : dict
+        The user's message.
+    pending : list | ()
+        Records standing in for summaries that haven't been saved yet - they come after the latest summaries record.
+
+    Returns
+    -------
+    list
+        The messages.
+    '''
+
+    tail = ([last] if last is not None else []) + list(pending)
+
+    # the last AI summary is replaced by the full text
+    if tail and tail[-1]['writer'] == 'ai':
+        tail = tail[:-1]
+    tail += [full_text, user_message]
+
+    tail = [item for i, item in enumerate(tail)
+            if i == len(tail) - 1 or item['writer'] != tail[i + 1]['writer']]
+
+    return messages + [fixed_message(item) for item in tail]
+
+def fit_to_budget(messages, budget, keep=2, step=1):
+    '''
+    Drops the oldest messages until the rest fit within a token budget.
+    The latest messages are always kept, and the messages still start with the user's.
+    Dropping them a step at a time keeps the start of the prompt the same from one turn to the next - 
+    so its cache can still be read - until another step has to go.
+
+    Parameters
+    ----------
+    messages : list
+        The LLM messages. Not changed.
+    budget : int
+        The most tokens the messages should take up.
+    keep : int | 2
+        The number of latest messages to keep, whatever their size - e.g. the last full text, and the user's message.
+    step : int | 1
+        The number of messages to drop at a time.
+
+    Returns
+    -------
+    list
+        The messages that fit.
+    int
+        Their estimated tokens.
+    '''
+
+    tokens = [message_tokens(message) for message in messages]
+    total = sum(tokens)
+    start = 0
+
+    while total > budget and start < len(messages) - keep:
+        end = min(start + step, len(messages) - keep)
+        total -= sum(tokens[start:end])
+        start = end
+
+    # the LLM won't take a conversation that starts with its own message
+    while start < len(messages) - 1 and messages[start]['role'] != 'user':
+        total -= tokens[start]
+        start += 1
+
+    return messages[start:], total
@@ -1,10 +1,14 @@
 
 ''' Contains functions for prompting the LLM API. '''
 
+import asyncio
 import logging
 import os
+import threading
+import weakref
 
 import anthropic
+import httpx
 from anthropic.lib.streaming._prompt_caching_beta_types import MessageStopEvent as CacheMessageStopEvent
 from anthropic.lib.streaming._prompt_caching_beta_types import TextEvent as CacheTextEvent
 from anthropic.lib.streaming._types import MessageStopEvent as MessageStopEvent
@@ -13,6 +17,9 @@ from anthropic.lib.streaming._types import TextEvent as TextEvent
 import config
 
 from games.model_prices import calculate_price
+from games.models import PromptUsage
+from games.prompt_state import to_message
+from games.storage import run_io
 from games.utils import load_yaml
 
 
@@ -25,38 +32,155 @@ PROVIDER = config.llm['provider']
 # load in the pre-written prompts, specific to that provider
 PROMPTS = load_yaml(os.path.join(config.llm['prompts_path'], f'{config.llm["provider"].lower()}.yaml'))
 
-def prompt(message, 
-           context=None, 
-           system=None, 
-           stream=False, 
-           client=None,
-           max_tokens=1024, 
-           caching=True, 
-           ):
-    ''' 
-    Prompts the LLM API with a message.
+# the client is created once per process, and shared between threads
+## it keeps a pool of open connections - so reusing it saves the TLS handshake on every call
+shared_client = None
+client_lock = threading.Lock()
 
-    Parameters
-    ----------
-    message : str | list
-        The message to prompt with. If a list, then it's a list of dictionaries
-        with the writer and text of the message in each. 
-        If it's a string, then it's just a message.
-    context : str | None
-        The context of the game in which the prompt is being made.
-    system : str | None
-        Additional system text to add to the prompt.
-    stream : bool | False
-        Whether to stream the prompt.
-    client : anthropic.Anthropic | None
-        The client to use for the prompt.
-    max_tokens : int | 1024
-        The maximum number of tokens to output.
-    caching : bool | True
-        Whether to use prompt caching.
+# async clients are shared by everything running on the same event loop - their connections belong to it
+async_clients = weakref.WeakKeyDictionary()
+
+# how many requests have been made, and how many of them had to open a new connection
+connection_stats = {'requests': 0, 'new_connections': 0}
+stats_lock = threading.Lock()
+
+def reset_clients():
+    '''
+    Drops the shared clients and their connection stats, so new ones get created on next use.
+    Runs automatically in a forked child process - 
+    the parent's connections can't safely be shared with it.
+
+    Returns
+    -------
+    None
+    '''
+
+    global shared_client, client_lock, async_clients, stats_lock
+
+    shared_client = None
+    async_clients = weakref.WeakKeyDictionary()
+    # the locks could have been held by another thread at the moment of the fork
+    client_lock = threading.Lock()
+    stats_lock = threading.Lock()
+
+    connection_stats.update(requests=0, new_connections=0)
+
+os.register_at_fork(after_in_child=reset_clients)
+
+def count_connection(name, info):
+    # called by httpcore as it handles a request - a tcp connection is only made when there isn't one to reuse
+    if name == 'connection.connect_tcp.complete':
+        with stats_lock:
+            connection_stats['new_connections'] += 1
+
+async def acount_connection(name, info):
+    count_connection(name, info)
+
+def count_request(request):
+    with stats_lock:
+        connection_stats['requests'] += 1
+    request.extensions['trace'] = count_connection
+
+async def acount_request(request):
+    with stats_lock:
+        connection_stats['requests'] += 1
+    request.extensions['trace'] = acount_connection
+
+def get_connection_stats():
+    '''
+    Returns how many LLM requests this process has made, and how many of them reused an open connection.
+
+    Returns
+    -------
+    dict
+        The requests, new connections, reused connections and the fraction reused.
+    '''
+
+    with stats_lock:
+        requests = connection_stats['requests']
+        new_connections = connection_stats['new_connections']
+
+    return {
+        'requests': requests,
+        'new_connections': new_connections,
+        'reused_connections': max(requests - new_connections, 0),
+        'reuse_rate': round(max(requests - new_connections, 0) / requests, 3) if requests else None,
+    }
+
+def client_options():
+    '''
+    Returns the options for the LLM clients - connection pool size, keep-alive, timeouts and retries.
+
+    Returns
+    -------
+    dict
+    '''
+
+    return {
+        'limits': httpx.Limits(max_connections=config.llm['max_connections'],
+                               max_keepalive_connections=config.llm['max_keepalive_connections'],
+                               keepalive_expiry=config.llm['keepalive_expiry']),
+        'timeout': httpx.Timeout(config.llm['read_timeout'], connect=config.llm['connect_timeout']),
+    }
+
+def get_client():
+    '''
+    Returns the LLM client shared by the whole process, creating it if it doesn't exist yet.
+
+    Returns
+    -------
+    anthropic.Anthropic
+    '''
+
+    global shared_client
+
+    with client_lock:
+        if shared_client is None:
+            options = client_options()
+            shared_client = anthropic.Anthropic(
+                api_key=config.llm['api_key'],
+                timeout=options['timeout'],
+                max_retries=config.llm['max_retries'],
+                http_client=anthropic.DefaultHttpxClient(limits=options['limits'], timeout=options['timeout'],
+                                                         event_hooks={'request': [count_request]}),
+            )
+
+        return shared_client
+
+def get_async_client():
+    '''
+    Returns the async LLM client for the running event loop, creating it if it doesn't exist yet.
+    Must be called from a coroutine.
+
+    Returns
+    -------
+    anthropic.AsyncAnthropic
+    '''
+
+    loop = asyncio.get_running_loop()
+
+    with client_lock:
+        if loop not in async_clients:
+            options = client_options()
+            async_clients[loop] = anthropic.AsyncAnthropic(
+                api_key=config.llm['api_key'],
+                timeout=options['timeout'],
+                max_retries=config.llm['max_retries'],
+                http_client=anthropic.DefaultAsyncHttpxClient(limits=options['limits'], timeout=options['timeout'],
+                                                              event_hooks={'request': [acount_request]}),
+            )
+
+        return async_clients[loop]
+
+def build_system_prompt(context=None, system=None):
+    '''
+    Builds the system prompt for an LLM call - see prompt for the parameters.
+
+    Returns
+    -------
+    str
     '''
 
-    ## generate system prompt
     # the main prompt is always added to the system
     system_prompt = PROMPTS['main']
 
@@ -69,6 +193,21 @@ def prompt(message,
     if system:
         system_prompt += system
 
+    return system_prompt
+
+def build_parameters(message, context=None, system=None, max_tokens=1024, caching=True, stable_messages=None):
+    '''
+    Builds the parameters for an LLM call - the model, system prompt and messages, with cache control if caching.
+    See prompt for the parameters.
+
+    Returns
+    -------
+    dict
+        The parameters for the LLM call.
+    '''
+
+    system_prompt = build_system_prompt(context=context, system=system)
+
 
     ## format the message
     # if message is just a string, then send it as a user message
@@ -86,104 +225,217 @@ def prompt(message,
         ]
     # if message is a list, then there will be some ai (assistant) messages, some user messages
     elif type(message) == list:
-        messages = []
-        for item in message:
-            messages.append({
-                'role': 'assistant' if item['writer'] == 'ai' else 'user',
-                'content': [
-                    {
-                        'type': 'text',
-                        'text': item['text']
-                    }
-                ]
-            })
+        messages = [item if 'role' in item else to_message(item) for item in message]
+        # the messages' token estimates aren't part of the LLM's format
+        messages = [{'role': item['role'], 'content': item['content']} for item in messages]
 
 
         # setup caching
         if caching:
-            try:
+            if stable_messages is None:
                 # we set the 3rd from last and 5th from last with cache control
                 ## we do this because, in the main loop, we don't want to cache the penultimate message
                 ## because it is a full text message, while all the others are summaries
                 ## we pass the full text message for continuity's sake, and to show the 
                 ## LLM an example of the full text
                 ## next turn, it will be replaced by its summary
-                messages[-3]['content'][0]['cache_control'] = {"type": "ephemeral"}
-                messages[-5]['content'][0]['cache_control'] = {"type": "ephemeral"}
+                breakpoints = [-3, -5]
+            else:
+                # the cache is written at the end of the messages that will be the same next call -
+                ## and read where the calls one and two turns ago wrote it (two, if a summary was still being written then)
+                breakpoints = [i for i in [stable_messages - 1, stable_messages - 3, stable_messages - 5] if i >= 0]
+
+            try:
+                # the messages may be shared (e.g. from the prompt state), so they're copied, not changed
+                for i in breakpoints:
+                    messages[i] = {**messages[i], 
+                                   'content': [{**messages[i]['content'][0], 'cache_control': {"type": "ephemeral"}}]}
             except IndexError:
                 pass
 
+    # define the parameters for the LLM call
+    parameters = {
+        'model': config.llm['model'],
+        'max_tokens': max_tokens,
+        'system': [
+            {
+                'type': 'text',
+                'text': system_prompt,
+            }
+        ],
+        'messages': messages
+    }
+
+    # if we're caching, then we want to cache the whole system prompt
+    # the system prompt doesn't change while we're in the main loop of the game
+    ## so we definitely want to cache it
+    if caching:
+        parameters['system'][0]['cache_control'] = {"type": "ephemeral"}
+
+    return parameters
+
+def get_cost(usage, caching=True):
+    '''
+    Calculates the cost of an LLM call from its token usage.
+
+    Parameters
+    ----------
+    usage : anthropic usage
+        The usage data of the message.
+    caching : bool | True
+        Whether the call used prompt caching - if so, the usage has cache tokens too.
+
+    Returns
+    -------
+    float
+        The cost.
+    '''
+
+    tokens = {
+        'input_tokens': usage.input_tokens,
+        'output_tokens': usage.output_tokens,
+    }
+
+    if caching:
+        tokens['cache_input_tokens'] = usage.cache_creation_input_tokens
+        tokens['cache_read_tokens'] = usage.cache_read_input_tokens
+
+    return calculate_price(config.llm['model'], tokens, caching=caching)
+
+def count_input_tokens(usage):
+    '''
+    Counts all the input tokens of an LLM call - those read from and written to the prompt cache included.
+
+    Parameters
+    ----------
+    usage : anthropic usage
+        The usage data of the message.
+
+    Returns
+    -------
+    int
+    '''
+
+    return (usage.input_tokens + (getattr(usage, 'cache_creation_input_tokens', None) or 0)
+            + (getattr(usage, 'cache_read_input_tokens', None) or 0))
+
+def record_usage(usage, label=None, caching=True, cost=0):
+    '''
+    Records the token usage of an LLM call, for the cache report (python manage.py cache_report).
+    A failure is logged, rather than failing the call.
+
+    Parameters
+    ----------
+    usage : anthropic usage
+        The usage data of the message.
+    label : str | None
+        What the call was for.
+    caching : bool | True
+        Whether the call used prompt caching.
+    cost : float | 0
+        The cost of the call.
+
+    Returns
+    -------
+    None
+    '''
+
+    if not config.llm['record_usage']:
+        return
+
+    try:
+        PromptUsage.objects.create(
+            label=label or '',
+            model=config.llm['model'],
+            caching=caching,
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cache_write_tokens=(getattr(usage, 'cache_creation_input_tokens', None) or 0) if caching else 0,
+            cache_read_tokens=(getattr(usage, 'cache_read_input_tokens', None) or 0) if caching else 0,
+            cost=cost,
+        )
+    except Exception:
+        logger.exception(f'Error recording the usage of an LLM call ({label})')
+
+def log_call(stream, caching):
+    stats = get_connection_stats()
+    logger.info(f'Calling Anthropic API with stream={stream} and caching={caching} '
+                f'(connections reused so far: {stats["reused_connections"]}/{stats["requests"]})')
+
+def prompt(message, 
+           context=None, 
+           system=None, 
+           stream=False, 
+           client=None,
+           max_tokens=1024, 
+           caching=True, 
+           stable_messages=None,
+           label=None,
+           ):
+    ''' 
+    Prompts the LLM API with a message.
+
+    Parameters
+    ----------
+    message : str | list
+        The message to prompt with. If a list, then it's a list of dictionaries
+        with the writer and text of the message in each - or messages that are already 
+        in the LLM's format, with a role and content, which are used as they are.
+        If it's a string, then it's just a message.
+    context : str | None
+        The context of the game in which the prompt is being made.
+    system : str | None
+        Additional system text to add to the prompt.
+    stream : bool | False
+        Whether to stream the prompt.
+    client : anthropic.Anthropic | None
+        The client to use for the prompt. If None, the shared client is used.
+    max_tokens : int | 1024
+        The maximum number of tokens to output.
+    caching : bool | True
+        Whether to use prompt caching.
+    stable_messages : int | None
+        The number of messages at the start of the list that the next call will start with too -
+        the cache breakpoints are put at the end of them. If None, the breakpoints go on the 3rd and 5th from last messages.
+    label : str | None
+        What the call is for, in the usage records. If None, the context.
+    '''
+
+    label = label or context
+
     # prompting from anthropic
     if PROVIDER == 'ANTHROPIC':
 
-        # set up the client
+        # use the shared client, so its open connections get reused
         if not client:
-            client = anthropic.Anthropic(api_key=config.llm['api_key'])
+            client = get_client()
         
-        # define the parameters for the LLM call
-        parameters = {
-            'model': config.llm['model'],
-            'max_tokens': max_tokens,
-            'system': [
-                {
-                    'type': 'text',
-                    'text': system_prompt,
-                }
-            ],
-            'messages': messages
-        }
-
-        # if we're caching, then we want to cache the whole system prompt
-        # the system prompt doesn't change while we're in the main loop of the game
-        ## so we definitely want to cache it
-        if caching:
-            parameters['system'][0]['cache_control'] = {"type": "ephemeral"}
-
-        logger.info(f'Calling Anthropic API with stream={stream} and caching={caching}')
+        parameters = build_parameters(message, context=context, system=system, 
+                                      max_tokens=max_tokens, caching=caching, stable_messages=stable_messages)
 
+        log_call(stream, caching)
 
         # if we're streaming the prompt
         # then return prompt_stream, which is a generator function
         if stream:
             return prompt_stream(parameters, client, 
                                  caching=caching,
+                                 label=label,
                                  )
         else:
             if caching:
                 message = client.beta.prompt_caching.messages.create(**parameters)
-
-                # get the output text and usage data
-                text = message.content[0].text
-                usage = message.usage
-
-                # calculate the cost of the message
-                tokens = {
-                        'input_tokens': usage.input_tokens,
-                        'output_tokens': usage.output_tokens,
-                        'cache_input_tokens': usage.cache_creation_input_tokens,
-                        'cache_read_tokens': usage.cache_read_input_tokens
-                    }
-                cost = calculate_price(config.llm['model'], tokens, caching=True)
-                # return the text and the cost
-                return text, cost
             else:
                 message = client.messages.create(**parameters)
-                
-                # get the output text and usage data
-                text = message.content[0].text
-                usage = message.usage
-
-                # calculate the cost of the message
-                tokens = {
-                        'input_tokens': usage.input_tokens,
-                        'output_tokens': usage.output_tokens,
-                    }
-                cost = calculate_price(config.llm['model'], tokens, caching=False)
-                # return the text and the cost
-                return text, cost
+
+            cost = get_cost(message.usage, caching=caching)
+            record_usage(message.usage, label=label, caching=caching, cost=cost)
+
+            # return the output text and the cost of the message
+            return message.content[0].text, cost
 
 def prompt_stream(parameters, client, 
-                  caching=True):
+                  caching=True, label=None):
     ''' 
     Given parameters and a client, makes a streaming LLM call.
 
@@ -195,12 +447,14 @@ def prompt_stream(parameters, client,
         The client to use for the call.
     caching : bool | True
         Whether to use prompt caching.
+    label : str | None
+        What the call is for, in the usage records.
 
     Yields
     ------
     chunks : dict
         The chunks of the stream. All but one will be text chunks.
-        The last one will be a message stop event, which will contain the cost of the message.
+        The last one will be a message stop event, which will contain the cost of the message, and its input tokens.
     '''
 
     if caching:
@@ -216,19 +470,10 @@ def prompt_stream(parameters, client,
                 # second - the message stop event - this gives us the token usage
                 ## and from that we can calculate the cost
                 if isinstance(chunk, CacheMessageStopEvent):
-                    
-                    usage = chunk.message.usage
-                    tokens = {
-                        'input_tokens': usage.input_tokens,
-                        'output_tokens': usage.output_tokens,
-                        'cache_input_tokens': usage.cache_creation_input_tokens,
-                        'cache_read_tokens': usage.cache_read_input_tokens
-                    }
-
-                    cost = calculate_price(config.llm['model'], tokens, caching=True)
-
-                    # yield the cost
-                    yield { 'type': 'message_stop', 'cost': cost }
+                    cost = get_cost(chunk.message.usage, caching=True)
+                    record_usage(chunk.message.usage, label=label, caching=True, cost=cost)
+                    yield { 'type': 'message_stop', 'cost': cost,
+                            'input_tokens': count_input_tokens(chunk.message.usage) }
 
     else:
         with client.messages.stream(**parameters) as stream:
@@ -243,13 +488,94 @@ def prompt_stream(parameters, client,
                 # second - the message stop event - this gives us the token usage
                 ## and from that we can calculate the cost
                 if isinstance(chunk, MessageStopEvent):
-                    
-                    usage = chunk.message.usage
-                    tokens = {
-                        'input_tokens': usage.input_tokens,
-                        'output_tokens': usage.output_tokens,
-                    }
+                    cost = get_cost(chunk.message.usage, caching=False)
+                    record_usage(chunk.message.usage, label=label, caching=False, cost=cost)
+                    yield { 'type': 'message_stop', 'cost': cost,
+                            'input_tokens': count_input_tokens(chunk.message.usage) }
+
+async def aprompt(message, 
+                  context=None, 
+                  system=None, 
+                  stream=False, 
+                  client=None,
+                  max_tokens=1024, 
+                  caching=True, 
+                  stable_messages=None,
+                  label=None,
+                  ):
+    ''' 
+    Prompts the LLM API with a message, without blocking the event loop - the async version of prompt,
+    with the same parameters. The client, if given, is an anthropic.AsyncAnthropic.
+
+    Returns
+    -------
+    tuple | async generator
+        The text and the cost - or if streaming, an async generator of the chunks (see aprompt_stream).
+    '''
+
+    label = label or context
+
+    if PROVIDER == 'ANTHROPIC':
+
+        # use the event loop's shared client, so its open connections get reused
+        if not client:
+            client = get_async_client()
+
+        parameters = build_parameters(message, context=context, system=system, 
+                                      max_tokens=max_tokens, caching=caching, stable_messages=stable_messages)
 
-                    cost = calculate_price(config.llm['model'], tokens, caching=False)
+        log_call(stream, caching)
 
-                    yield { 'type': 'message_stop', 'cost': cost }
+        if stream:
+            return aprompt_stream(parameters, client, caching=caching, label=label)
+        else:
+            if caching:
+                message = await client.beta.prompt_caching.messages.create(**parameters)
+            else:
+                message = await client.messages.create(**parameters)
+
+            cost = get_cost(message.usage, caching=caching)
+            await run_io(record_usage, message.usage, label=label, caching=caching, cost=cost)
+
+            return message.content[0].text, cost
+
+async def aprompt_stream(parameters, client, 
+                         caching=True, label=None):
+    ''' 
+    Given parameters and an async client, makes a streaming LLM call - the async version of prompt_stream.
+
+    Parameters
+    ----------
+    parameters : dict
+        The parameters for the LLM call.
+    client : anthropic.AsyncAnthropic
+        The client to use for the call.
+    caching : bool | True
+        Whether to use prompt caching.
+    label : str | None
+        What the call is for, in the usage records.
+
+    Yields
+    ------
+    chunks : dict
+        The chunks of the stream - text chunks, then a message stop chunk with the cost and input tokens of the message.
+    '''
+
+    if caching:
+        stream_manager = client.beta.prompt_caching.messages.stream(**parameters)
+        text_event, stop_event = CacheTextEvent, CacheMessageStopEvent
+    else:
+        stream_manager = client.messages.stream(**parameters)
+        text_event, stop_event = TextEvent, MessageStopEvent
+
+    async with stream_manager as stream:
+        async for chunk in stream:
+            if isinstance(chunk, text_event):
+                yield { 'type': 'text', 'text': chunk.text }
+
+            if isinstance(chunk, stop_event):
+                cost = get_cost(chunk.message.usage, caching=caching)
+                # the database is written off the event loop
+                await run_io(record_usage, chunk.message.usage, label=label, caching=caching, cost=cost)
+                yield { 'type': 'message_stop', 'cost': cost,
+                        'input_tokens': count_input_tokens(chunk.message.usage) }
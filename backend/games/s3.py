@@ -1,11 +1,59 @@
 ''' Utility functions for reading and writing S3 files. '''
 
 import os
+import threading
+
 import boto3
+from botocore.config import Config
+
+import config
 
 from games.decorators import retry_on_exception
 
 
+# clients are created once per process, and shared between threads
+## boto3 clients are thread-safe, and keep a pool of open connections -
+## so reusing them saves the session setup, credential lookup and TLS handshake on every call
+clients = {}
+clients_lock = threading.Lock()
+
+def reset_clients():
+    '''
+    Drops all the cached clients, so new ones get created on next use.
+    Runs automatically in a forked child process - 
+    the parent's connections can't safely be shared with it.
+
+    Returns
+    -------
+    None
+    '''
+
+    global clients_lock
+
+    clients.clear()
+    # the lock could have been held by another thread at the moment of the fork
+    clients_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_clients)
+
+def client_config():
+    '''
+    Returns the botocore config for AWS clients - 
+    connection pool size, keep-alive, timeouts and retries.
+
+    Returns
+    -------
+    botocore.config.Config
+    '''
+
+    return Config(
+        max_pool_connections=config.s3['max_pool_connections'],
+        tcp_keepalive=True,
+        connect_timeout=config.s3['connect_timeout'],
+        read_timeout=config.s3['read_timeout'],
+        retries={'max_attempts': config.s3['max_attempts'], 'mode': 'standard'},
+    )
+
 @retry_on_exception(max_retries=3, delay=2)
 def aws_session():
     '''
@@ -22,19 +70,25 @@ def aws_session():
 def aws_client(service, session=None):
     '''
     Returns an AWS client.
+    Unless a session is given, the client is shared by the whole process.
 
     Parameters
     ----------
     service : str
         The AWS service to use.
     session : boto3.Session | None
-        The session to use. If None, then a new session is created.
+        The session to use. If None, then the shared client for the service is returned,
+        and created if it doesn't exist yet.
     '''
 
-    if not session:
-        session = aws_session()
+    if session:
+        return session.client(service, config=client_config())
 
-    return session.client(service)
+    with clients_lock:
+        if service not in clients:
+            clients[service] = aws_session().client(service, config=client_config())
+
+        return clients[service]
 
 @retry_on_exception(max_retries=3, delay=2)
 def read_object(bucket, key, client=None):
@@ -48,7 +102,7 @@ def read_object(bucket, key, client=None):
     key : str
         The key of the object.
     client : boto3.client | None
-        The client to use. If None, then a new client is created.
+        The client to use. If None, then the shared client is used.
 
     Returns
     -------
@@ -61,6 +115,94 @@ def read_object(bucket, key, client=None):
 
     return client.get_object(Bucket=bucket, Key=key)['Body'].read()
 
+@retry_on_exception(max_retries=3, delay=2)
+def read_object_if_exists(bucket, key, client=None):
+    '''
+    Reads an object from S3, if it exists.
+    Unlike read_object, a missing object isn't an error - so it isn't retried.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the bucket.
+    key : str
+        The key of the object.
+    client : boto3.client | None
+        The client to use. If None, then the shared client is used.
+
+    Returns
+    -------
+    bytes | None
+        The binary data of the file, or None if it doesn't exist.
+    '''
+
+    if not client:
+        client = aws_client('s3')
+
+    try:
+        return client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    except client.exceptions.NoSuchKey:
+        return None
+
+@retry_on_exception(max_retries=3, delay=2)
+def read_object_range(bucket, key, start, end, client=None):
+    '''
+    Reads a range of bytes from an object in S3.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the bucket.
+    key : str
+        The key of the object.
+    start : int
+        The first byte to read.
+    end : int
+        The byte to stop reading at (exclusive).
+    client : boto3.client | None
+        The client to use. If None, then the shared client is used.
+
+    Returns
+    -------
+    bytes
+        The binary data in the range.
+    '''
+
+    if not client:
+        client = aws_client('s3')
+
+    # an empty range can't be requested
+    if end <= start:
+        return b''
+
+    # http ranges are inclusive
+    return client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end - 1}')['Body'].read()
+
+@retry_on_exception(max_retries=3, delay=2)
+def get_object_size(bucket, key, client=None):
+    '''
+    Returns the size of an object in S3, from its metadata - without downloading it.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the bucket.
+    key : str
+        The key of the object.
+    client : boto3.client | None
+        The client to use. If None, then the shared client is used.
+
+    Returns
+    -------
+    int
+        The size of the object in bytes.
+    '''
+
+    if not client:
+        client = aws_client('s3')
+
+    return client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
 @retry_on_exception(max_retries=3, delay=2)
 def write_object(bucket_name, key, data, client=None):
     '''Writes an object to s3.
@@ -74,7 +216,7 @@ def write_object(bucket_name, key, data, client=None):
     data : bytes
         The data to write.
     client : boto3.client | None
-        The client to use. If None, then a new client is created.
+        The client to use. If None, then the shared client is used.
 
     Returns
     -------
@@ -86,6 +228,30 @@ def write_object(bucket_name, key, data, client=None):
 
     client.put_object(Bucket=bucket_name, Key=key, Body=data)
     
+@retry_on_exception(max_retries=3, delay=2)
+def delete_object(bucket, key, client=None):
+    '''
+    Deletes an object from S3.
+
+    Parameters
+    ----------
+    bucket : str
+        The name of the bucket.
+    key : str
+        The key of the object.
+    client : boto3.client | None
+        The client to use. If None, then the shared client is used.
+
+    Returns
+    -------
+    None
+    '''
+
+    if not client:
+        client = aws_client('s3')
+
+    client.delete_object(Bucket=bucket, Key=key)
+
 @retry_on_exception(max_retries=3, delay=2)
 def list_objects(bucket, prefix='', client=None):
     '''
@@ -98,7 +264,7 @@ def list_objects(bucket, prefix='', client=None):
     prefix : str | ''
         The prefix to search for.
     client : boto3.client | None
-        The client to use. If None, then a new client is created.
+        The client to use. If None, then the shared client is used.
     
     Returns
     -------
@@ -110,16 +276,15 @@ def list_objects(bucket, prefix='', client=None):
         client = aws_client('s3')
 
     # get the objects
-    # if it returns a key error, then the given prefix doesn't exist
-    try:
-        objects =  client.list_objects(Bucket=bucket, Prefix=prefix)['Contents']
-    except KeyError:
-        return []
+    # each page holds up to 1000 - a long game has more than that
+    # if a page has no contents, then the given prefix doesn't exist
+    objects = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        objects += page.get('Contents', [])
 
-    # if there's only one object, and it's the directory, it will return it
+    # the directory itself can be returned as an object
     # but we don't count that as a file
-    if len(objects) == 1 and objects[0]['Key'] == prefix or objects[0]['Key'] == f'{prefix}/':
-        return []
+    objects = [obj for obj in objects if obj['Key'] not in [prefix, f'{prefix}/']]
     
     # remove the prefix from each item
     return [os.path.basename(obj['Key']) for obj in objects]
@@ -136,7 +301,7 @@ def check_object_exists(bucket, key, client=None):
     key : str
         The key of the object.
     client : boto3.client | None
-        The client to use. If None, then a new client is created.
+        The client to use. If None, then the shared client is used.
 
     Returns
     -------
@@ -1,22 +1,74 @@
 ''' Functions for saving a game to the system. '''
 
+import copy
 import json
 import os
-from pathlib import Path
+import threading
+import time
+from functools import wraps
 
 import config
 
+import games.history_db as history_db
+from games.cache import cache, enabled as cache_enabled, notify_write, records_size
+from games.codec import encode, detect
+from games.prompt_state import advance
 from games.decorators import retry_on_exception, catch_and_log
-from games.load_game import load_json
-from games.s3 import write_object
-from games.utils import get_gamefile_listdir, get_file_size, check_file_exists
+from games.intro import expand_record, make_intro_record
+from games.load_game import (fetch_records, get_tombstones, is_visible, load_json, load_raw, load_manifest,
+                             load_stream, parse_records)
+from games.storage import get_storage
+from games.utils import get_gamefile_listdir, check_file_exists
 
 
+# a game's manifest is read, changed and saved again - so only one thread in the process changes it at a time
+## e.g. a turn being committed while the previous turn's summary is committed in the background
+## the games share a fixed set of locks, rather than keeping one for every game ever saved
+game_locks = [threading.RLock() for _ in range(64)]
+
+def reset_game_locks():
+    '''
+    Replaces the game locks in a forked child process - they could have been held by another thread at the moment of the fork.
+
+    Returns
+    -------
+    None
+    '''
+
+    global game_locks
+
+    game_locks = [threading.RLock() for _ in range(64)]
+
+os.register_at_fork(after_in_child=reset_game_locks)
+
+def get_game_lock(game_id):
+    '''
+    Returns the lock for changing a game's manifest.
+
+    Parameters
+    ----------
+    game_id : int | str
+        The game id.
+
+    Returns
+    -------
+    threading.RLock
+    '''
+
+    return game_locks[hash(str(game_id)) % len(game_locks)]
+
+# decorator for functions that change a game's files - the game id is their first argument
+def locks_game(func):
+    @wraps(func)
+    def wrapper(game_id, *args, **kwargs):
+        with get_game_lock(game_id):
+            return func(game_id, *args, **kwargs)
+    return wrapper
+
 @retry_on_exception(max_retries=3, delay=2)
 def save_json(filepath, data):
     '''
-    Saves a json to the system.
-    Either to local or s3, depending on the environment.
+    Saves a json to the configured storage backend.
 
     Parameters
     ----------
@@ -30,19 +82,674 @@ def save_json(filepath, data):
     None
     '''
 
-    if config.ENV == 'DEV':
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+    get_storage().write(filepath, encode(json.dumps(data).encode('utf-8')))
+
+def format_records(records):
+    '''
+    Formats records as newline-delimited json - one record per line.
+
+    Parameters
+    ----------
+    records : list
+        The records to format.
+
+    Returns
+    -------
+    str
+        The formatted records.
+    '''
+
+    return ''.join(json.dumps(record) + '\n' for record in records)
+
+@retry_on_exception(max_retries=3, delay=2)
+def append_records(filepath, records):
+    '''
+    Appends records to the end of a chunk, without reading it.
+    Only for storage backends that support appending.
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the chunk.
+    records : list
+        The records to append.
+
+    Returns
+    -------
+    int
+        The number of bytes appended.
+    '''
+
+    # encoded frames can be concatenated, so they can be appended
+    data = encode(format_records(records).encode('utf-8'))
+
+    get_storage().append(filepath, data)
+
+    return len(data)
+
+@retry_on_exception(max_retries=3, delay=2)
+def save_records(filepath, records):
+    '''
+    Saves records as a whole chunk, overwriting anything already there.
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the chunk.
+    records : list
+        The records to save.
+
+    Returns
+    -------
+    int
+        The number of bytes saved.
+    '''
+
+    data = encode(format_records(records).encode('utf-8'))
+
+    get_storage().write(filepath, data)
+
+    return len(data)
+
+def describe_chunk(name, records, size, codec=None):
+    '''
+    Creates the manifest entry for a chunk.
+
+    Parameters
+    ----------
+    name : str
+        The name of the chunk.
+    records : list
+        The records in the chunk.
+    size : int
+        The size of the chunk in bytes.
+    codec : str | None
+        The codec the chunk is encoded with. If None, the configured codec.
+
+    Returns
+    -------
+    dict
+        The manifest entry.
+    '''
+
+    turns = [record['turn'] for record in records if 'turn' in record]
+
+    return {
+        'name': name,
+        'size': size,
+        'records': len(records),
+        'first_turn': turns[0] if turns else None,
+        'last_turn': turns[-1] if turns else None,
+        'codec': codec or config.file_save['codec'],
+    }
+
+def build_manifest(game_id):
+    '''
+    Builds a manifest for a game that was saved before manifests existed,
+    by listing and reading every one of its chunks.
+    This only ever has to happen once per game - after that, the manifest is kept up to date.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    '''
+
+    manifest = {'index': {}}
+
+    for type in ['full_text', 'summaries']:
+        file_save_dir = os.path.join(config.file_save['path'], str(game_id), type)
+
+        manifest[type] = []
+        manifest['index'][type] = []
+
+        for file in get_gamefile_listdir(file_save_dir):
+            raw = load_raw(os.path.join(file_save_dir, file))
+            records = parse_records(raw)
+            manifest[type].append(describe_chunk(file, records, len(raw), codec=detect(raw)))
+            index_records(manifest['index'][type], file, records)
+
+    return manifest
+
+def index_records(index, name, records, offset=0):
+    '''
+    Adds records to a turn index - which records the chunk and position of the first record of each turn, in order.
+    The index lets us find a turn's records without reading any chunks that don't hold it.
+
+    Parameters
+    ----------
+    index : list
+        The turn index, as a list of [turn, chunk name, position] - updated in place.
+    name : str
+        The name of the chunk the records are in.
+    records : list
+        The records.
+    offset : int | 0
+        The position of the first of the records in the chunk.
+
+    Returns
+    -------
+    None
+    '''
+
+    for position, record in enumerate(records, offset):
+        turn = record.get('turn')
+
+        # only the first record of each turn goes in the index
+        if turn is None or (index and index[-1][0] == turn):
+            continue
+
+        index.append([turn, name, position])
+
+def reindex(manifest, type, rewritten):
+    '''
+    Updates a game's turn index after some of its chunks have been rewritten.
+    Only the rewritten chunks are re-indexed - the other chunks' entries are kept as they are.
+
+    Parameters
+    ----------
+    manifest : dict
+        The game's manifest - updated in place.
+    type : str
+        The type of chunks (full_text or summaries).
+    rewritten : dict
+        The records in each rewritten chunk, keyed by chunk name.
+
+    Returns
+    -------
+    None
+    '''
+
+    entries = {}
+    for entry in manifest['index'][type]:
+        entries.setdefault(entry[1], []).append(entry)
+
+    index = []
+
+    for chunk in manifest[type]:
+        if chunk['name'] in rewritten:
+            index_records(index, chunk['name'], rewritten[chunk['name']])
+        else:
+            for entry in entries.get(chunk['name'], []):
+                if not (index and index[-1][0] == entry[0]):
+                    index.append(entry)
+
+    manifest['index'][type] = index
+
+def build_index(game_id, manifest):
+    '''
+    Builds the turn index for a game whose manifest was saved before there were turn indexes,
+    from its committed records - which are usually cached already.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The game's manifest - updated in place.
+
+    Returns
+    -------
+    None
+    '''
+
+    index = {}
+
+    for type in ['full_text', 'summaries']:
+        records = load_stream(game_id, type=type)['records']
+
+        # the records are split between the chunks as the manifest says
+        if len(records) != sum(chunk['records'] for chunk in manifest[type]):
+            return
+
+        index[type] = []
+        offset = 0
+        for chunk in manifest[type]:
+            index_records(index[type], chunk['name'], records[offset:offset + chunk['records']])
+            offset += chunk['records']
+
+    manifest['index'] = index
+
+def get_manifest(game_id):
+    '''
+    Returns the manifest for a game, building and saving it if the game doesn't have one yet.
+    It's saved straight away, before anything else is written - 
+    otherwise readers would fall back to listing the game's chunks, and see writes that were never committed.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    '''
+
+    # always from storage - the cached one may be out of date, if another process has saved the game
+    manifest = load_manifest(game_id, fresh=True)
+
+    if manifest is None:
+        manifest = build_manifest(game_id)
+        save_manifest(game_id, manifest)
+    elif 'index' not in manifest:
+        # it's saved along with whatever's being written
+        build_index(game_id, manifest)
+
+    return manifest
+
+def save_manifest(game_id, manifest):
+    '''
+    Saves the manifest for a game.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The manifest.
+
+    Returns
+    -------
+    None
+    '''
+
+    # when the game was last saved - games that haven't been saved in a while get archived
+    manifest['modified'] = time.time()
+
+    save_json(os.path.join(config.file_save['path'], str(game_id), 'manifest.json'), manifest)
+
+    # write through to the cache, and let other processes know the game has changed
+    if cache_enabled():
+        cache.put((str(game_id), 'manifest'), copy.deepcopy(manifest), len(json.dumps(manifest)))
+    notify_write(game_id)
+
+def cache_records(game_id, manifest, records):
+    '''
+    Adds records that have just been committed to the game's cached full_text, summaries and prompt state,
+    so the next turn doesn't have to read them back from storage.
+    Should be called after the manifest is saved.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The game's manifest, as saved.
+    records : dict
+        The committed records, keyed by type.
+
+    Returns
+    -------
+    None
+    '''
+
+    if not cache_enabled():
+        return
+
+    for type in ['full_text', 'summaries', 'prompt']:
+        if type not in manifest:
+            continue
+
+        stream = cache.peek((str(game_id), type))
+        new = records.get(type, [])
+        chunks = manifest[type]
+
+        if stream is None:
+            # a game with nothing else saved can be cached from what was just written
+            ## otherwise, it'll be loaded from storage the next time it's needed
+            if sum(chunk['records'] for chunk in chunks) != len(new):
+                continue
+            stream = {'records': [], 'latest': 0}
+
+        combined = stream['records'] + new
+
+        # the new records either started a new chunk, or went on the end of the latest one
+        if chunks and chunks[-1]['records'] == len(new):
+            latest = len(new)
+        else:
+            latest = stream['latest'] + len(new)
+
+        cache.put((str(game_id), type), {
+            'records': combined,
+            'latest': latest,
+            'stored': sum(chunk['records'] for chunk in chunks),
+            'journal': dict(manifest.get('journal', {})),
+        }, records_size(combined))
+
+def update_prompt_state(game_id, manifest, records):
+    '''
+    Moves a game's prompt state on by the summaries records that have just been added,
+    writing the newly settled messages to the end of the prompt chunks.
+    Should be called after the records are added, and before the manifest is saved - so it's committed with them.
+    A game without a prompt state (e.g. one saved before there were prompt states) gets one built from all its summaries.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The game's manifest - updated in place.
+    records : list
+        The summaries records that have just been added.
+
+    Returns
+    -------
+    dict
+        The newly settled messages, keyed by type - for cache_records.
+    '''
+
+    total = sum(chunk['records'] for chunk in manifest['summaries'])
+    state = manifest.get('prompt_state')
+
+    if state is None:
+        # build it from the game's committed summaries, plus the new records
+        committed = load_stream(game_id, type='summaries')
+        if committed['stored'] + len(records) != total:
+            return {}
+
+        drop_prompt_state(game_id, manifest)
+        state = {'last': None, 'summaries': 0}
+        records = committed['records'] + records
+
+    elif state['summaries'] + len(records) != total:
+        # something changed the summaries without moving the prompt state on - it gets rebuilt next time
+        drop_prompt_state(game_id, manifest)
+        return {}
+
+    settled, last = advance(state['last'], records)
+
+    if settled:
+        add_records(game_id, manifest, 'prompt', settled)
+
+    manifest['prompt_state'] = {'last': last, 'summaries': total}
+
+    return {'prompt': settled}
+
+def drop_prompt_state(game_id, manifest):
+    '''
+    Drops a game's prompt state, for when its summaries have been rewritten.
+    It's rebuilt the next time a turn is saved.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The game's manifest - updated in place.
+
+    Returns
+    -------
+    None
+    '''
+
+    # the prompt chunks' names get reused, and overwritten
+    manifest['prompt_state'] = None
+    manifest['prompt'] = []
+
+    cache.invalidate(game_id, 'prompt')
+
+def make_record(writer, text, turn=None):
+    '''
+    Creates a full_text or summaries record.
+
+    Parameters
+    ----------
+    writer : str
+        The writer of the text.
+    text : str
+        The text.
+    turn : int | str | None
+        The turn number.
+
+    Returns
+    -------
+    dict
+        The record.
+    '''
+
+    d = {'writer': writer, 'text': text}
+    # add the turn data
+    if turn is not None:
+        d['turn'] = turn
+
+    return d
+
+def add_records(game_id, manifest, type, records):
+    '''
+    Writes records to the end of a game's full_text or summaries, in a single storage operation,
+    and adds them to the manifest. 
+    The records aren't committed until the manifest is saved - 
+    readers only ever read up to the sizes recorded in the manifest.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    manifest : dict
+        The game's manifest - updated in place.
+    type : str
+        The type of records (full_text or summaries).
+    records : list
+        The records to write.
+
+    Returns
+    -------
+    None
+    '''
+
+    # e.g. a turn whose summaries are saved later
+    if not records:
+        return
+
+    file_save_dir = os.path.join(config.file_save['path'], str(game_id), type)
+    storage = get_storage()
+
+    chunks = manifest[type]
+    latest = chunks[-1] if chunks else None
+
+    # if the backend supports it, we append to the latest chunk, as long as it isn't too big
+    ## legacy .json chunks hold a single json list, so they can't be appended to
+    ## s3 objects can't be appended to either - so there, every write is a new, small object
+    ## chunks can't mix codecs, so if the codec has changed since the chunk was started, we start a new one
+    ## and if the chunk is bigger than the manifest says, an uncommitted write was left behind -
+    ## so we start a new chunk rather than append after it
+    if (storage.supports_append and latest and latest['name'].endswith('.jsonl')
+            and latest['size'] <= config.file_save['max_size']
+            and latest.get('codec', 'none') == config.file_save['codec']
+            and storage.size(os.path.join(file_save_dir, latest['name'])) == latest['size']):
+        size = append_records(os.path.join(file_save_dir, latest['name']), records)
+
+        if type in manifest.get('index', {}):
+            index_records(manifest['index'][type], latest['name'], records, offset=latest['records'])
+
+        chunk = describe_chunk(latest['name'], records, size)
+        latest['size'] += chunk['size']
+        latest['records'] += chunk['records']
+        if chunk['last_turn'] is not None:
+            latest['last_turn'] = chunk['last_turn']
+            if latest['first_turn'] is None:
+                latest['first_turn'] = chunk['first_turn']
     else:
-        write_object(config.s3['data_bucket'], filepath, json.dumps(data).encode('utf-8'))
+        # a new chunk - if a name is reused from an uncommitted write, it gets overwritten
+        file_num = int(latest['name'].split('.')[0]) + 1 if latest else 0
+        name = f'{file_num}.jsonl'
+
+        size = save_records(os.path.join(file_save_dir, name), records)
+        chunks.append(describe_chunk(name, records, size))
+
+        if type in manifest.get('index', {}):
+            index_records(manifest['index'][type], name, records)
+
+def make_turn_records(turn, response, summary, user_input=None, summary_input=None):
+    '''
+    Creates the full_text and summaries records for a turn.
+
+    Parameters
+    ----------
+    turn : int | str
+        The turn number.
+    response : str
+        The AI's response - for full_text.
+    summary : str | None
+        The summary of the response - for summaries.
+        If None, the turn has no summaries records - they're saved later, once the summary is written.
+    user_input : str | None
+        The user input that the AI responded to - for both full_text and summaries.
+    summary_input : str | None
+        A user message for summaries only, in place of the user input.
+        Used for the start of the game, where the player didn't write anything.
+
+    Returns
+    -------
+    dict
+        The records, keyed by type.
+    '''
+
+    records = {'full_text': [], 'summaries': []}
+
+    if summary is None:
+        if user_input is not None:
+            records['full_text'].append(make_record('user', user_input, turn))
+        records['full_text'].append(make_record('ai', response, turn))
+        return records
+
+    # the user message in summaries is the user input, unless it's been replaced
+    if summary_input is None:
+        summary_input = user_input
+
+    if user_input is not None:
+        records['full_text'].append(make_record('user', user_input, turn))
+    if summary_input is not None:
+        records['summaries'].append(make_record('user', summary_input, turn))
+
+    records['full_text'].append(make_record('ai', response, turn))
+    records['summaries'].append(make_record('ai', summary, turn))
+
+    return records
+
+@catch_and_log
+def commit_turn(game_id, turn, response, summary, 
+                user_input=None, summary_input=None):
+    '''
+    Saves a whole turn - the full text and the summaries - in one commit.
+    Each of full_text and summaries gets a single write, then the manifest is saved.
+    Saving the manifest is the commit: if anything fails before it, none of the turn is visible,
+    so there's nothing to clean up.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    turn : int | str
+        The turn number.
+    response : str
+        The AI's response - saved to full_text.
+    summary : str | None
+        The summary of the response - saved to summaries. If None, the summaries are saved later.
+    user_input : str | None
+        The user input that the AI responded to - saved to both full_text and summaries.
+    summary_input : str | None
+        A user message to save to summaries only, in place of the user input.
+        Used for the start of the game, where the player didn't write anything.
+
+    Returns
+    -------
+    None
+    '''
+
+    records = make_turn_records(turn, response, summary, 
+                                user_input=user_input, summary_input=summary_input)
+
+    commit_records(game_id, records)
+
+@catch_and_log
+@locks_game
+def commit_records(game_id, records):
+    '''
+    Saves a turn's full_text and summaries records in one commit - see commit_turn.
+    Either can be empty - e.g. a turn's summaries, saved once they've been written.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    records : dict
+        The records, keyed by type.
+
+    Returns
+    -------
+    None
+    '''
+
+    # in the database, the transaction is the commit
+    if config.file_save['history_backend'] == 'database':
+        history_db.commit_turn(game_id, records)
+        return
+
+    manifest = get_manifest(game_id)
+
+    add_records(game_id, manifest, 'full_text', records['full_text'])
+    add_records(game_id, manifest, 'summaries', records['summaries'])
+    settled = update_prompt_state(game_id, manifest, records['summaries']) if records['summaries'] else {}
+
+    # commit
+    save_manifest(game_id, manifest)
+
+    cache_records(game_id, manifest, {**records, **settled})
 
 @catch_and_log
+@locks_game
+def save_intro(game_id, names):
+    '''
+    Saves the game intro to the full text - as a reference to its template, with the characters' names,
+    so every game doesn't store its own copy of the text.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    names : list | None
+        The first names of the game's three characters.
+
+    Returns
+    -------
+    None
+    '''
+
+    records = {'full_text': [make_intro_record(names)]}
+
+    # the database only has room for the text
+    if config.file_save['history_backend'] == 'database':
+        history_db.add_records(game_id, 'full_text', [expand_record(record) for record in records['full_text']])
+        return
+
+    manifest = get_manifest(game_id)
+
+    add_records(game_id, manifest, 'full_text', records['full_text'])
+
+    # commit
+    save_manifest(game_id, manifest)
+
+    cache_records(game_id, manifest, records)
+
+@catch_and_log
+@locks_game
 def save_text(game_id, new_data, turn=None,
               writer='ai', 
               save_type='append',
               type='full_text'):
     '''
     Saves game data to the system.
+    Full text and summaries are stored as append-only chunks of newline-delimited json,
+    so appending a record never reads or rewrites what's already been saved.
+    The game's manifest tracks the chunks, so we never have to list or download them to find the latest.
 
     Parameters
     ----------
@@ -64,109 +771,213 @@ def save_text(game_id, new_data, turn=None,
     None
     '''
 
+    if type in ['full_text', 'summaries'] and config.file_save['history_backend'] == 'database':
+        if save_type == 'append':
+            history_db.add_records(game_id, type, [make_record(writer, new_data, turn)])
+        elif save_type == 'overwrite':
+            history_db.replace_latest_turn(game_id, type, new_data)
+        return
+
     if type in ['full_text', 'summaries']:
         file_save_dir = os.path.join(config.file_save['path'], str(game_id), type)
     elif type == 'initialization':
         file_save_dir = os.path.join(config.file_save['path'], str(game_id))
 
-    # create the directory if it doesn't exist
-    # only need this for dev
-    if config.ENV == 'DEV':
-        Path(file_save_dir).mkdir(parents=True, exist_ok=True)
-
     if type in ['full_text', 'summaries']:
-        # get all the files
-        files = get_gamefile_listdir(file_save_dir)
-        # if there are no files, then start at 0
-        if not files:
-            file_num = 0
-            data = []
-            file_save_path = os.path.join(file_save_dir, f'{file_num}.json')
+        manifest = get_manifest(game_id)
+        chunks = manifest[type]
+        latest = chunks[-1] if chunks else None
+
+        if save_type == 'append':
+            records = {type: [make_record(writer, new_data, turn)]}
+            add_records(game_id, manifest, type, records[type])
+
+            if type == 'summaries':
+                records.update(update_prompt_state(game_id, manifest, records[type]))
+
+        elif save_type == 'overwrite':
+            # overwrite the latest chunk
+            name = latest['name'] if latest else '0.jsonl'
+            start = sum(chunk['records'] for chunk in chunks) - (latest['records'] if latest else 0)
+            size = save_records(os.path.join(file_save_dir, name), new_data)
+
+            if latest:
+                chunks.pop()
+            # an emptied chunk is dropped from the manifest - its name will get reused
+            if new_data:
+                chunks.append(describe_chunk(name, new_data, size))
+
+            # the new data is what was visible in the chunk, so tombstones have nothing left to remove from it
+            for entry in manifest.get('tombstones', {}).get(type, []):
+                entry[1] = min(entry[1], start)
+
+            if 'index' in manifest:
+                reindex(manifest, type, {name: new_data})
+
+            if type == 'summaries':
+                drop_prompt_state(game_id, manifest)
+
+        save_manifest(game_id, manifest)
+
+        if save_type == 'append':
+            cache_records(game_id, manifest, records)
         else:
-            # check how big the latest file is
-            latest_file = files[-1]
-            # if the file is too big, start a new file
-            if get_file_size(os.path.join(file_save_dir, latest_file)) > config.file_save['max_size']:
-                file_num = int(latest_file.split('.')[0]) + 1
-                data = []
-                file_save_path = os.path.join(file_save_dir, f'{file_num}.json')
-            # otherwise, use the latest file
-            else:
-                file_save_path = os.path.join(file_save_dir, latest_file)
-                data = load_json(file_save_path)
-            
+            cache.invalidate(game_id, type)
+
     elif type == 'initialization':
         file_save_path = os.path.join(file_save_dir, 'initialization.json')
-        if check_file_exists(file_save_path):
+
+        cached = cache.peek((str(game_id), 'initialization'))
+        if cached is not None:
+            data = list(cached)
+        elif check_file_exists(file_save_path):
             data = load_json(file_save_path)
         else:
             data = []
+
+        if save_type == 'append':
+            data.append(make_record(writer, new_data, turn))
+        elif save_type == 'overwrite':
+            data = new_data
     
-    if save_type == 'append':
-        d = {'writer': writer, 'text': new_data}
-        # add the turn data
-        if turn is not None:
-            d['turn'] = turn
-        data.append(d)
-    elif save_type == 'overwrite':
-        data = new_data
-    
-    save_json(file_save_path, data)
+        save_json(file_save_path, data)
+
+        cache.put((str(game_id), 'initialization'), data, records_size(data))
+        notify_write(game_id)
 
 @catch_and_log
-def remove_turn(game_id, turn):
+@locks_game
+def remove_turn(game_id, turn, types=('full_text', 'summaries')):
     ''' 
     Removes a turn from a game.
     This is necessary when an error occurs in the middle of a turn,
     and we need to rewind the game to the previous turn.
+    Rather than rewriting the chunks that hold the turn, it's marked with a tombstone in the manifest -
+    so it's a single small write. Readers leave out the turn's records from before the tombstone
+    (records for the turn saved after it are kept), and compact_tombstones later folds them into the chunks.
 
     Parameters
     ----------
     game_id : int
         The game id.
-    turn : int
+    turn : int | str
         The turn to remove.
+    types : tuple | ('full_text', 'summaries')
+        The types of records to remove the turn from.
 
     Returns
     -------
     None
     '''
 
-    ## first, full text
-    # get the full text files
-    full_text_files = get_gamefile_listdir(os.path.join(config.file_save['path'], str(game_id), 'full_text'))
-    
-    # if there are no files, then return
-    try:
-        last_full_text_file = full_text_files[-1]
-    except IndexError:
+    if config.file_save['history_backend'] == 'database':
+        history_db.remove_turn(game_id, turn, kinds=types)
         return
 
-    # load the last full text file
-    full_text_data = load_json(os.path.join(config.file_save['path'], str(game_id), 'full_text', last_full_text_file))
-        
-    # remove the turn
-    new_full_text_data = [item for item in full_text_data if item['turn'] != turn]
+    manifest = get_manifest(game_id)
+    tombstones = manifest.setdefault('tombstones', {})
 
-    # save the new full text
-    save_text(game_id, new_full_text_data, save_type='overwrite', type='full_text')
-    
+    for type in types:
+        # the turn's records before this position are gone
+        tombstones.setdefault(type, []).append([turn, sum(chunk['records'] for chunk in manifest[type])])
 
-    ## then, summaries
-    # get the summary files
-    summary_files = get_gamefile_listdir(os.path.join(config.file_save['path'], str(game_id), 'summaries'))
+    if 'summaries' in types:
+        drop_prompt_state(game_id, manifest)
 
-    # if there are no files, then return
-    try:
-        last_summary_file = summary_files[-1]
-    except IndexError:
-        return
+    # commit
+    save_manifest(game_id, manifest)
+
+    # take the turn out of the cached records too, rather than reading them all back
+    for type in types:
+        stream = cache.peek((str(game_id), type))
+        if stream is None:
+            continue
+
+        records = [record for record in stream['records'] if record.get('turn') != turn]
+        latest = len([record for record in stream['records'][len(stream['records']) - stream['latest']:]
+                      if record.get('turn') != turn])
+
+        cache.put((str(game_id), type), {**stream, 'records': records, 'latest': latest}, records_size(records))
+
+@catch_and_log
+@locks_game
+def compact_tombstones(game_id):
+    '''
+    Folds a game's tombstones into its chunks - the chunks that hold removed records are rewritten without them,
+    and the tombstones are cleared from the manifest.
+    Shouldn't be run while the game is being played, since a turn saved in the meantime would be lost.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    int
+        The number of records removed from the chunks.
+    '''
+
+    manifest = load_manifest(game_id, fresh=True)
+
+    if not manifest or not manifest.get('tombstones'):
+        return 0
+
+    removed = 0
+    stored = sum(chunk['records'] for chunk in manifest['summaries'])
+
+    for type in ['full_text', 'summaries']:
+        tombstones = get_tombstones(manifest, type)
+        if not tombstones:
+            continue
+
+        file_save_dir = os.path.join(config.file_save['path'], str(game_id), type)
+        chunks = manifest[type]
+
+        # where each chunk starts, counting every record
+        starts = []
+        position = 0
+        for chunk in chunks:
+            starts.append(position)
+            position += chunk['records']
+
+        # nothing before the first of the removed turns needs reading
+        ## the index says where it is - without one, every chunk is read
+        names = [chunk['name'] for chunk in chunks]
+        index = manifest.get('index', {}).get(type, [])
+        first = min((names.index(name) for turn, name, _ in index if turn in tombstones), default=0)
+
+        rewritten = {}
+
+        for i, data in enumerate(fetch_records(file_save_dir, chunks[first:]), first):
+            new_data = [record for position, record in enumerate(data, starts[i])
+                        if is_visible(tombstones, position, record)]
+
+            if len(new_data) == len(data):
+                continue
+
+            size = save_records(os.path.join(file_save_dir, chunks[i]['name']), new_data)
+            chunks[i] = describe_chunk(chunks[i]['name'], new_data, size)
+            rewritten[chunks[i]['name']] = new_data
+            removed += len(data) - len(new_data)
+
+        # emptied chunks are dropped from the manifest
+        manifest[type] = [chunk for chunk in chunks if chunk['records']]
+
+        if 'index' in manifest:
+            reindex(manifest, type, rewritten)
+
+    # an up to date prompt state stays up to date - the summaries it covers have just been counted differently
+    state = manifest.get('prompt_state')
+    if state and state['summaries'] == stored:
+        state['summaries'] = sum(chunk['records'] for chunk in manifest['summaries'])
+
+    del manifest['tombstones']
 
-    # load the last summary file
-    summary_data = load_json(os.path.join(config.file_save['path'], str(game_id), 'summaries', last_summary_file))
+    # commit
+    save_manifest(game_id, manifest)
 
-    # remove the turn
-    new_summary_data = [item for item in summary_data if item['turn'] != turn]
+    for type in ['full_text', 'summaries']:
+        cache.invalidate(game_id, type)
 
-    # save the new summaries
-    save_text(game_id, new_summary_data, save_type='overwrite', type='summaries')
\ No newline at end of file
+    return removed
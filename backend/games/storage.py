@@ -0,0 +1,342 @@
+''' Storage backends for game files - the local file system, S3, and memory. '''
+
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.db import close_old_connections
+
+import config
+
+from games.s3 import (read_object, read_object_if_exists, read_object_range,
+                      write_object, delete_object, list_objects,
+                      get_object_size, check_object_exists)
+
+
+class StorageBackend:
+    '''
+    The interface for a place that game files are stored.
+    Paths are the full path/key of a file, e.g. <file save path>/<game id>/full_text/0.jsonl.
+    '''
+
+    # whether data can be added to the end of a file without rewriting it
+    supports_append = False
+
+    def read(self, path):
+        ''' Returns the contents of a file, as bytes. '''
+        raise NotImplementedError
+
+    def read_if_exists(self, path):
+        ''' Returns the contents of a file as bytes, or None if it doesn't exist. '''
+        raise NotImplementedError
+
+    def read_range(self, path, start, end):
+        ''' Returns the bytes of a file from start up to (but not including) end. '''
+        raise NotImplementedError
+
+    def write(self, path, data):
+        ''' Writes bytes to a file, overwriting anything already there. '''
+        raise NotImplementedError
+
+    def append(self, path, data):
+        ''' Adds bytes to the end of a file, creating it if it doesn't exist. '''
+        raise NotImplementedError
+
+    def size(self, path):
+        ''' Returns the size of a file in bytes. '''
+        raise NotImplementedError
+
+    def exists(self, path):
+        ''' Returns whether a file exists. '''
+        raise NotImplementedError
+
+    def list(self, path):
+        ''' Returns the names of the files in a directory/prefix. '''
+        raise NotImplementedError
+
+    def delete(self, path):
+        ''' Deletes a file, if it exists. '''
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    ''' Stores game files on the local file system. '''
+
+    supports_append = True
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def read_if_exists(self, path):
+        try:
+            return self.read(path)
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, path, start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(max(end - start, 0))
+
+    def write(self, path, data):
+        # written to a temporary file, then moved over the file in one step - so a crash can't leave it half written
+        ## the temporary file is in the same directory, as the move is only atomic within a file system
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def append(self, path, data):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+
+    def size(self, path):
+        return os.path.getsize(path)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def list(self, path):
+        # a directory that hasn't been created yet has no files
+        try:
+            return os.listdir(path)
+        except FileNotFoundError:
+            return []
+
+    def delete(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage(StorageBackend):
+    ''' Stores game files in an S3 bucket. '''
+
+    # s3 objects are immutable - appending means downloading and re-uploading
+    supports_append = False
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def read(self, path):
+        return read_object(self.bucket, path)
+
+    def read_if_exists(self, path):
+        return read_object_if_exists(self.bucket, path)
+
+    def read_range(self, path, start, end):
+        return read_object_range(self.bucket, path, start, end)
+
+    def write(self, path, data):
+        write_object(self.bucket, path, data)
+
+    def append(self, path, data):
+        existing = self.read_if_exists(path) or b''
+        write_object(self.bucket, path, existing + data)
+
+    def size(self, path):
+        # from the object's metadata - no download
+        return get_object_size(self.bucket, path)
+
+    def exists(self, path):
+        return check_object_exists(self.bucket, path)
+
+    def list(self, path):
+        return list_objects(self.bucket, prefix=path)
+
+    def delete(self, path):
+        delete_object(self.bucket, path)
+
+
+class MemoryStorage(StorageBackend):
+    '''
+    Stores game files in memory - nothing touches the disk or network.
+    Useful for tests and load testing the whole turn pipeline.
+    '''
+
+    supports_append = True
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        with self.lock:
+            return bytes(self.files[path])
+
+    def read_if_exists(self, path):
+        with self.lock:
+            data = self.files.get(path)
+            return bytes(data) if data is not None else None
+
+    def read_range(self, path, start, end):
+        with self.lock:
+            return bytes(self.files[path][start:end])
+
+    def write(self, path, data):
+        with self.lock:
+            self.files[path] = bytearray(data)
+
+    def append(self, path, data):
+        with self.lock:
+            self.files.setdefault(path, bytearray()).extend(data)
+
+    def size(self, path):
+        with self.lock:
+            return len(self.files[path])
+
+    def exists(self, path):
+        with self.lock:
+            return path in self.files
+
+    def list(self, path):
+        prefix = path.rstrip('/') + '/'
+        with self.lock:
+            # only the files directly inside the directory
+            return sorted(key[len(prefix):] for key in self.files
+                          if key.startswith(prefix) and '/' not in key[len(prefix):])
+
+    def delete(self, path):
+        with self.lock:
+            self.files.pop(path, None)
+
+
+# one backend of each kind per process
+## the memory backend in particular has to be shared, or it would lose its files
+backends = {}
+backends_lock = threading.Lock()
+
+def get_storage(name=None):
+    '''
+    Returns the storage backend to use for game files.
+
+    Parameters
+    ----------
+    name : str | None
+        The backend to use - 'local', 's3' or 'memory'.
+        If None, uses the configured backend - or if that isn't set,
+        the local file system in DEV and S3 everywhere else.
+
+    Returns
+    -------
+    StorageBackend
+        The storage backend.
+    '''
+
+    if name is None:
+        name = config.file_save['backend'] or ('local' if config.ENV == 'DEV' else 's3')
+
+    with backends_lock:
+        if name not in backends:
+            if name == 'local':
+                backends[name] = LocalStorage()
+            elif name == 's3':
+                backends[name] = S3Storage(config.s3['data_bucket'])
+            elif name == 'memory':
+                backends[name] = MemoryStorage()
+            else:
+                raise ValueError(f'Invalid storage backend: {name}')
+
+        return backends[name]
+
+
+# the pool that runs blocking storage and database calls for the async views - so the event loop never waits on them
+## started the first time it's needed
+io_executor = None
+io_lock = threading.Lock()
+
+def reset_io_executor():
+    '''
+    Forgets the io pool - its threads don't survive into a forked child process,
+    so a new one gets started there on first use.
+
+    Returns
+    -------
+    None
+    '''
+
+    global io_executor, io_lock
+
+    io_executor = None
+    io_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_io_executor)
+
+def get_io_executor():
+    '''
+    Returns the pool that runs blocking calls for the async views, starting it if it isn't running already.
+
+    Returns
+    -------
+    ThreadPoolExecutor
+    '''
+
+    global io_executor
+
+    with io_lock:
+        if io_executor is None:
+            io_executor = ThreadPoolExecutor(max_workers=config.file_save['io_workers'],
+                                             thread_name_prefix='storage-io')
+
+        return io_executor
+
+def run_in_background(function, *args, **kwargs):
+    '''
+    Runs a call on a long-lived background thread - closing the thread's database connections before and after,
+    if they're broken or past their age. Request threads get this from request_started and request_finished,
+    which these threads never see - so without it, their connections break after a database restart.
+
+    Parameters
+    ----------
+    function : callable
+        The function to call.
+    *args, **kwargs
+        Its arguments.
+
+    Returns
+    -------
+    The function's result.
+    '''
+
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+async def run_io(function, *args, **kwargs):
+    '''
+    Runs a blocking call - e.g. saving or loading game files - in the io pool, and waits for it without blocking the event loop.
+    The storage backends (and boto3 underneath them) are synchronous, so this is how async code reaches them.
+
+    Parameters
+    ----------
+    function : callable
+        The function to call.
+    *args, **kwargs
+        Its arguments.
+
+    Returns
+    -------
+    The function's result.
+    '''
+
+    loop = asyncio.get_running_loop()
+
+    return await loop.run_in_executor(get_io_executor(), functools.partial(run_in_background, function, *args, **kwargs))
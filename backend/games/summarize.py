@@ -1,13 +1,96 @@
-''' Functions to summarize text - for the purpose of increasing latency and decreasing costs from LLM API calls. '''
+'''
+Functions to summarize text - for the purpose of increasing latency and decreasing costs from LLM API calls.
+A turn's summary is written in the background once the turn is saved, so the player doesn't wait for it.
+As a game goes on, its older turn summaries are folded into acts, and its older acts into an arc - 
+so the main loop prompt stays about the same size, however long the game gets.
+'''
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import zlib
+
+from django.db.models import F
+
+import config
 
 from games.decorators import retry_on_exception, catch_and_log
-from games.prompting import prompt
+from games.load_game import iter_history, load_history
+from games.models import Game
+from games.prompt_state import advance
+from games.prompting import aprompt
+from games.save_game import make_turn_records
+from games.storage import run_io
+from games.write_behind import save_turn_records
+
+
+logger = logging.getLogger(__name__)
+
+
+# the user messages in the summaries at the start of the game, where the player didn't write anything - in the order they're played
+SUMMARY_INPUTS = {
+    'crash': 'Start the story for me - have them crash land.',
+    'wakeup': 'Now tell the story of them waking up in this new, strange place.',
+}
+
+# summaries are written on an event loop of their own, in a background thread - started the first time it's needed
+## it outlives the requests that submit them, and its async client keeps its connections open between summaries
+summary_loop = None
+# limits how many summaries are written at once - created on the summary loop
+summary_slots = None
+# the summaries still being written, by game - in the order they'll be saved
+pending = {}
+# the games whose story summaries are being folded - by the summary loop, so only one fold runs per game
+folding = set()
+lock = threading.Lock()
+
+def reset():
+    '''
+    Forgets the summary loop and the pending summaries - the loop's thread doesn't survive into a forked child process,
+    so a new one gets started there on first use.
+
+    Returns
+    -------
+    None
+    '''
+
+    global summary_loop, summary_slots, lock
+
+    summary_loop = None
+    summary_slots = None
+    pending.clear()
+    folding.clear()
+    lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset)
+
+def start():
+    '''
+    Starts the summary loop, if it isn't running already.
+
+    Returns
+    -------
+    asyncio.AbstractEventLoop
+        The loop.
+    '''
+
+    global summary_loop, summary_slots
+
+    with lock:
+        if summary_loop is None:
+            summary_loop = asyncio.new_event_loop()
+            summary_slots = asyncio.Semaphore(config.llm['summary_workers'])
+            threading.Thread(target=summary_loop.run_forever, name='summaries', daemon=True).start()
+
+        return summary_loop
 
 
 @retry_on_exception(max_retries=3, delay=3)
-def summarize(text, target_words=50):
+async def summarize(text, target_words=50):
     ''' 
-    Uses the LLM to summarize text.
+    Uses the LLM to summarize text - a coroutine, so the event loop is free while it waits for the LLM.
 
     Parameters
     ----------
@@ -34,8 +117,8 @@ and be sure to include them in your summary.\n'''
     summary_prompt = f"Summarize the following text in {target_words} words: \n\n {text}"
 
     # prompt the LLM for a summary and cost
-    summary, cost = prompt(summary_prompt, 
-                        system=system_prompt, stream=False, caching=False)
+    summary, cost = await aprompt(summary_prompt, 
+                                  system=system_prompt, stream=False, caching=False, label='summarize')
     
 
     return summary, cost
@@ -77,4 +160,538 @@ def fix_summary_history(history):
             item['text'] = 'continue'
         new_history.append(item)
     
-    return new_history
\ No newline at end of file
+    return new_history
+
+def save_summary(game_id, records, cost):
+    '''
+    Saves a turn's summaries records, and adds the cost of the summary to the game.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    records : list
+        The summaries records.
+    cost : float
+        The cost to generate the summary.
+
+    Returns
+    -------
+    None
+    '''
+
+    save_turn_records(game_id, {'full_text': [], 'summaries': records})
+
+    # added in the database, so it doesn't overwrite cost added by the game's requests at the same time
+    Game.objects.filter(id=game_id).update(total_dollar_cost=F('total_dollar_cost') + cost)
+
+async def write_summary(game_id, entry, response, user_input, summary_input, previous):
+    '''
+    Summarizes a turn's response, and saves its summaries records - once the summary before it has been saved.
+    If the summary can't be written, the full text is saved in its place.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    entry : dict
+        The turn's pending entry.
+    response : str
+        The AI's response.
+    user_input : str | None
+        The user input that the AI responded to.
+    summary_input : str | None
+        A user message for summaries only, in place of the user input.
+    previous : concurrent.futures.Future | None
+        The game's previous pending summary, if there is one.
+
+    Returns
+    -------
+    None
+    '''
+
+    try:
+        async with summary_slots:
+            try:
+                summary, cost = await summarize(response, target_words=config.llm['summarization_target_word_count'])
+                records = make_turn_records(entry['turn'], response, summary,
+                                            user_input=user_input, summary_input=summary_input)['summaries']
+            except Exception:
+                logger.exception(f'Error summarizing turn {entry["turn"]} for game id={game_id} - saving the full text instead')
+                records, cost = entry['records'], 0
+
+        # the summaries are saved in turn order
+        if previous is not None:
+            await asyncio.wait([asyncio.wrap_future(previous)])
+
+        # a summary submitted again (see resubmit_summaries) may have been saved by the process that first wrote it
+        if await run_io(summary_saved, game_id, entry['turn']):
+            logger.info(f'The summary of turn {entry["turn"]} for game id={game_id} has already been saved')
+        else:
+            await run_io(save_summary, game_id, records, cost)
+    except Exception:
+        logger.exception(f'Error saving the summary of turn {entry["turn"]} for game id={game_id}')
+    finally:
+        with lock:
+            entries = pending.get(str(game_id), [])
+            if entry in entries:
+                entries.remove(entry)
+            if not entries:
+                pending.pop(str(game_id), None)
+
+    # the older turns get folded into the story summary - the next turn doesn't wait for it
+    asyncio.ensure_future(fold_story(game_id))
+
+def defer_summary(game_id, turn, response, user_input=None, summary_input=None):
+    '''
+    Submits a turn's summary to be written in the background - call it once the turn's full text has been saved.
+    The summaries records are saved when it's done, after any summaries still pending from the game's earlier turns.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    turn : int | str
+        The turn number.
+    response : str
+        The AI's response - to summarize.
+    user_input : str | None
+        The user input that the AI responded to.
+    summary_input : str | None
+        A user message for summaries only, in place of the user input.
+        Used for the start of the game, where the player didn't write anything.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        Done once the summary has been saved.
+    '''
+
+    loop = start()
+
+    # until the summary is saved, the prompt can stand the full text in for it
+    entry = {
+        'turn': turn,
+        'records': make_turn_records(turn, response, response,
+                                     user_input=user_input, summary_input=summary_input)['summaries'],
+    }
+
+    with lock:
+        entries = pending.setdefault(str(game_id), [])
+        previous = entries[-1]['future'] if entries else None
+
+        entry['future'] = asyncio.run_coroutine_threadsafe(
+            write_summary(game_id, entry, response, user_input, summary_input, previous), loop)
+        entries.append(entry)
+
+    return entry['future']
+
+async def wait_for_summaries(game_id, timeout=None):
+    '''
+    Waits for a game's pending summaries to be saved - apart from the latest turn's,
+    which the main loop prompt doesn't need, as it uses the turn's full text.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    timeout : float | None
+        The longest to wait, in seconds. If None, uses the configured time.
+
+    Returns
+    -------
+    list
+        The summaries still pending (including the latest turn's) - each with its turn, 
+        and the records to stand in for it (with the full text in place of the summary).
+    '''
+
+    if timeout is None:
+        timeout = config.llm['summary_wait']
+
+    with lock:
+        entries = list(pending.get(str(game_id), []))
+
+    # the summaries are saved in order - so once the one before the latest is saved, they all are
+    if len(entries) > 1:
+        done, _ = await asyncio.wait([asyncio.wrap_future(entries[-2]['future'])], timeout=timeout)
+        if not done:
+            logger.warning(f'Summaries for game id={game_id} are still pending after {timeout}s - using the full text.')
+
+    with lock:
+        return [{'turn': entry['turn'], 'records': entry['records']} for entry in pending.get(str(game_id), [])]
+
+def stand_in_records(pending_summaries, last):
+    '''
+    Returns the records to stand in for the summaries that haven't been saved yet.
+
+    Parameters
+    ----------
+    pending_summaries : list
+        The turns without saved summaries, from find_unsummarized (or wait_for_summaries).
+    last : dict | None
+        The last summaries record that has been saved.
+        Any pending summaries up to and including its turn were saved after they were looked up.
+
+    Returns
+    -------
+    list
+        The records, in order.
+    '''
+
+    turns = [entry['turn'] for entry in pending_summaries]
+
+    if last is not None and last.get('turn') in turns:
+        pending_summaries = pending_summaries[turns.index(last['turn']) + 1:]
+
+    return [record for entry in pending_summaries for record in entry['records']]
+
+
+def group_turns(records):
+    '''
+    Groups summaries records by turn.
+
+    Parameters
+    ----------
+    records : list
+        The records, in order.
+
+    Returns
+    -------
+    list
+        The records of each turn, in order.
+    '''
+
+    turns = []
+
+    for record in records:
+        if turns and turns[-1][-1].get('turn') == record.get('turn'):
+            turns[-1].append(record)
+        else:
+            turns.append([record])
+
+    return turns
+
+def checksum(records):
+    '''
+    Returns a checksum of some summaries records - to tell whether the records folded into a story summary have changed.
+
+    Parameters
+    ----------
+    records : list
+        The records.
+
+    Returns
+    -------
+    int
+    '''
+
+    return zlib.crc32(json.dumps([[record['writer'], record['text']] for record in records]).encode('utf-8'))
+
+def format_turns(records):
+    '''
+    Formats summaries records as a single piece of text, to be summarized.
+
+    Parameters
+    ----------
+    records : list
+        The records.
+
+    Returns
+    -------
+    str
+    '''
+
+    return '\n\n'.join(f'{"Story" if record["writer"] == "ai" else "Player"}: {record["text"]}' for record in records)
+
+async def fold_story(game_id):
+    '''
+    Folds a game's older turn summaries into acts, and its older acts into the arc - keeping at least the latest
+    few turns as they are. Runs on the summary loop, once a turn's summary has been saved.
+    A story summary that no longer matches the summaries (e.g. after a rollback) is built again from the start.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    dict | None
+        The game's story summary, if it changed.
+    '''
+
+    if str(game_id) in folding:
+        return None
+
+    # the check and the add happen without giving up the loop - so they can't be split by another fold
+    folding.add(str(game_id))
+
+    try:
+        # the database calls go through the io pool too - this loop's thread never sees a request, to have its connections closed
+        game = await run_io(Game.objects.get, id=game_id)
+        records = await run_io(load_history, game_id, summaries=True)
+
+        story = game.story_summary
+        if story is not None and after_story(story, records) is None:
+            logger.warning(f'Story summary of game id={game_id} no longer matches its summaries - folding it again')
+            story = None
+        if story is None:
+            story = {'arc': None, 'acts': [], 'records': 0, 'messages': 0, 'turn': None, 'checksum': None}
+
+        act_turns = config.llm['act_turns']
+        turns = group_turns(records[story['records']:])
+        cost = 0
+        changed = False
+
+        while len(turns) > config.llm['recent_turns'] + act_turns:
+            act, turns = [record for turn in turns[:act_turns] for record in turn], turns[act_turns:]
+            end = story['records'] + len(act)
+
+            # the turns after the act have to start with the player - an LLM conversation can't start with the AI
+            if act[-1]['writer'] != 'ai' or records[end]['writer'] != 'user':
+                break
+
+            async with summary_slots:
+                text, act_cost = await summarize(format_turns(act), target_words=config.llm['act_target_word_count'])
+            cost += act_cost
+
+            # the prompt state drops the first of two records in a row from the same writer -
+            ## so the records in the act don't map one to one onto its messages
+            settled, _ = advance(None, records[:end + 1])
+
+            story = {
+                **story,
+                'acts': story['acts'] + [{'text': text, 'first_turn': act[0].get('turn'), 'last_turn': act[-1].get('turn')}],
+                'records': end,
+                'messages': len(settled),
+                'turn': act[-1].get('turn'),
+                'checksum': checksum(records[:end]),
+            }
+            changed = True
+
+            if len(story['acts']) > config.llm['recent_acts']:
+                folded = story['acts'][:-config.llm['recent_acts']]
+                text = f'The story so far:\n{story["arc"]["text"]}\n\nThen:\n' if story['arc'] else ''
+                text += '\n\n'.join(act['text'] for act in folded)
+
+                async with summary_slots:
+                    arc, arc_cost = await summarize(text, target_words=config.llm['arc_target_word_count'])
+                cost += arc_cost
+
+                story['arc'] = {'text': arc, 'last_turn': folded[-1]['last_turn']}
+                story['acts'] = story['acts'][-config.llm['recent_acts']:]
+
+        if changed:
+            await run_io(Game.objects.filter(id=game_id).update, story_summary=story, 
+                         total_dollar_cost=F('total_dollar_cost') + cost)
+            logger.info(f'Folded the story of game id={game_id} up to turn {story["turn"]} - '
+                        f'{len(story["acts"])} acts{" and the arc" if story["arc"] else ""}')
+            return story
+    except Exception:
+        logger.exception(f'Error folding the story summary of game id={game_id}')
+    finally:
+        folding.discard(str(game_id))
+
+    return None
+
+def after_story(story, items, messages=False):
+    '''
+    Returns the items of a game's history that come after the turns folded into its story summary.
+
+    Parameters
+    ----------
+    story : dict
+        The game's story summary.
+    items : list
+        The summaries records - or the prompt state's messages.
+    messages : bool | False
+        If True, the items are the prompt state's messages.
+
+    Returns
+    -------
+    list | None
+        The items - or None if the story summary doesn't fit them, e.g. if its turns were rolled back.
+        Then, the prompt should have all the items, without the story summary.
+    '''
+
+    if story['records'] == 0:
+        return items
+
+    if messages:
+        # the messages can't be checked - but the latest turns are never folded, so there's always more of them
+        ## a story summary that's out of date gets folded again once the turn's summary is saved
+        if len(items) <= story['messages']:
+            return None
+        return items[story['messages']:]
+
+    # turns rolled back and played again can have the same numbers - so the records are checked too
+    if len(items) <= story['records'] or checksum(items[:story['records']]) != story['checksum']:
+        return None
+
+    return items[story['records']:]
+
+def describe_story(story):
+    '''
+    Describes the turns folded into a game's story summary, for the main loop's system prompt.
+
+    Parameters
+    ----------
+    story : dict | None
+        The game's story summary.
+
+    Returns
+    -------
+    str
+        The description - empty if nothing has been folded yet.
+    '''
+
+    if not story or not (story['arc'] or story['acts']):
+        return ''
+
+    text = 'Here is a summary of what happened earlier in the story, before the history below:\n'
+
+    if story['arc']:
+        text += f'{story["arc"]["text"]}\n\n'
+    for act in story['acts']:
+        text += f'{act["text"]}\n\n'
+
+    return text
+
+def turn_order(turn):
+    '''
+    Returns where a turn comes in the game - the crash and wakeup come before the numbered turns.
+
+    Parameters
+    ----------
+    turn : int | str
+        The turn.
+
+    Returns
+    -------
+    int | None
+        The turn's place, or None for records outside the turns (e.g. the intro).
+    '''
+
+    if turn in SUMMARY_INPUTS:
+        return list(SUMMARY_INPUTS).index(turn) - len(SUMMARY_INPUTS)
+
+    return turn if isinstance(turn, int) else None
+
+def summary_saved(game_id, turn):
+    '''
+    Checks whether a turn's summary has been saved - e.g. by another process, while this one was writing it again.
+    Summaries are saved in turn order, so only the ones from this turn on need reading.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    turn : int | str
+        The turn.
+
+    Returns
+    -------
+    bool
+    '''
+
+    history = iter_history(game_id, summaries=True, newest_first=True)
+    try:
+        for record in history:
+            if record.get('turn') == turn:
+                return True
+
+            # past the turn, without finding it
+            order = turn_order(record.get('turn'))
+            if order is not None and order < turn_order(turn):
+                return False
+    finally:
+        history.close()
+
+    return False
+
+def find_unsummarized(game_id, last):
+    '''
+    Finds the turns after the last one with a saved summary, from their full text - 
+    e.g. the turns whose summaries are still being written, in this process or another,
+    or whose summaries were lost when a process stopped.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    last : dict | None
+        The last summaries record that has been saved.
+
+    Returns
+    -------
+    list
+        The turns, in order - each with its turn, response and user input, 
+        and the records to stand in for its summaries (with the full text in place of the summary).
+    '''
+
+    turns = []
+
+    # the latest turns come first - usually only the latest turn's full text needs reading
+    history = iter_history(game_id, newest_first=True)
+    try:
+        for record in history:
+            if last is not None and record.get('turn') == last.get('turn'):
+                break
+
+            # the intro isn't summarized
+            if record['writer'] == 'intro':
+                continue
+
+            if not turns or turns[-1]['turn'] != record.get('turn'):
+                turns.append({'turn': record.get('turn'), 'response': None, 'user_input': None})
+
+            if record['writer'] == 'ai':
+                turns[-1]['response'] = record['text']
+            else:
+                turns[-1]['user_input'] = record['text']
+    finally:
+        history.close()
+
+    # a turn without a response was never finished - the main loop removes it
+    turns = [turn for turn in turns[::-1] if turn['response'] is not None]
+
+    for turn in turns:
+        turn['records'] = make_turn_records(turn['turn'], turn['response'], turn['response'],
+                                            user_input=turn['user_input'], 
+                                            summary_input=SUMMARY_INPUTS.get(turn['turn']))['summaries']
+
+    return turns
+
+def resubmit_summaries(game_id, unsummarized):
+    '''
+    Submits the summaries of turns that have none, and aren't being written in this process -
+    their summaries were being written by another process, which may have stopped.
+    If the other process saves its summary first, this one isn't saved.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    unsummarized : list
+        The turns without summaries, from find_unsummarized.
+
+    Returns
+    -------
+    list
+        The futures of the summaries submitted.
+    '''
+
+    with lock:
+        writing = {entry['turn'] for entry in pending.get(str(game_id), [])}
+
+    futures = []
+
+    for turn in unsummarized:
+        if turn['turn'] in writing:
+            continue
+
+        logger.warning(f'Turn {turn["turn"]} of game id={game_id} has no summary - summarizing it again')
+        futures.append(defer_summary(game_id, turn['turn'], turn['response'], user_input=turn['user_input'],
+                                     summary_input=SUMMARY_INPUTS.get(turn['turn'])))
+
+    return futures
@@ -33,6 +33,7 @@ urlpatterns = [
     # game loading
     path('load_game_info/', views.load_game_info),
     path('load_game/', views.load_game),
+    path('<int:game_id>/history/', views.history),
 
     # main gameplay
     path('main_loop/', views.main_loop),
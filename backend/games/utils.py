@@ -1,11 +1,8 @@
 ''' Contains utility functions for the games app. '''
 
-import os
 import yaml
 
-import config
-
-from games.s3 import list_objects, read_object, check_object_exists
+from games.storage import get_storage
 
 
 def load_yaml(file):
@@ -68,8 +65,9 @@ def add_info_to_initialization_prompt(theme, timeframe, details, prompt=''):
 
 def get_gamefile_listdir(path):
     ''' 
-    Returns the list of files in a game file - either local or from s3, depending on the environment.
-    All files should be named with an integer, e.g. 1.json, 2.json, etc. 
+    Returns the list of files in a game file, from the configured storage backend.
+    All files should be named with an integer, e.g. 1.json, 2.jsonl, etc. 
+    Files are returned in numerical order, so the latest file is always last.
 
     Parameters
     ----------
@@ -82,24 +80,22 @@ def get_gamefile_listdir(path):
         The list of files in the directory/prefix.
     '''
 
-    if config.ENV == 'DEV':
-        files = sorted(os.listdir(path))
-
-    else:
-        files = list_objects(config.s3['data_bucket'], prefix=path)
+    files = get_storage().list(path)
 
-    # remove any files that don't end in .json
-    files = [file for file in files if file.endswith('.json')]
+    # remove any files that don't end in .json or .jsonl
+    ## .json files are legacy chunks, holding a single json list
+    ## .jsonl files are append-only chunks, holding one json record per line
+    files = [file for file in files if file.endswith(('.json', '.jsonl'))]
 
     # filter out any files that don't start with an integer
     files = [file for file in files if file.split('.')[0].isdigit()]
 
-    return files
+    # sort numerically - so that 10.jsonl comes after 9.jsonl
+    return sorted(files, key=lambda file: int(file.split('.')[0]))
 
 def get_file_size(filepath):
     '''
-    Returns the size of a file in bytes.
-    Loads file locally or from s3, depending on the environment.
+    Returns the size of a file in bytes, from the configured storage backend.
 
     Parameters
     ----------
@@ -112,15 +108,11 @@ def get_file_size(filepath):
         The size of the file in bytes.
     '''
 
-    if config.ENV == 'DEV':
-        return os.path.getsize(filepath)
-    else:
-        return len(read_object(config.s3['data_bucket'], filepath))
-    
+    return get_storage().size(filepath)
+
 def check_file_exists(filepath):
     '''
-    Checks if a file exists.
-    Loads file locally or from s3, depending on the environment.
+    Checks if a file exists in the configured storage backend.
 
     Parameters
     ----------
@@ -133,8 +125,4 @@ def check_file_exists(filepath):
         Whether the file exists.
     '''
 
-    if config.ENV == 'DEV':
-        return os.path.exists(filepath)
-    else:
-        return check_object_exists(config.s3['data_bucket'], filepath)
-
+    return get_storage().exists(filepath)
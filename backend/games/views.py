@@ -1,16 +1,18 @@
 ''' The views for the server. '''
 
+import asyncio
 import json
 import logging
-import os
-import time
 import requests
 from uuid import uuid4
 
 from django_eventstream import send_event
 from django.core.mail import send_mail
+from django.db.models import F
 from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import APIException
 from rest_framework import viewsets
@@ -18,12 +20,20 @@ from rest_framework import viewsets
 import config
 
 import games.initialization as initialization
-from games.load_game import load_history, load_latest_file, load_json
+from games.chain import run_chain
+from games.intro import render_intro
+from games.load_game import (load_history, load_latest_file, load_last_record, load_initialization,
+                             load_prompt_state, iter_history, count_history, load_history_page)
 from games.models import Game, Location, Character, Skill
-from games.prompting import prompt
-from games.save_game import save_text, remove_turn
+from games.pacing import PacedStream
+from games.prompting import aprompt, build_system_prompt
+from games.prompt_state import advance, build_messages, estimate_tokens, fit_to_budget, to_message, words_to_tokens
+from games.save_game import save_text, save_intro, remove_turn
 from games.serializers import CharacterSerializer, SkillSerializer
-from games.summarize import summarize, fix_summary_history
+from games.storage import run_io
+from games.summarize import (SUMMARY_INPUTS, after_story, defer_summary, describe_story, find_unsummarized, 
+                             fix_summary_history, resubmit_summaries, stand_in_records, wait_for_summaries)
+from games.write_behind import save_turn
 
 
 logger = logging.getLogger(__name__)
@@ -91,6 +101,208 @@ class SkillViewSet(viewsets.ModelViewSet):
             raise CustomAPIException()
 
 
+## Helpers for the async views
+## DRF's views are synchronous - so the views that stream from the LLM are plain async django views,
+## which don't hold a thread while they wait on the LLM. Blocking storage calls go through the io pool.
+
+def get_data(request):
+    '''
+    Returns the parameters sent to an async view - the json body, or the form data.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request.
+
+    Returns
+    -------
+    dict
+    '''
+
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+
+    return request.POST
+
+async def send_text(game_id, text):
+    '''
+    Sends a piece of text to the player, over the game's event stream.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    text : str
+        The text.
+
+    Returns
+    -------
+    None
+    '''
+
+    # the event may be stored in the database, so it's sent from the io pool
+    await run_io(send_event, f'game-{game_id}', 'message', {'text': text})
+
+async def update_game(game_id, cost, **fields):
+    '''
+    Adds to a game's cost, and sets any other fields, in a single update.
+    The cost is added in the database - summaries are written in the background, and add their cost at the same time.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    cost : float
+        The cost to add.
+    **fields
+        Other fields to set, e.g. turns.
+
+    Returns
+    -------
+    None
+    '''
+
+    # a queryset update skips auto_now - so modified is set here, as saving the game would
+    await Game.objects.filter(id=game_id).aupdate(total_dollar_cost=F('total_dollar_cost') + cost, 
+                                                  modified=timezone.now(), **fields)
+
+def email_game_info(meta, game_id, title, theme, timeframe, details):
+    '''
+    Sends me an email with a new game's info, and where the player is.
+
+    Parameters
+    ----------
+    meta : dict
+        The request's META - for the player's ip address.
+    game_id : int
+        The game id.
+    title : str
+        The game's title.
+    theme : str
+        The theme of the game.
+    timeframe : str
+        The timeframe of the game.
+    details : str
+        The details of the game.
+
+    Returns
+    -------
+    None
+    '''
+
+    try: 
+        # get user's ip address
+        ip = meta.get("HTTP_X_REAL_IP")
+        
+        # get the location
+        response = requests.get(f'http://ip-api.com/json/{ip}')
+
+        country = response.json()['country']
+        region = response.json()['regionName']
+        city = response.json()['city']
+    except:
+        # if that way doesn't work, try using x_forwarded_for
+        try:
+            # get the user's IP address
+            x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+
+            if x_forwarded_for:
+                ip = x_forwarded_for.split(',')[0]
+            else:
+                ip = meta.get('REMOTE_ADDR')
+
+            # get the location
+            response = requests.get(f'http://ip-api.com/json/{ip}')
+
+            country = response.json()['country']
+            region = response.json()['regionName']
+            city = response.json()['city']
+        except:
+            message = f'''Error getting user location.
+            ip = {ip}
+            response = {response.json()}
+            '''
+            logger.exception(message)
+            country = 'Unknown'
+            region = 'Unknown'
+            city = 'Unknown'
+        
+    try:
+        # send myself an email with the game info
+        send_mail(
+            title,
+            f'''New game of Crash:
+
+        Game ID: {game_id}
+
+        Theme: {theme}
+        Timeframe: {timeframe}
+        Details: {details}
+
+        User location: {city}, {region}, {country}
+        Current env: {config.ENV}
+            ''',
+            config.email['from_address'],
+            [config.email['to_address']],
+        )
+    # if there's an error, log it and move on
+    except:
+        logger.exception('Error sending email with game info.')
+        pass
+
+def remove_user_messages(game_id):
+    '''
+    Checks whether the last item in the summaries/full text is a user message - and if it is, removes it.
+    Something probably went wrong, preventing the AI from responding to it.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    None
+    '''
+
+    for type in ['full_text', 'summaries']:
+        last = load_last_record(game_id, type=type)
+
+        if last is None or last['writer'] != 'user':
+            continue
+
+        logger.info(f'Removing user message from {type}.')
+
+        if 'turn' in last:
+            # roll back its turn with a tombstone, rather than rewriting the latest chunk
+            remove_turn(game_id, last['turn'], types=(type,))
+        else:
+            records = load_latest_file(game_id, type=type)[:-1]
+            save_text(game_id=game_id, new_data=records, writer='ai', save_type='overwrite', type=type)
+
+def send_history(stream, game_id, newest_first):
+    '''
+    Reads a game's history, and schedules each item to be sent as soon as it's read.
+
+    Parameters
+    ----------
+    stream : PacedStream
+        The stream to send the history on.
+    game_id : int
+        The game id.
+    newest_first : bool
+        Whether to send the latest first.
+
+    Returns
+    -------
+    None
+    '''
+
+    for item in iter_history(game_id, newest_first=newest_first):
+        stream.send({'item': item, 'newest_first': newest_first})
+    stream.close()
+
+
 ## API Views
 
 @csrf_exempt
@@ -143,8 +355,8 @@ def random_setup(request):
     })
 
 @csrf_exempt
-@api_view(['POST'])
-def initialize_game_title(request):
+@require_POST
+async def initialize_game_title(request):
     '''
     Given a theme and details, creates a title for the game scenario and returns it to the frontend.
 
@@ -162,23 +374,24 @@ def initialize_game_title(request):
 
     
     # get parameters
-    game_id = request.data['game_id']
-    theme = request.data['theme']
-    timeframe = request.data['timeframe']
-    details = request.data['details']
+    data = get_data(request)
+    game_id = data['game_id']
+    theme = data['theme']
+    timeframe = data['timeframe']
+    details = data['details']
 
     try:
         # generate the title and the cost to create it
-        title, cost = initialization.create_title(theme=theme, timeframe=timeframe, details=details)
+        title, cost = await initialization.create_title(theme=theme, timeframe=timeframe, details=details)
 
         # update the game
-        game = Game.objects.get(id=game_id)
+        game = await Game.objects.aget(id=game_id)
         game.theme = theme
         game.timeframe = timeframe
         game.starting_details = details
         game.title = title
         game.total_dollar_cost += cost
-        game.save()
+        await game.asave()
     except:
         logger.exception(f'Error initializing game title.')
         return HttpResponse('Error initializing game. Please try again.', status=255)
@@ -186,72 +399,14 @@ def initialize_game_title(request):
     logger.info(f'Game title created for game id={game_id}: {title} -- theme: {theme}, timeframe: {timeframe}, details: {details}')
 
     # send me an email with game info
-    try: 
-        # get user's ip address
-        ip = request.META.get("HTTP_X_REAL_IP")
-        
-        # get the location
-        response = requests.get(f'http://ip-api.com/json/{ip}')
-
-        country = response.json()['country']
-        region = response.json()['regionName']
-        city = response.json()['city']
-    except:
-        # if that way doesn't work, try using x_forwarded_for
-        try:
-            # get the user's IP address
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-
-            if x_forwarded_for:
-                ip = x_forwarded_for.split(',')[0]
-            else:
-                ip = request.META.get('REMOTE_ADDR')
-
-            # get the location
-            response = requests.get(f'http://ip-api.com/json/{ip}')
-
-            country = response.json()['country']
-            region = response.json()['regionName']
-            city = response.json()['city']
-        except:
-            message = f'''Error getting user location.
-            ip = {ip}
-            response = {response.json()}
-            '''
-            logger.exception(message)
-            country = 'Unknown'
-            region = 'Unknown'
-            city = 'Unknown'
-        
-    try:
-        # send myself an email with the game info
-        send_mail(
-            title,
-            f'''New game of Crash:
-
-        Game ID: {game_id}
-
-        Theme: {theme}
-        Timeframe: {timeframe}
-        Details: {details}
-
-        User location: {city}, {region}, {country}
-        Current env: {config.ENV}
-            ''',
-            config.email['from_address'],
-            [config.email['to_address']],
-        )
-    # if there's an error, log it and move on
-    except:
-        logger.exception('Error sending email with game info.')
-        pass
+    await run_io(email_game_info, request.META, game_id, title, theme, timeframe, details)
 
     # return the title
     return JsonResponse({'title': title})
 
 @csrf_exempt
-@api_view(['POST'])
-def initialize_game_crash(request):
+@require_POST
+async def initialize_game_crash(request):
     '''
     Given a game (which should now have a theme, details, and a title), 
     generates a crash story, to be sent back to the frontend.
@@ -263,52 +418,43 @@ def initialize_game_crash(request):
     '''
 
     # wait some time, to let the player read the title
-    time.sleep(1)
+    await asyncio.sleep(1)
     
     # get parameters
-    game_id = request.data['game_id']
+    game_id = get_data(request)['game_id']
 
     # get the game
-    game = Game.objects.get(id=game_id)
+    game = await Game.objects.aget(id=game_id)
 
     logger.info(f'Generating crash story for game id={game_id}')
 
     crash_story = ''
+    cost = 0
 
     try:
         # iterate through
-        for chunk in initialization.create_crash(title=game.title, theme=game.theme,
+        async for chunk in await initialization.create_crash(title=game.title, theme=game.theme,
                                         timeframe=game.timeframe, details=game.starting_details):
             
             if chunk['type'] == 'text':
                 crash_story += chunk['text']
-                send_event(f'game-{game.id}', 'message', {'text': chunk['text']})
+                await send_text(game.id, chunk['text'])
             elif chunk['type'] == 'message_stop':
-                cost = chunk['cost']
-                game.total_dollar_cost += cost
+                cost += chunk['cost']
     except:
         logger.exception(f'Error generating crash story for game id={game_id}')
         return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
 
     try:
-        # save the crash story to file
-        save_text(game_id=game_id, new_data=crash_story, turn='crash', writer='ai')
-
-        # summarize the crash story
-        summary, summary_cost = summarize(crash_story, target_words=config.llm['summarization_target_word_count'])
-
-        # save a user message to summary file
-        crash_message = 'Start the story for me - have them crash land.'
-        save_text(game_id=game_id, new_data=crash_message, writer='user', turn='crash', type='summaries')
-
-        # then save the summary to file
-        save_text(game_id=game_id, new_data=summary, writer='ai', turn='crash', type='summaries')
+        # save the crash story - it's summarized in the background, and the summary saved after it
+        ## with a user message in the summaries, standing in for the prompt
+        await run_io(save_turn, game_id, 'crash', crash_story, None)
+        defer_summary(game_id, 'crash', crash_story, summary_input=SUMMARY_INPUTS['crash'])
 
         # update the game cost
-        game.total_dollar_cost += summary_cost
-        game.save()
+        await update_game(game_id, cost)
     except:
-        logger.exception(f'Error summarizing and saving crash story for game id={game_id}')
+        logger.exception(f'Error saving crash story for game id={game_id}')
         return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
     
     logger.info(f'Crash story generated for game id={game_id}')
@@ -317,8 +463,8 @@ def initialize_game_crash(request):
     return JsonResponse({'crash_story': crash_story})
 
 @csrf_exempt
-@api_view(['POST'])
-def initialize_game_wakeup(request):
+@require_POST
+async def initialize_game_wakeup(request):
     '''
     Given a game, generates the wake-up scene for the player.
 
@@ -331,137 +477,142 @@ def initialize_game_wakeup(request):
     '''
     
     # get parameters
-    game_id = request.data['game_id']
-    crash_story = request.data['crash_story']
+    data = get_data(request)
+    game_id = data['game_id']
+    crash_story = data['crash_story']
 
     try:
         # get the game
-        game = Game.objects.get(id=game_id)
-
-        # first, we need to generate the starting location description
-        location_name, location_description, location_cost = initialization.create_location(crash_story, title=game.title, theme=game.theme,
-                                                                                            timeframe=game.timeframe, details=game.starting_details)
+        game = await Game.objects.aget(id=game_id)
+    except:
+        logger.exception(f'Error getting game id={game_id}')
+        return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
 
-        # then, create a new location object
-        location = Location.objects.create(
+    info = {'title': game.title, 'theme': game.theme, 'timeframe': game.timeframe, 'details': game.starting_details}
+    # the cost of each LLM call
+    costs = []
+
+    ## the steps of the wakeup chain - each runs as soon as the steps it needs have finished
+    ## the location name and the saving don't hold up the next LLM call, and the wakeup scene starts streaming
+    ## as soon as the characters are ready
+
+    # the starting location description - everything else builds on it
+    async def location_description():
+        description, cost = await initialization.create_location(crash_story, **info)
+        costs.append(cost)
+        return description
+
+    async def location_name(location_description):
+        name, cost = await initialization.create_location_name(location_description)
+        costs.append(cost)
+        return name
+
+    # skills that match the location/scenario
+    async def skills(location_description):
+        skills_str, skills_list, cost = await initialization.create_skills(crash_story, location_description, **info)
+        costs.append(cost)
+        return skills_str, skills_list
+
+    # characters that match the location, scenario, and skills
+    async def characters(location_description, skills):
+        characters_str, characters_list, cost = await initialization.create_characters(crash_story, location_description,
+                                                                                        skills[0], **info)
+        costs.append(cost)
+        return characters_str, characters_list
+
+    # the initialization file is read back by position - so the saves happen in order, each after the one before
+    async def save_location(location_name, location_description):
+        location = await Location.objects.acreate(
             name=location_name,
             description=location_description
         )
+        await game.locations.aadd(location)
 
-        # add the location to the game
-        game.locations.add(location)
-        # update game cost
-        game.total_dollar_cost += location_cost
-        game.save()
+        await run_io(save_text, game_id=game_id, new_data=f'Location name: {location_name}', writer='ai', type='initialization')
+        await run_io(save_text, game_id=game_id, new_data=f'Location description: {location_description}', writer='ai', type='initialization')
 
-        # save location info to the initialization file
-        save_text(game_id=game_id, new_data=f'Location name: {location_name}', writer='ai', type='initialization')
-        save_text(game_id=game_id, new_data=f'Location description: {location_description}', writer='ai', type='initialization')
+    async def save_skills(skills, save_location):
+        skills_str, skills_list = skills
 
-        # now we need to generate skills that match the location/scenario
-        skills_str, skills_list, skills_cost = initialization.create_skills(crash_story, location_description, 
-                                                                            title=game.title, theme=game.theme,
-                                                                            timeframe=game.timeframe, details=game.starting_details)
-    
-        # create skill objects and add to the game
         for name, description in skills_list:
-            skill = Skill.objects.create(
+            skill = await Skill.objects.acreate(
                 name=name,
                 description=description
             )
+            await game.skills.aadd(skill)
 
-            game.skills.add(skill)
-        
-        # update game cost
-        game.total_dollar_cost += skills_cost
-        game.save()
-
-        # save skills to file
-        save_text(game_id=game_id, new_data=f'Skills: {skills_str}', writer='ai', type='initialization')
-    
+        await run_io(save_text, game_id=game_id, new_data=f'Skills: {skills_str}', writer='ai', type='initialization')
 
+    async def save_characters(characters, save_skills):
+        characters_str, characters_list = characters
 
-        # now, we need to generate characters that match the location, scenario, and skills
-        characters_str, characters_list, characters_cost = initialization.create_characters(crash_story, location_description, skills_str,
-                                                                                            title=game.title, theme=game.theme,
-                                                                                            timeframe=game.timeframe, details=game.starting_details)
-    
-        # create the character objects and add to the game
         # characters list is a list of character dicts
         for character in characters_list:
-                
-            new_character = Character.objects.create(
+            new_character = await Character.objects.acreate(
                 name=character['name'],
                 history=character['history'],
                 physical_description=character['physical'],
                 personality=character['personality'],
                 skills=character['skills']
             )
+            await game.characters.aadd(new_character)
 
-            game.characters.add(new_character)
-
-        # update game cost
-        game.total_dollar_cost += characters_cost
-        game.save()
-
-        # save characters to file
-        save_text(game_id=game_id, new_data=f'Characters: {characters_str}', writer='ai', type='initialization')
-    
-    except:
-        logger.exception(f'Error generating wakeup info for game id={game_id}')
-        return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
+        await run_io(save_text, game_id=game_id, new_data=f'Characters: {characters_str}', writer='ai', type='initialization')
 
-    logger.info(f'Generating wakeup scene for game id={game_id}')
+    # finally, the wake up scene - streamed to the player
+    async def wakeup(location_description, skills, characters):
+        logger.info(f'Generating wakeup scene for game id={game_id}')
 
-    # finally, create the wake up scene, and return it to the player
-    wakeup_story = ''
+        wakeup_story = ''
 
-    # iterate through the wakeup story
-    try:
-        for chunk in initialization.create_wakeup(crash_story, location_description, skills_str, characters_str,
-                                                    title=game.title, theme=game.theme,
-                                                    timeframe=game.timeframe, details=game.starting_details):
+        async for chunk in await initialization.create_wakeup(crash_story, location_description, skills[0], characters[0], **info):
             
             # if it's text, yield it
             if chunk['type'] == 'text':
                 wakeup_story += chunk['text']
-                send_event(f'game-{game.id}', 'message', {'text': chunk['text']})
+                await send_text(game.id, chunk['text'])
             # the last chunk will be the message stop, which has cost data
             elif chunk['type'] == 'message_stop':
                 # add the cost to generate it
-                cost = chunk['cost']
-                game.total_dollar_cost += cost
-    except:
-        logger.exception(f'Error generating wakeup story for game id={game_id}')
-        return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
-    
-    try:
-        # save wakeup story to file
-        save_text(game_id=game_id, new_data=wakeup_story, turn='wakeup', writer='ai')
-
-        # summarize the wakeup story
-        summary, summary_cost = summarize(wakeup_story, target_words=config.llm['summarization_target_word_count'])
+                costs.append(chunk['cost'])
 
-        # save a user message to summary file
-        wakeup_message = 'Now tell the story of them waking up in this new, strange place.'
-        save_text(game_id=game_id, new_data=wakeup_message, writer='user', turn='wakeup', type='summaries')
+        return wakeup_story
 
-        # then save the summary to file
-        save_text(game_id=game_id, new_data=summary, writer='ai', turn='wakeup', type='summaries')
+    try:
+        results = await run_chain({
+            'location_description': (location_description, []),
+            'location_name': (location_name, ['location_description']),
+            'skills': (skills, ['location_description']),
+            'characters': (characters, ['location_description', 'skills']),
+            'save_location': (save_location, ['location_name', 'location_description']),
+            'save_skills': (save_skills, ['skills', 'save_location']),
+            'save_characters': (save_characters, ['characters', 'save_skills']),
+            'wakeup': (wakeup, ['location_description', 'skills', 'characters']),
+        }, name=f'Wakeup chain for game id={game_id}')
+
+        wakeup_story = results['wakeup']
 
         # update game cost
-        game.total_dollar_cost += summary_cost
-        game.save()
+        await update_game(game_id, sum(costs))
+    except:
+        logger.exception(f'Error generating wakeup for game id={game_id}')
+        return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
+    
+    try:
+        # save the wakeup story - it's summarized in the background, and the summary saved after it
+        ## with a user message in the summaries, standing in for the prompt
+        await run_io(save_turn, game_id, 'wakeup', wakeup_story, None)
+        defer_summary(game_id, 'wakeup', wakeup_story, summary_input=SUMMARY_INPUTS['wakeup'])
     except:
-        logger.exception(f'Error summarizing and saving wakeup story for game id={game_id}')
+        logger.exception(f'Error saving wakeup story for game id={game_id}')
         return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
 
     # return success
     return JsonResponse({'success': "we're looking good back here frontend - thanks for all your hard work"})
 
 @csrf_exempt
-@api_view(['POST'])
-def initialize_game_intro(request):
+@require_POST
+async def initialize_game_intro(request):
     '''
     Returns the game intro to the player.
 
@@ -472,52 +623,33 @@ def initialize_game_intro(request):
     '''
 
     # get the game ID
-    game_id = request.data['game_id']
+    game_id = get_data(request)['game_id']
 
     ## if we have trouble with these things, don't abort the game
     ## just don't include the character names in the intro
     # get the game
     try:
-        game = Game.objects.get(id=game_id)
+        game = await Game.objects.aget(id=game_id)
     except:
         logger.exception(f'Error getting game id={game_id}')
         character_names = None
 
     # get the game character names
     try:
-        character_names = [character.name.split()[0] for character in game.characters.all()]
+        character_names = [character.name.split()[0] async for character in game.characters.all()]
     except:
         logger.exception(f'Error getting character names for game id={game_id}')
         character_names = None
 
-    if not character_names:
-        starting_str = 'Some poor souls'
-    else:
-        starting_str = f'{character_names[0]}, {character_names[1]}, and {character_names[2]}'
-
-        
     # get the game intro
-    intro = f'''{starting_str} need your help!
-They're lost in a strange world, the unwitting and unwilling heroes of a story that they didn't want to be a part of.
-Now you - that's right, YOU - need to guide them through that story.
-
-Think of yourself as an angel (or devil), sitting on their shoulders, whispering in their ears.
-Each turn, you'll make suggestions and interact with your characters.
+    intro = render_intro(character_names)
 
-Speaking of the characters - on the right -> of the screen, you can see more info about your characters - their histories, personalities, skills.
-Be creative, be bold, be kind, be cruel. Do whatever you like - the world is your oyster!
-
-Speaking of the right of the screen - in the bottom right you should see a button that says 'Save Key'. 
-Click it.
-
-So - what will you do next?'''
-    
     # save the intro to file
     ## if we can't, skip it
     ## this will only affect if the player loads the game at a future time,
     ## and they won't see the intro
     try:
-        save_text(game_id=game_id, new_data=intro, writer='intro', turn='intro')
+        await run_io(save_intro, game_id, character_names)
     except:
         logger.exception(f'Error saving intro for game id={game_id}')
         pass
@@ -528,8 +660,8 @@ So - what will you do next?'''
     # if we have problems streaming it back, then raise an error
     try:
         for chunk in intro:
-            time.sleep(0.007)
-            send_event(f'game-{game_id}', 'message', {'text': chunk})
+            await asyncio.sleep(0.007)
+            await send_text(game_id, chunk)
     except:
         logger.exception(f'Error streaming intro for game id={game_id}')
         return HttpResponse('There was a problem initializing the game. Please try again.', status=255)
@@ -572,44 +704,106 @@ def load_game_info(request):
     return JsonResponse(game_info)
 
 @csrf_exempt
-@api_view(['POST'])
-def load_game(request):
+@require_POST
+async def load_game(request):
     '''
     Loads a game from a save key.
-    '''
+    The history is sent to the player as it's read - so the first of it arrives straight away, however long the game is.
 
-    # wait a couple seconds so the player can read the title, it doesn't all get thrown at once
-    time.sleep(1)
+    API Parameters
+    --------------
+    save_key : str
+        The game's save key.
+    order : str | 'oldest'
+        'oldest' to send the history from the start of the game, or 'newest' to send the latest first.
+    '''
 
-    save_key = request.data['save_key']
+    data = get_data(request)
+    save_key = data['save_key']
+    newest_first = data.get('order', 'oldest') == 'newest'
 
     try:
-        game = Game.objects.get(save_key=save_key)
+        game = await Game.objects.aget(save_key=save_key)
     except:
         logger.exception(f'Problem finding game with save key {save_key}')
         return HttpResponse('There was a problem retrieving your game - please try again.', status=255)
 
-    # load the game history
-    history = load_history(game.id)
-
     logger.info(f'Loading game for game id={game.id}')
 
-    # stream back the response
-    # want it to take a max of 4 seconds
-    time_per_chunk = 4 / len(history)
+    # the items are spread out, so they don't all get thrown at once - want it to take a max of a few seconds
+    ## they're paced by a background thread, and this view awaits them - so no thread is held while they go out
+    ## and there's a pause before the first one, so the player can read the title
+    count = await run_io(count_history, game.id)
+    interval = config.streaming['load_interval']
+    if count:
+        interval = min(config.streaming['load_seconds'] / count, interval)
+
+    stream = PacedStream(f'game-{game.id}', interval, delay=config.streaming['load_delay'])
+
+    # stream back the history, as it's read
     try:
-        for item in history:
-            time.sleep(min(time_per_chunk, 0.3))
-            send_event(f'game-{game.id}', 'message', {'item': item})
+        await run_io(send_history, stream, game.id, newest_first)
     except:
         logger.exception(f'Error streaming game for game id={game.id}')
+        stream.cancel()
+        return HttpResponse('There was a problem retrieving your game - please try again.', status=255)
+
+    # the frontend moves on once this returns - so wait until everything's been sent
+    timeout = config.streaming['load_delay'] + interval * (count or 0) + 30
+    if not await stream.wait(timeout):
+        logger.error(f'Error streaming game for game id={game.id}')
         return HttpResponse('There was a problem retrieving your game - please try again.', status=255)
     
     return JsonResponse({'success': 'game loaded - have fun!'})
 
 @csrf_exempt
-@api_view(['POST'])
-def main_loop(request):
+@api_view(['GET'])
+def history(request, game_id):
+    '''
+    Returns a page of a game's history - the turns just before a given turn.
+    The player gets the latest turns straight away, and pages back through the rest as they scroll.
+
+    API Parameters
+    --------------
+    X-Save-Key : str
+        The save key for the game - in a header, rather than the url, so it doesn't end up in logs or browser history.
+    before : int | str
+        The page ends just before this turn - the cursor returned with the page after it.
+        If not given, the page ends with the latest turn.
+    limit : int | 10
+        The most turns on the page - up to 100.
+    '''
+
+    save_key = request.headers.get('X-Save-Key')
+
+    try:
+        game = Game.objects.get(id=game_id, save_key=save_key)
+    except:
+        warning = 'Invalid save key.'
+        logger.exception(warning)
+        return HttpResponse(warning, status=255)
+
+    # numbered turns come through as strings
+    before = request.query_params.get('before')
+    if before is not None and before.isdigit():
+        before = int(before)
+
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+    except ValueError:
+        return HttpResponse('Invalid limit.', status=400)
+
+    try:
+        items, cursor = load_history_page(game.id, before=before, limit=limit)
+    except:
+        logger.exception(f'Error loading history page for game id={game.id}')
+        return HttpResponse('There was a problem retrieving your game - please try again.', status=255)
+
+    return JsonResponse({'items': items, 'before': cursor})
+
+@csrf_exempt
+@require_POST
+async def main_loop(request):
     '''
     The main loop of the game.
 
@@ -625,31 +819,21 @@ def main_loop(request):
         The current turn.
     '''
 
-    game_id = request.data['game_id']
-    user_input = request.data['user_input']
-    turn = int(request.data['turn'])
+    data = get_data(request)
+    game_id = data['game_id']
+    user_input = data['user_input']
+    turn = int(data['turn'])
 
     # frontend history - all the text displayed in the frontend
     ## includes the crash story, wakeup story, game intro, then all user input and AI responses
     ## ends in the current user input
-    frontend_history = request.data['history']
+    frontend_history = data['history']
     
     # first, check to see if the last item in summaries/full text is a user message
     ## if it is, then remove it
     ## something probably went wrong, preventing the AI from responding to it
     try:
-        full_text = load_latest_file(game_id, type='full_text')
-        summaries = load_latest_file(game_id, type='summaries')
-
-        if full_text[-1]['writer'] == 'user':
-            logger.info('Removing user message from full text.')
-            full_text = full_text[:-1]
-            save_text(game_id=game_id, new_data=full_text, writer='ai', save_type='overwrite')
-        
-        if summaries[-1]['writer'] == 'user':
-            logger.info('Removing user message from summaries.')
-            summaries = summaries[:-1]
-            save_text(game_id=game_id, new_data=summaries, writer='ai', save_type='overwrite', type='summaries')
+        await run_io(remove_user_messages, game_id)
     # if something goes wrong log it and pass
     except:
         logger.exception('Problem checking for user message in summaries/full text.')
@@ -659,7 +843,7 @@ def main_loop(request):
     # create the system prompt and history
     try:
         ## first, add the theme, timeframe, and details to the system prompt
-        game = Game.objects.get(id=game_id)
+        game = await Game.objects.aget(id=game_id)
     
         main_loop_prompt = 'Here is the title, theme, timeframe, and details of the game:\n'
 
@@ -670,14 +854,12 @@ def main_loop(request):
 
         ## then, add the location, skills, and characters to the system prompt
 
-        game_initialization_path = os.path.join(config.file_save['path'], str(game_id), 'initialization.json')
+        initialization_data = await run_io(load_initialization, game_id)
 
-        data = load_json(game_initialization_path)
-
-        location_name = data[0]['text']
-        location_description = data[1]['text']
-        skills = data[2]['text']
-        characters = data[3]['text']
+        location_name = initialization_data[0]['text']
+        location_description = initialization_data[1]['text']
+        skills = initialization_data[2]['text']
+        characters = initialization_data[3]['text']
 
         main_loop_prompt += 'Here are the location name, description, skills, and characters:\n'
         main_loop_prompt += f'{location_name}\n'
@@ -686,33 +868,98 @@ def main_loop(request):
         main_loop_prompt += f'{skills}\n'
         main_loop_prompt += f'{characters}\n\n'
 
-        main_loop_prompt += '''Here is the history of the game thus far:
-Each of these, except for the last, is a summary of what happened.
-The last is the full text. What you output should be more like the full text.\n\n'''
-
         ## now, add the history
-        history = load_history(game_id, summaries=True)
-        
-        # remove the last AI message
-        if history[-1]['writer'] == 'ai':
-            history = history[:-1]
-
-        # replace it with the last full text AI response
+        # the last full text AI response - it replaces the last AI summary
+        full_text = None
         for item in frontend_history[::-1]:
             if item['writer'] == 'ai':
                 item['text'] = item['text'].strip()
-                history.append(item)
+                full_text = item
                 break
-        
-        # then, add the user input and some gentle encouragement and tips
+
+        # then, the user input and some gentle encouragement and tips
         ## have to tell it not to create monsters, or else that's ALL it does
-        history.append({'writer': 'user', 
-                        'text': f'''{user_input}. Remember to keep it around 150-250 words.
+        user_message = {'writer': 'user', 
+                        'text': f'''{user_input}. Remember to keep it around 150-{config.llm['main_loop_words']} words.
 When in doubt, make something surprising and exciting happen!
-Avoid creating monsters and scary creatures - we're looking for drama, funny characters, and bizarre twists!'''})
-        
-        # check the history, and fix it if necessary
-        history_fixed = fix_summary_history(history)
+Avoid creating monsters and scary creatures - we're looking for drama, funny characters, and bizarre twists!'''}
+
+        # the summaries of the last turns may still be being written
+        ## the earlier ones are waited for - the latest is replaced by the full text anyway
+        ## any that still aren't ready have their full text stand in for them
+        await wait_for_summaries(game_id)
+
+        # the prompt state has the summaries already fixed and converted - so we only add the end
+        prompt_state = await run_io(load_prompt_state, game_id)
+
+        # the older turns are folded into acts and an arc - those go in the system prompt, and the turns since in the history
+        ## if the story summary doesn't fit the history (e.g. it's being folded again after a rollback), the whole history goes in
+        story = game.story_summary
+
+        if prompt_state is not None and full_text is not None:
+            messages = after_story(story, prompt_state['messages'], messages=True) if story else None
+            if messages is None:
+                messages, story = prompt_state['messages'], None
+
+            # the settled messages will start the next turn's prompt too - the rest gets replaced
+            stable_messages = len(messages)
+
+            # the turns since the last saved summary - including any whose summaries were lost, or are in another process
+            unsummarized = await run_io(find_unsummarized, game_id, prompt_state['last'])
+            resubmit_summaries(game_id, unsummarized)
+
+            history_fixed = build_messages(messages, prompt_state['last'], 
+                                           full_text, user_message,
+                                           pending=stand_in_records(unsummarized, prompt_state['last']))
+        else:
+            history = await run_io(load_history, game_id, summaries=True)
+            last = history[-1] if history else None
+
+            unsummarized = await run_io(find_unsummarized, game_id, last)
+            resubmit_summaries(game_id, unsummarized)
+
+            pending_records = stand_in_records(unsummarized, last)
+            history += pending_records
+
+            recent = after_story(story, history) if story else None
+            if recent is not None:
+                history = recent
+            else:
+                story = None
+
+            # as with the prompt state - the messages settled from the saved summaries will start the next prompt too
+            stable_messages = len(advance(None, history[:len(history) - len(pending_records)])[0])
+            
+            # remove the last AI message
+            if history[-1]['writer'] == 'ai':
+                history = history[:-1]
+
+            # replace it with the last full text AI response
+            if full_text is not None:
+                history.append(full_text)
+            
+            history.append(user_message)
+            
+            # check the history, and fix it if necessary
+            history_fixed = [to_message(item) for item in fix_summary_history(history)]
+
+        main_loop_prompt += describe_story(story)
+
+        main_loop_prompt += '''Here is the history of the game thus far:
+Each of these, except for the last, is a summary of what happened.
+The last is the full text. What you output should be more like the full text.\n\n'''
+
+        # the prompt is kept within its budget - what's left after the system prompt goes to the history, latest first
+        system_tokens = estimate_tokens(build_system_prompt(context='main_loop', system=main_loop_prompt))
+        ## an act's worth of turns is dropped at a time, so the start of the prompt (and its cache) doesn't change every turn
+        history_budget, history_tokens = fit_to_budget(history_fixed, config.llm['prompt_budget'] - system_tokens,
+                                                       step=2 * config.llm['act_turns'])
+        stable_messages = max(stable_messages - (len(history_fixed) - len(history_budget)), 0)
+
+        if len(history_budget) < len(history_fixed):
+            logger.info(f'Dropped the oldest {len(history_fixed) - len(history_budget)} messages from the main loop prompt '
+                        f'for game id={game_id}, to keep it within {config.llm["prompt_budget"]} tokens')
+        history_fixed = history_budget
     except:
         logger.exception(f'Problem generating main loop prompt and history for game id={game_id}')
         return HttpResponse('There was a problem - please try again.', status=255)
@@ -720,57 +967,50 @@ Avoid creating monsters and scary creatures - we're looking for drama, funny cha
     logger.info(f'Generating main loop response for game id={game_id}')
 
     response = ''
+    cost = 0
     try:
-        for chunk in prompt(history_fixed, context='main_loop', 
-                            system=main_loop_prompt, stream=True, caching=True):
+        async for chunk in await aprompt(history_fixed, context='main_loop', 
+                                         system=main_loop_prompt, stream=True, caching=True,
+                                         max_tokens=words_to_tokens(config.llm['main_loop_words']),
+                                         stable_messages=stable_messages):
         
             if chunk['type'] == 'text':
                 response += chunk['text']
-                send_event(f'game-{game_id}', 'message', {'text': chunk['text']})
+                await send_text(game_id, chunk['text'])
             elif chunk['type'] == 'message_stop':
                 # add the cost to generate it
-                cost = chunk['cost']
-                game.total_dollar_cost += cost
+                cost += chunk['cost']
+
+                # the story summary keeps the prompt from growing with the game - this shows whether it does
+                logger.info(f'Main loop prompt for game id={game_id} on turn {turn} was {chunk["input_tokens"]} input tokens '
+                            f'(estimated {system_tokens + history_tokens}) - '
+                            f'{len(history_fixed)} messages, {len(story["acts"]) if story else 0} acts'
+                            f'{" and the arc" if story and story["arc"] else ""}')
     except:
         logger.exception(f'Error generating main loop response for game id={game_id}')
         return HttpResponse('There was a problem - please try again.', status=255)
     
 
     try:
-        # summarize the response
-        summary, summary_cost = summarize(response, target_words=config.llm['summarization_target_word_count'])
-
-        # update game
-        game.turns = turn
-        game.total_dollar_cost += summary_cost
-        game.save()
-
-        ## saving text
-
-        # first, save the user input to both the full text and summary files
-        save_text(game_id=game_id, new_data=user_input, writer='user', turn=turn, type='full_text')
-        save_text(game_id=game_id, new_data=user_input, writer='user', turn=turn, type='summaries')
-
-        # then save the response to file
-        save_text(game_id=game_id, new_data=response, turn=turn, writer='ai', type='full_text')
-
-        # then save the summmary to file
-        save_text(game_id=game_id, new_data=summary, turn=turn, writer='ai', type='summaries')
+        # save the user input and response in one commit
+        ## if it fails, none of the turn is saved - so there's nothing to clean up
+        ## in write-behind mode, this returns as soon as the turn is in the local journal
+        await run_io(save_turn, game_id, turn, response, None, user_input=user_input)
 
+        # the response is summarized in the background - it isn't needed until the turn after next
+        defer_summary(game_id, turn, response, user_input=user_input)
     except:
-        # something has gone wrong, so we need to reset the turn
-
-        # remove the turn from the summary and full text files
-        remove_turn(game_id, turn)
-
-        game.turns = turn - 1
-        # save the game
-        game.save()
-
-        logger.exception(f'Error summarizing and saving main loop response for game id={game_id}')
+        logger.exception(f'Error saving main loop response for game id={game_id}')
         
         return HttpResponse('There was a problem - please try again.', status=255)
 
+    try:
+        # update game
+        await update_game(game_id, cost, turns=turn)
+    except:
+        # the turn has already been saved, so don't make the player redo it
+        logger.exception(f'Error updating game id={game_id} after turn {turn}')
+
     return JsonResponse({'success': 'locked and loaded - knock their socks off!'})
 
 
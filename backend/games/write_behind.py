@@ -0,0 +1,223 @@
+''' Write-behind saving of turns - turns go into a local journal, and a background pool writes them to storage. '''
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+import games.journal as journal
+from games.save_game import (add_records, cache_records, commit_records, get_game_lock, get_manifest,
+                             make_turn_records, save_manifest, update_prompt_state)
+
+
+logger = logging.getLogger(__name__)
+
+
+# the worker pool, and the sweeper thread that picks up turns that are due for a retry
+## both are started the first time they're needed
+executor = None
+sweeper = None
+# the games currently being flushed - only one worker flushes a game at a time, so its turns stay in order
+flushing = set()
+lock = threading.Lock()
+
+def reset():
+    '''
+    Forgets the worker pool and sweeper - they don't survive into a forked child process,
+    so new ones get started there on first use.
+
+    Returns
+    -------
+    None
+    '''
+
+    global executor, sweeper, lock
+
+    executor = None
+    sweeper = None
+    flushing.clear()
+    lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset)
+
+def start():
+    '''
+    Starts the worker pool and the sweeper thread, if they aren't running already.
+    The sweeper also flushes any turns left in the journal by a previous process.
+
+    Returns
+    -------
+    None
+    '''
+
+    global executor, sweeper
+
+    with lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=config.file_save['flush_workers'],
+                                          thread_name_prefix='write-behind')
+        if sweeper is None:
+            sweeper = threading.Thread(target=sweep, name='write-behind-sweeper', daemon=True)
+            sweeper.start()
+
+def sweep():
+    '''
+    Runs forever, periodically scheduling a flush for every game with turns that are due.
+
+    Returns
+    -------
+    None
+    '''
+
+    while True:
+        try:
+            for game_id in journal.get_due_games():
+                schedule_flush(game_id)
+        except Exception:
+            logger.exception('Error sweeping the write-behind journal.')
+
+        time.sleep(config.file_save['flush_interval'])
+
+def schedule_flush(game_id):
+    '''
+    Schedules a game's pending turns to be written to storage by the worker pool.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+
+    Returns
+    -------
+    None
+    '''
+
+    start()
+    executor.submit(flush_game, str(game_id))
+
+def flush_game(game_id):
+    '''
+    Writes all of a game's pending turns to storage, batched into a single commit.
+    If it fails, the turns stay in the journal and are retried later, with backoff.
+
+    Parameters
+    ----------
+    game_id : str
+        The game id.
+
+    Returns
+    -------
+    None
+    '''
+
+    with lock:
+        if game_id in flushing:
+            return
+        flushing.add(game_id)
+
+    try:
+        # keep going until the journal is empty - turns can arrive while we're flushing
+        while True:
+            turns = journal.get_pending_turns(game_id)
+            if not turns:
+                return
+
+            ids = [id for id, _ in turns]
+
+            try:
+                # the manifest can also be changed by other saves, e.g. rolling back a turn
+                with get_game_lock(game_id):
+                    manifest = get_manifest(game_id)
+
+                    # the manifest records the last of this journal's turns that it holds
+                    ## so if we committed but then failed to remove the turns from the journal,
+                    ## they don't get written twice
+                    journal_id = journal.get_journal_id()
+                    flushed = manifest.setdefault('journal', {}).get(journal_id, 0)
+                    turns = [(id, records) for id, records in turns if id > flushed]
+
+                    if turns:
+                        added = {type: [record for _, records in turns for record in records[type]]
+                                 for type in ['full_text', 'summaries']}
+
+                        for type, records in added.items():
+                            add_records(game_id, manifest, type, records)
+                        if added['summaries']:
+                            added.update(update_prompt_state(game_id, manifest, added['summaries']))
+
+                        # commit
+                        manifest['journal'][journal_id] = ids[-1]
+                        save_manifest(game_id, manifest)
+
+                        cache_records(game_id, manifest, added)
+
+                journal.remove_turns(ids)
+            except Exception:
+                logger.exception(f'Error flushing write-behind turns for game id={game_id}')
+                journal.record_failure(ids)
+                return
+    finally:
+        with lock:
+            flushing.discard(game_id)
+
+def save_turn(game_id, turn, response, summary,
+              user_input=None, summary_input=None):
+    '''
+    Saves a whole turn.
+    In write-behind mode, the turn goes into the local journal and is written to storage in the background -
+    otherwise, it's committed to storage straight away.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    turn : int | str
+        The turn number.
+    response : str
+        The AI's response - saved to full_text.
+    summary : str | None
+        The summary of the response - saved to summaries. If None, the summaries are saved later, with save_turn_records.
+    user_input : str | None
+        The user input that the AI responded to - saved to both full_text and summaries.
+    summary_input : str | None
+        A user message to save to summaries only, in place of the user input.
+
+    Returns
+    -------
+    None
+    '''
+
+    records = make_turn_records(turn, response, summary,
+                                user_input=user_input, summary_input=summary_input)
+
+    save_turn_records(game_id, records)
+
+def save_turn_records(game_id, records):
+    '''
+    Saves a turn's records - e.g. its summaries, once they've been written.
+    In write-behind mode they go through the journal, the same as whole turns, so everything is written in order.
+
+    Parameters
+    ----------
+    game_id : int
+        The game id.
+    records : dict
+        The full_text and summaries records.
+
+    Returns
+    -------
+    None
+    '''
+
+    # the database commits a turn in a single transaction - there's nothing to gain from the journal
+    if not config.file_save['write_behind'] or config.file_save['history_backend'] == 'database':
+        commit_records(game_id, records)
+        return
+
+    # once it's in the journal, the turn is safe - even if the process dies before it's flushed
+    journal.add_turn(game_id, records)
+
+    schedule_flush(game_id)
@@ -0,0 +1,27 @@
+import pytest
+import config
+
+from games.cache import cache
+from games.storage import get_storage
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # tests reuse game ids, so nothing can be left cached from another test
+    cache.clear()
+    yield
+    cache.clear()
+
+@pytest.fixture
+def storage_config():
+    # the file save settings to change for the memory storage - 
+    ## override this fixture in a test file, or parametrize it on a test, e.g. to make the chunks smaller
+    return {}
+
+@pytest.fixture
+def memory_storage(mocker, storage_config):
+    # a fresh memory backend for each test, so no files are shared between them
+    mocker.patch('games.storage.backends', {})
+    mocker.patch.dict(config.file_save, {'backend': 'memory', 'path': 'games', 'max_size': 100000,
+                                         'write_behind': False, 'history_backend': 'files', **storage_config})
+    return get_storage()
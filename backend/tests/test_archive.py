@@ -0,0 +1,79 @@
+import pytest
+import time
+
+from django.core.management import call_command
+
+import games.cache
+from games.archive import archive_game, get_archive_path
+from games.load_game import load_history, load_initialization, load_manifest, load_prompt_state
+from games.models import Game
+from games.save_game import commit_turn, remove_turn, save_text
+from games.storage import get_storage
+
+
+@pytest.fixture
+def storage_config():
+    return {'max_size': 100, 'archive_path': None}
+
+@pytest.fixture
+def game(memory_storage):
+    game = Game.objects.create()
+
+    save_text(game.id, 'Location name: a cave', type='initialization')
+    commit_turn(game.id, 'crash', 'story', 'summary', summary_input='start')
+    for turn in range(1, 11):
+        commit_turn(game.id, turn, f'response {turn}', f'summary {turn}', user_input=f'input {turn}')
+    remove_turn(game.id, 10)
+
+    return game
+
+@pytest.mark.django_db
+def test_archive_game(game):
+    history = load_history(game.id)
+    summaries = load_history(game.id, summaries=True)
+    prompt_state = load_prompt_state(game.id)
+
+    results = archive_game(game.id)
+
+    storage = get_storage()
+    assert sorted(storage.files) == sorted([get_archive_path(game.id), f'games/{game.id}/manifest.json'])
+    assert results['objects_before'] > results['objects_after'] == 2
+    assert results['bytes_before'] > results['bytes_after']
+    assert Game.objects.get(id=game.id).archived
+
+    # loading the game brings it back, as it was
+    games.cache.cache.clear()
+    assert load_history(game.id) == history
+    assert load_history(game.id, summaries=True) == summaries
+    assert load_initialization(game.id) == [{'writer': 'ai', 'text': 'Location name: a cave'}]
+    assert not Game.objects.get(id=game.id).archived
+    assert get_archive_path(game.id) not in storage.files
+    assert len(load_manifest(game.id)['full_text']) == 1
+
+    # the prompt state comes back too, and the game carries on
+    assert load_prompt_state(game.id) == prompt_state
+    commit_turn(game.id, 10, 'response 10', 'summary 10', user_input='input 10')
+    assert load_history(game.id)[-1] == {'writer': 'ai', 'text': 'response 10', 'turn': 10}
+
+@pytest.mark.django_db
+def test_initialization_rehydrates(game):
+    archive_game(game.id)
+    games.cache.cache.clear()
+
+    assert load_initialization(game.id) == [{'writer': 'ai', 'text': 'Location name: a cave'}]
+
+@pytest.mark.django_db
+def test_recently_played_game_not_archived(game):
+    assert archive_game(game.id, idle_since=time.time() - 60) is None
+    assert not Game.objects.get(id=game.id).archived
+
+@pytest.mark.django_db
+def test_archive_games_command(game):
+    Game.objects.filter(id=game.id).update(modified=Game.objects.get(id=game.id).created.replace(year=2000))
+
+    # the manifest says it was played just now
+    call_command('archive_games', days=1)
+    assert not Game.objects.get(id=game.id).archived
+
+    call_command('archive_games', days=0)
+    assert Game.objects.get(id=game.id).archived
@@ -0,0 +1,121 @@
+import games.cache
+from games.cache import LRUCache, add_invalidation_hook
+from games.load_game import load_history, load_last_record, load_latest_file, load_initialization
+from games.save_game import commit_turn, save_text, remove_turn
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=100, ttl=60)
+    cache.put(('1', 'a'), 'a', 40)
+    cache.put(('2', 'a'), 'b', 40)
+    cache.get(('1', 'a'))
+    cache.put(('3', 'a'), 'c', 40)
+
+    assert cache.get(('1', 'a')) == 'a'
+    assert cache.get(('2', 'a')) is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 80
+
+def test_disabled_cache_stores_nothing():
+    cache = LRUCache(max_bytes=0, ttl=60)
+    cache.put(('1', 'a'), [], 0)
+
+    assert cache.get(('1', 'a')) is None
+
+def test_entries_expire(mocker):
+    cache = LRUCache(max_bytes=100, ttl=60)
+    cache.put(('1', 'a'), 'a', 10)
+
+    mocker.patch('time.monotonic', return_value=cache.now() + 61)
+
+    assert cache.get(('1', 'a')) is None
+    assert cache.stats()['misses'] == 1
+
+def test_stale_reads_are_not_cached():
+    cache = LRUCache(max_bytes=100, ttl=60)
+    since = cache.now()
+    cache.invalidate('1')
+    cache.put(('1', 'a'), 'old', 10, since=since)
+
+    assert cache.get(('1', 'a')) is None
+
+def test_warm_turn_reads_only_the_manifest(mocker, memory_storage):
+    commit_turn(1, 1, 'they go left', 'left', user_input='go left')
+    save_text(1, 'Location name: a cave', type='initialization')
+    load_history(1, summaries=True)
+
+    reads = [mocker.spy(memory_storage, method) 
+             for method in ['read', 'read_if_exists', 'read_range', 'exists']]
+
+    # a whole turn - the preamble, the prompt, and saving the turn
+    load_last_record(1)
+    load_last_record(1, type='summaries')
+    load_initialization(1)
+    load_history(1, summaries=True)
+    commit_turn(1, 2, 'they go right', 'right', user_input='go right')
+
+    # saving reads the manifest from storage, in case another process has saved the game - nothing else is read
+    assert [call.args[0] for read in reads for call in read.call_args_list] == ['games/1/manifest.json']
+    assert [item['text'] for item in load_history(1, summaries=True)] == ['go left', 'left', 'go right', 'right']
+    assert [item['turn'] for item in load_latest_file(1)] == [1, 1, 2, 2]
+
+def test_cached_history_matches_storage(memory_storage):
+    for turn in range(1, 4):
+        commit_turn(1, turn, 'response', 'short', user_input='input')
+    remove_turn(1, 3)
+    save_text(1, 'dangling', turn=3, writer='user')
+
+    cached = load_history(1)
+    games.cache.cache.clear()
+
+    assert load_history(1) == cached
+
+def test_dangling_message_rolled_back_in_one_write(mocker, memory_storage):
+    commit_turn(1, 1, 'they go left', 'left', user_input='go left')
+    save_text(1, 'go right', turn=2, writer='user')
+    save_text(1, 'go right', turn=2, writer='user', type='summaries')
+    load_history(1)
+    load_history(1, summaries=True)
+
+    writes = [mocker.spy(memory_storage, method) for method in ['write', 'append']]
+
+    # what the main loop's preamble does
+    for type in ['full_text', 'summaries']:
+        remove_turn(1, load_last_record(1, type=type)['turn'], types=(type,))
+
+    assert [call.args[0] for write in writes for call in write.call_args_list] == ['games/1/manifest.json'] * 2
+    assert load_latest_file(1) == [{'writer': 'user', 'text': 'go left', 'turn': 1},
+                                   {'writer': 'ai', 'text': 'they go left', 'turn': 1}]
+
+    cached = load_history(1, summaries=True)
+    games.cache.cache.clear()
+
+    assert load_history(1, summaries=True) == cached == [{'writer': 'user', 'text': 'go left', 'turn': 1},
+                                                         {'writer': 'ai', 'text': 'left', 'turn': 1}]
+
+def test_invalidation_hooks(mocker, memory_storage):
+    hook = mocker.Mock()
+    mocker.patch('games.cache.invalidation_hooks', [])
+    add_invalidation_hook(hook)
+
+    commit_turn(1, 1, 'they go left', 'left', user_input='go left')
+
+    hook.assert_called_with('1')
+
+def test_save_built_on_the_manifest_in_storage(memory_storage):
+    # another process saves a turn after this one cached the game - so this process's cache is out of date
+    commit_turn(1, 1, 'response 1', 'summary 1', user_input='input 1')
+    stale = {name: games.cache.cache.peek(('1', name)) for name in ['manifest', 'full_text', 'summaries', 'prompt']}
+
+    commit_turn(1, 2, 'response 2', 'summary 2', user_input='input 2')
+
+    for name, value in stale.items():
+        if value is not None:
+            games.cache.cache.put(('1', name), value, 1)
+
+    commit_turn(1, 3, 'response 3', 'summary 3', user_input='input 3')
+
+    assert [item['turn'] for item in load_history(1)] == [1, 1, 2, 2, 3, 3]
+    games.cache.cache.clear()
+    assert [item['turn'] for item in load_history(1)] == [1, 1, 2, 2, 3, 3]
+    assert [item['turn'] for item in load_history(1, summaries=True)] == [1, 1, 2, 2, 3, 3]
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+
+from games.chain import run_chain
+
+
+def test_steps_get_their_dependencies():
+
+    async def description():
+        return 'a cave'
+
+    async def name(description):
+        return f'The {description.split()[-1].title()}'
+
+    async def scene(description, name):
+        return f'{name}: {description}'
+
+    results = asyncio.run(run_chain({
+        'description': (description, []),
+        'name': (name, ['description']),
+        'scene': (scene, ['description', 'name']),
+    }))
+
+    assert results == {'description': 'a cave', 'name': 'The Cave', 'scene': 'The Cave: a cave'}
+
+def test_independent_steps_overlap():
+    finished = []
+
+    def step(label, seconds):
+        async def run(**dependencies):
+            await asyncio.sleep(seconds)
+            finished.append(label)
+        return run
+
+    start = time.perf_counter()
+    asyncio.run(run_chain({
+        'first': (step('first', 0.1), []),
+        'slow': (step('slow', 0.2), ['first']),
+        'fast': (step('fast', 0.05), ['first']),
+        'last': (step('last', 0), ['slow', 'fast']),
+    }))
+
+    # first, then slow and fast side by side - rather than 0.35s one after another
+    assert time.perf_counter() - start < 0.33
+    assert finished == ['first', 'fast', 'slow', 'last']
+
+def test_failed_step_cancels_the_rest():
+    cancelled = []
+
+    async def fails():
+        raise ValueError('no location')
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append('slow')
+            raise
+
+    async def after(fails):
+        return 'never'
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_chain({
+            'slow': (slow, []),
+            'fails': (fails, []),
+            'after': (after, ['fails']),
+        }))
+
+    assert cancelled == ['slow']
+
+def test_dependency_must_come_first():
+
+    async def step(**dependencies):
+        return None
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_chain({
+            'name': (step, ['description']),
+            'description': (step, []),
+        }))
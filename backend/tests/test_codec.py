@@ -0,0 +1,30 @@
+import pytest
+
+from games.codec import encode, decode, detect
+
+
+def test_encode_and_decode():
+    data = b'{"writer": "ai", "text": "They crash into the jungle. The jungle is very green."}\n' * 10
+    encoded = encode(data, codec='zlib')
+
+    assert encoded != data
+    assert len(encoded) < len(data)
+    assert detect(encoded) == 'zlib'
+    assert decode(encoded) == data
+
+def test_decode_concatenated_frames():
+    first = b'{"writer": "user", "text": "go left"}\n'
+    second = b'{"writer": "ai", "text": "they go left"}\n'
+
+    assert decode(encode(first, codec='zlib') + encode(second, codec='zlib')) == first + second
+
+def test_decode_legacy():
+    data = b'[{"writer": "ai", "text": "hello"}]'
+
+    assert encode(data, codec='none') == data
+    assert detect(data) == 'none'
+    assert decode(data) == data
+
+def test_encode_invalid_codec():
+    with pytest.raises(ValueError):
+        encode(b'{}', codec='floppy')
@@ -0,0 +1,67 @@
+import pytest
+import config
+
+from django.core.management import call_command
+
+from games.load_game import load_history, load_latest_file
+from games.models import Game, StoryEntry
+from games.save_game import save_text, save_intro, remove_turn, commit_turn
+
+
+@pytest.fixture
+def game(mocker, tmp_path):
+    mocker.patch('config.ENV', 'DEV')
+    mocker.patch.dict(config.file_save, {'path': str(tmp_path), 'history_backend': 'database'})
+    return Game.objects.create()
+
+@pytest.mark.django_db
+def test_commit_turn(game):
+    commit_turn(game.id, 'crash', 'story', 'summary', summary_input='start')
+    commit_turn(game.id, 1, 'response', 'short', user_input='input')
+
+    assert load_history(game.id) == [{'writer': 'ai', 'text': 'story', 'turn': 'crash'},
+                                     {'writer': 'user', 'text': 'input', 'turn': 1},
+                                     {'writer': 'ai', 'text': 'response', 'turn': 1}]
+    assert load_history(game.id, summaries=True) == [{'writer': 'user', 'text': 'start', 'turn': 'crash'},
+                                                     {'writer': 'ai', 'text': 'summary', 'turn': 'crash'},
+                                                     {'writer': 'user', 'text': 'input', 'turn': 1},
+                                                     {'writer': 'ai', 'text': 'short', 'turn': 1}]
+    assert load_latest_file(game.id) == [{'writer': 'user', 'text': 'input', 'turn': 1},
+                                         {'writer': 'ai', 'text': 'response', 'turn': 1}]
+
+@pytest.mark.django_db
+def test_remove_turn(game):
+    for turn in range(1, 4):
+        commit_turn(game.id, turn, 'response', 'short', user_input='input')
+
+    remove_turn(game.id, 3)
+
+    assert [item['turn'] for item in load_history(game.id)] == [1, 1, 2, 2]
+    assert [item['turn'] for item in load_history(game.id, summaries=True)] == [1, 1, 2, 2]
+
+@pytest.mark.django_db
+def test_save_text_overwrite(game):
+    commit_turn(game.id, 1, 'response', 'short', user_input='input')
+    save_text(game.id, 'dangling', turn=2, writer='user')
+
+    # the preamble drops a dangling user message by overwriting the latest turn
+    save_text(game.id, load_latest_file(game.id)[:-1], save_type='overwrite')
+
+    assert [item['text'] for item in load_history(game.id)] == ['input', 'response']
+
+@pytest.mark.django_db
+def test_import_story_entries(game, mocker):
+    mocker.patch.dict(config.file_save, {'history_backend': 'files'})
+    commit_turn(game.id, 'crash', 'story', 'summary', summary_input='start')
+    save_intro(game.id, ['Ann', 'Bo', 'Cy'])
+    commit_turn(game.id, 1, 'response', 'short', user_input='input')
+    files_history = load_history(game.id)
+
+    # importing twice doesn't duplicate anything
+    call_command('import_story_entries')
+    call_command('import_story_entries', game.id)
+
+    assert StoryEntry.objects.filter(game=game).count() == 8
+
+    mocker.patch.dict(config.file_save, {'history_backend': 'database'})
+    assert load_history(game.id) == files_history
@@ -1,6 +1,7 @@
+import asyncio
 import pytest
 import random
-from games.initialization import random_setup, create_skills
+from games.initialization import random_setup, create_characters, create_wakeup
 import config
 from games.utils import add_info_to_initialization_prompt
 
@@ -19,4 +20,41 @@ def test_random_setup(mocker):
     assert theme == 'Fantasy'
     assert timeframe == 'Medieval'
     assert details == 'Dragons, Magic'
-    assert mock_random_choice.call_count == 5
\ No newline at end of file
+    assert mock_random_choice.call_count == 5
+
+
+def test_initialization_prompts_share_a_cached_start(mocker):
+    mocker.patch.dict(config.llm, {'initialization_caching': True})
+
+    characters = 'Ada--history--tall--calm--Climbing|3\n' * 3
+    aprompt = mocker.patch('games.initialization.aprompt', side_effect=[(characters, 0.01), None])
+
+    async def initialize():
+        await create_characters('They crash.', 'A cave.', 'Climbing--up\n', title='Fallen', theme='Space')
+        await create_wakeup('They crash.', 'A cave.', 'Climbing--up\n', characters, title='Fallen', theme='Space')
+
+    asyncio.run(initialize())
+
+    (characters_call, wakeup_call) = aprompt.call_args_list
+    characters_blocks = characters_call.args[0][0]['content']
+    wakeup_blocks = wakeup_call.args[0][0]['content']
+
+    # the wakeup prompt starts the same way as the characters prompt - up to the end of the skills
+    assert [block['text'] for block in wakeup_blocks[:4]] == [block['text'] for block in characters_blocks[:4]]
+    assert 'characters' in wakeup_blocks[4]['text']
+
+    # the characters prompt writes the cache at the end of the skills, which the wakeup prompt reads
+    ## and as its output is checked and re-prompted, the whole of it is cached too
+    assert [i for i, block in enumerate(characters_blocks) if 'cache_control' in block] == [2, 3, 4]
+    assert [i for i, block in enumerate(wakeup_blocks) if 'cache_control' in block] == [2, 3, 4]
+    assert all(call.kwargs['caching'] and call.kwargs['stable_messages'] == 0 for call in aprompt.call_args_list)
+    assert wakeup_call.kwargs['label'] == 'create_wakeup'
+
+def test_initialization_caching_off(mocker):
+    mocker.patch.dict(config.llm, {'initialization_caching': False})
+    aprompt = mocker.patch('games.initialization.aprompt', return_value=None)
+
+    asyncio.run(create_wakeup('They crash.', 'A cave.', 'Climbing--up\n', 'Ada', title='Fallen'))
+
+    assert not any('cache_control' in block for block in aprompt.call_args.args[0][0]['content'])
+    assert aprompt.call_args.kwargs['caching'] is False
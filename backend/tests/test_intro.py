@@ -0,0 +1,23 @@
+from games.intro import render_intro
+from games.load_game import iter_history, load_history, load_history_page, load_manifest
+from games.save_game import commit_turn, save_intro
+
+
+def test_render_intro():
+    assert render_intro(['Ann', 'Bo', 'Cy']).startswith('Ann, Bo, and Cy need your help!\n')
+    assert render_intro(None).startswith('Some poor souls need your help!\n')
+
+def test_intro_stored_as_reference(memory_storage):
+    commit_turn(1, 'crash', 'story', 'summary', summary_input='start')
+    save_intro(1, ['Ann', 'Bo', 'Cy'])
+    commit_turn(1, 1, 'response', 'short', user_input='input')
+
+    intro = {'writer': 'intro', 'text': render_intro(['Ann', 'Bo', 'Cy']), 'turn': 'intro'}
+
+    # the text isn't stored - just the names
+    assert load_manifest(1)['full_text'][0]['size'] < len(intro['text'])
+
+    # but it's there when the history is read
+    assert load_history(1)[1] == intro
+    assert list(iter_history(1))[1] == intro
+    assert load_history_page(1, before=1)[0] == [load_history(1)[0], intro]
@@ -0,0 +1,174 @@
+import pytest
+import random
+import threading
+import time
+import config
+
+import games.cache
+import games.load_game
+import games.storage
+import games.save_game
+from games.load_game import fetch_chunks, iter_history, load_history, load_history_page, load_latest_file, load_manifest
+from games.save_game import commit_turn, compact_tombstones, remove_turn, save_manifest
+
+
+@pytest.fixture
+def storage_config():
+    # small chunks, so a game has plenty of them
+    return {'max_size': 100, 'fetch_workers': 4}
+
+@pytest.fixture
+def long_game(memory_storage):
+    for turn in range(1, 21):
+        commit_turn(1, turn, f'response {turn}', f'summary {turn}', user_input=f'input {turn}')
+    games.cache.cache.clear()
+
+def test_fetch_chunks_in_order(mocker, long_game):
+    load_records = games.load_game.load_records
+    lock = threading.Lock()
+    running = []
+    most = [0]
+
+    # chunks arrive out of order
+    def slow_load_records(*args, **kwargs):
+        with lock:
+            running.append(1)
+            most[0] = max(most[0], len(running))
+        time.sleep(random.random() / 100)
+        with lock:
+            running.pop()
+        return load_records(*args, **kwargs)
+
+    mocker.patch('games.load_game.load_records', side_effect=slow_load_records)
+
+    chunks = list(fetch_chunks(1))
+
+    assert len(chunks) == len(load_manifest(1)['full_text']) > 4
+    assert [item['text'] for chunk in chunks for item in chunk][:4] == ['input 1', 'response 1', 'input 2', 'response 2']
+    assert most[0] <= config.file_save['fetch_workers']
+
+def test_load_latest_file_reads_only_latest_chunk(mocker, long_game):
+    load_records = mocker.spy(games.load_game, 'load_records')
+    latest = load_latest_file(1)
+
+    assert load_records.call_count == 1
+    assert latest == load_history(1)[-len(latest):]
+
+def test_iter_history(long_game):
+    history = load_history(1, summaries=True)
+    games.cache.cache.clear()
+
+    assert list(iter_history(1, summaries=True)) == history
+
+def test_iter_history_yields_before_loading_everything(mocker, long_game):
+    load_records = mocker.spy(games.load_game, 'load_records')
+
+    items = iter_history(1)
+    next(items)
+
+    # only the first window of chunks, and the one after it, have been requested
+    assert load_records.call_count <= config.file_save['fetch_workers'] + 1
+    items.close()
+
+def test_iter_history_is_cached(mocker, long_game):
+    list(iter_history(1))
+    load_records = mocker.spy(games.load_game, 'load_records')
+
+    assert [item['turn'] for item in iter_history(1)][-2:] == [20, 20]
+    assert load_records.call_count == 0
+
+def test_iter_history_newest_first(long_game):
+    history = load_history(1)
+    games.cache.cache.clear()
+
+    # read from storage, then from the cache
+    assert list(iter_history(1, newest_first=True)) == history[::-1]
+    assert list(iter_history(1, newest_first=True)) == history[::-1]
+    assert load_history(1) == history
+
+def test_history_pages(long_game):
+    history = load_history(1)
+
+    items, before = load_history_page(1, limit=3)
+    assert [item['turn'] for item in items] == [18, 18, 19, 19, 20, 20]
+    assert before == 18
+
+    # paging back through the whole game gets everything, in order
+    pages = [items]
+    while before is not None:
+        items, before = load_history_page(1, before=before, limit=3)
+        pages.insert(0, items)
+    assert [item for page in pages for item in page] == history
+
+def test_history_page_reads_only_its_chunks(mocker, long_game):
+    load_records = mocker.spy(games.load_game, 'load_records')
+
+    items, _ = load_history_page(1, before=10, limit=2)
+
+    assert [item['turn'] for item in items] == [8, 8, 9, 9]
+    assert load_records.call_count < len(load_manifest(1)['full_text']) / 2
+
+def test_history_page_from_cache(long_game):
+    pages = [load_history_page(1, before=before, limit=4) for before in [None, 5, 17]]
+    load_history(1)
+
+    assert [load_history_page(1, before=before, limit=4) for before in [None, 5, 17]] == pages
+
+def test_history_page_without_index(long_game):
+    history = load_history(1)
+    manifest = load_manifest(1)
+    del manifest['index']
+    save_manifest(1, manifest)
+
+    assert load_history_page(1, before=3, limit=5) == (history[:4], None)
+
+    # the index is built the next time the game is saved
+    commit_turn(1, 21, 'response 21', 'summary 21', user_input='input 21')
+    assert load_manifest(1)['index']['full_text'][-1][0] == 21
+    assert load_history_page(1, limit=1) == (load_history(1)[-2:], 21)
+
+def test_remove_turn_writes_only_the_manifest(mocker, long_game):
+    load_history(1)
+    write = mocker.spy(games.storage.MemoryStorage, 'write')
+
+    remove_turn(1, 20)
+
+    # the tombstone is a single write - the manifest
+    assert [call.args[1] for call in write.call_args_list] == ['games/1/manifest.json']
+    assert [item['turn'] for item in load_history(1)][-2:] == [19, 19]
+
+    # and readers that don't go through the cache leave the turn out too
+    games.cache.cache.clear()
+    assert [item['turn'] for item in load_history(1)][-2:] == [19, 19]
+    assert [item['turn'] for item in iter_history(1, newest_first=True)][:2] == [19, 19]
+    assert load_history_page(1, limit=1)[0] == load_history(1)[-2:]
+
+def test_turn_saved_again_after_tombstone(long_game):
+    remove_turn(1, 20)
+    commit_turn(1, 20, 'response 20 again', 'summary 20 again', user_input='input 20')
+
+    history = load_history(1)
+    games.cache.cache.clear()
+
+    assert history == load_history(1)
+    assert [item['text'] for item in history[-3:]] == ['response 19', 'input 20', 'response 20 again']
+
+def test_compact_tombstones(mocker, long_game):
+    remove_turn(1, 5)
+    remove_turn(1, 20)
+    history = load_history(1)
+    summaries = load_history(1, summaries=True)
+
+    save_records = mocker.spy(games.save_game, 'save_records')
+
+    assert compact_tombstones(1) == 8
+
+    manifest = load_manifest(1)
+    assert 'tombstones' not in manifest
+    # only the chunks that held the removed turns are rewritten
+    assert save_records.call_count < len(manifest['full_text']) + len(manifest['summaries'])
+
+    games.cache.cache.clear()
+    assert load_history(1) == history
+    assert load_history(1, summaries=True) == summaries
+    assert load_history_page(1, before=7, limit=2)[0] == [item for item in history if item['turn'] in [4, 6]]
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from games.pacing import PacedStream
+
+
+def test_sends_in_order_at_the_interval(mocker):
+    sent = []
+    mocker.patch('games.pacing.send_event', side_effect=lambda channel, type, data: sent.append((time.monotonic(), data)))
+
+    stream = PacedStream('game-1', interval=0.02)
+    start = time.monotonic()
+    for i in range(5):
+        stream.send({'item': i})
+    stream.close()
+
+    # nothing waits here - the events are sent in the background
+    assert time.monotonic() - start < 0.02
+    assert asyncio.run(stream.wait(timeout=5))
+    assert [data['item'] for _, data in sent] == [0, 1, 2, 3, 4]
+    assert sent[-1][0] - sent[0][0] >= 0.08 * 0.9
+
+def test_first_event_is_sent_straight_away(mocker):
+    sent = []
+    mocker.patch('games.pacing.send_event', side_effect=lambda channel, type, data: sent.append(time.monotonic()))
+
+    stream = PacedStream('game-1', interval=10)
+    start = time.monotonic()
+    stream.send({'item': 0})
+    stream.send({'item': 1})
+
+    deadline = time.monotonic() + 5
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    assert len(sent) == 1 and sent[0] - start < 1
+    stream.cancel()
+
+def test_failed_send(mocker):
+    mocker.patch('games.pacing.send_event', side_effect=Exception('no channel'))
+
+    stream = PacedStream('game-1', interval=0)
+    stream.send({'item': 0})
+    stream.close()
+
+    assert not asyncio.run(stream.wait(timeout=5))
+
+def test_wait_times_out(mocker):
+    mocker.patch('games.pacing.send_event')
+
+    stream = PacedStream('game-1', interval=10)
+    stream.send({'item': 0})
+    stream.send({'item': 1})
+    stream.close()
+
+    assert not asyncio.run(stream.wait(timeout=0.05))
+    stream.cancel()
@@ -0,0 +1,119 @@
+import pytest
+import random
+
+import games.cache
+from games.load_game import load_manifest, load_prompt_state
+from games.prompt_state import advance, build_messages, estimate_tokens, fit_to_budget, message_tokens, to_message
+from games.save_game import commit_turn, save_text, remove_turn, save_manifest
+from games.summarize import fix_summary_history
+
+
+@pytest.fixture
+def storage_config():
+    return {'max_size': 300}
+
+def rebuild(summaries, full_text, user_message):
+    # how the main loop builds the prompt without a prompt state
+    history = [dict(item) for item in summaries]
+    if history and history[-1]['writer'] == 'ai':
+        history = history[:-1]
+    history += [dict(full_text), dict(user_message)]
+
+    return [to_message(item) for item in fix_summary_history(history)]
+
+def test_matches_rebuilding():
+    rng = random.Random(0)
+    full_text = {'writer': 'ai', 'text': 'full text'}
+    user_message = {'writer': 'user', 'text': 'go left'}
+
+    for _ in range(200):
+        summaries = [{'writer': rng.choice(['user', 'ai']), 'text': rng.choice(['', 'a', 'b'])}
+                     for _ in range(rng.randint(0, 8))]
+
+        # moved on a few records at a time, as turns are saved
+        messages, last = [], None
+        i = 0
+        while i < len(summaries):
+            n = rng.randint(1, 3)
+            settled, last = advance(last, summaries[i:i + n])
+            messages += settled
+            i += n
+
+        assert build_messages(messages, last, full_text, user_message) == rebuild(summaries, full_text, user_message)
+
+def test_matches_rebuilding_with_pending_summaries():
+    rng = random.Random(1)
+    full_text = {'writer': 'ai', 'text': 'full text'}
+    user_message = {'writer': 'user', 'text': 'go left'}
+
+    for _ in range(200):
+        summaries = [{'writer': rng.choice(['user', 'ai']), 'text': rng.choice(['', 'a', 'b'])}
+                     for _ in range(rng.randint(0, 8))]
+        # the last few haven't been saved yet - their full text stands in for them
+        saved = rng.randint(0, len(summaries))
+
+        messages, last = advance(None, summaries[:saved])
+
+        assert (build_messages(messages, last, full_text, user_message, pending=summaries[saved:])
+                == rebuild(summaries, full_text, user_message))
+
+def test_saved_with_turns(memory_storage):
+    commit_turn(1, 'crash', 'story', 'crash summary', summary_input='start')
+    for turn in range(1, 6):
+        commit_turn(1, turn, 'response', f'summary {turn}', user_input=f'input {turn}')
+
+    state = load_prompt_state(1)
+    assert state['last'] == {'writer': 'ai', 'text': 'summary 5', 'turn': 5}
+    assert [message['content'][0]['text'] for message in state['messages']][-2:] == ['summary 4', 'input 5']
+
+    # each message has its token estimate saved with it
+    assert state['messages'][-1]['tokens'] == estimate_tokens('input 5') + 4
+
+    # and it's the same when it's read back from storage
+    games.cache.cache.clear()
+    assert load_prompt_state(1) == state
+
+def test_rebuilt_after_rollback(memory_storage):
+    for turn in range(1, 4):
+        commit_turn(1, turn, 'response', f'summary {turn}', user_input=f'input {turn}')
+
+    remove_turn(1, 3)
+    assert load_prompt_state(1) is None
+
+    commit_turn(1, 3, 'response', 'summary 3 again', user_input='input 3 again')
+    state = load_prompt_state(1)
+    assert state['last']['text'] == 'summary 3 again'
+    assert [message['content'][0]['text'] for message in state['messages']][-1] == 'input 3 again'
+
+def test_built_for_legacy_games(memory_storage):
+    save_text(1, 'start', turn='crash', writer='user', type='summaries')
+    save_text(1, 'crash summary', turn='crash', writer='ai', type='summaries')
+
+    # a game saved before there were prompt states
+    manifest = load_manifest(1)
+    del manifest['prompt_state'], manifest['prompt']
+    save_manifest(1, manifest)
+    assert load_prompt_state(1) is None
+
+    commit_turn(1, 1, 'response', 'summary 1', user_input='input 1')
+    state = load_prompt_state(1)
+    assert [message['content'][0]['text'] for message in state['messages']] == ['start', 'crash summary', 'input 1']
+
+def test_fit_to_budget():
+    messages = [to_message({'writer': 'user' if i % 2 == 0 else 'ai', 'text': 'x' * 70}) for i in range(7)]
+    # saved before there were estimates
+    messages[0].pop('tokens')
+    assert all(message_tokens(message) == 24 for message in messages)
+
+    assert fit_to_budget(messages, 1000) == (messages, 168)
+
+    # the oldest go first - and the rest start with the user's message
+    assert fit_to_budget(messages, 100) == (messages[4:], 72)
+
+    # a step at a time
+    assert fit_to_budget(messages, 150) == (messages[2:], 120)
+    assert fit_to_budget(messages, 150, step=4) == (messages[4:], 72)
+
+    # the latest are kept, whatever the budget
+    assert fit_to_budget(messages, 0) == (messages[-1:], 24)
+    assert fit_to_budget(messages, 0, keep=3) == (messages[-3:], 72)
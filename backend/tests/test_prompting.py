@@ -1,8 +1,16 @@
 
+import asyncio
 import pytest
 import config
 
-from games.prompting import prompt
+import games.prompting
+from django.core.management import call_command
+
+from games.models import PromptUsage
+from games.prompting import (prompt, aprompt, build_parameters, get_client, get_async_client, get_connection_stats,
+                             count_request, reset_clients)
+from games.management.commands.cache_report import cache_report
+from anthropic.lib.streaming._prompt_caching_beta_types import TextEvent as CacheTextEvent
 
 
 @pytest.fixture
@@ -11,7 +19,8 @@ def mock_config(mocker):
         'provider': 'ANTHROPIC',
         'prompts_path': 'dummy_path',
         'api_key': 'dummy_api_key',
-        'model': 'dummy_model'
+        'model': 'dummy_model',
+        'record_usage': False,
     })
     mocker.patch('games.utils.load_yaml', return_value={
         'main': 'Main prompt text.',
@@ -22,7 +31,10 @@ def mock_config(mocker):
 def mock_anthropic_client(mocker):
     mock_client = mocker.Mock()
     mocker.patch('anthropic.Anthropic', return_value=mock_client)
-    return mock_client
+    # the shared client is created on first use - so make sure it's the mock
+    reset_clients()
+    yield mock_client
+    reset_clients()
 
 def test_prompting(mocker, mock_config, mock_anthropic_client):
 
@@ -70,4 +82,158 @@ def test_prompt_with_list_message(mocker, mock_config, mock_anthropic_client):
         'output_tokens': 50,
         'cache_input_tokens': 20,
         'cache_read_tokens': 10
-    }, caching=True)
\ No newline at end of file
+    }, caching=True)
+
+
+def test_prompt_with_converted_messages(mocker, mock_config, mock_anthropic_client):
+    mocker.patch('games.prompting.calculate_price', return_value=0.01)
+    mock_message = mocker.Mock()
+    mock_message.content = [mocker.Mock(text='Response text')]
+    mock_anthropic_client.beta.prompt_caching.messages.create.return_value = mock_message
+
+    messages = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': [{'type': 'text', 'text': str(i)}]}
+                for i in range(5)]
+    prompt(messages, context='create_crash', caching=True)
+
+    sent = mock_anthropic_client.beta.prompt_caching.messages.create.call_args.kwargs['messages']
+    assert [message['content'][0]['text'] for message in sent] == ['0', '1', '2', '3', '4']
+    assert sent[-3]['content'][0]['cache_control'] == {'type': 'ephemeral'}
+    # the messages passed in aren't changed - they may be shared
+    assert all('cache_control' not in message['content'][0] for message in messages)
+
+def test_cache_breakpoints_on_stable_messages(mock_config):
+    messages = [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': [{'type': 'text', 'text': str(i)}]}
+                for i in range(9)]
+
+    # the first 6 messages will start the next call too
+    parameters = build_parameters(messages, context='main_loop', caching=True, stable_messages=6)
+
+    assert [i for i, message in enumerate(parameters['messages'])
+            if 'cache_control' in message['content'][0]] == [1, 3, 5]
+
+    # nothing's stable yet - only the system prompt is cached
+    parameters = build_parameters(messages[:2], context='main_loop', caching=True, stable_messages=0)
+    assert not any('cache_control' in message['content'][0] for message in parameters['messages'])
+    assert parameters['system'][0]['cache_control'] == {'type': 'ephemeral'}
+
+@pytest.mark.django_db
+def test_usage_recorded(mocker, mock_config, mock_anthropic_client):
+    mocker.patch.dict(config.llm, {'record_usage': True})
+    mocker.patch('games.prompting.calculate_price', return_value=0.01)
+
+    mock_message = mocker.Mock()
+    mock_message.content = [mocker.Mock(text='Response text')]
+    mock_message.usage.input_tokens = 100
+    mock_message.usage.output_tokens = 50
+    mock_message.usage.cache_creation_input_tokens = 0
+    mock_message.usage.cache_read_input_tokens = 300
+    mock_anthropic_client.beta.prompt_caching.messages.create.return_value = mock_message
+
+    prompt('Test message', context='main_loop')
+    mock_message.usage.cache_read_input_tokens = 0
+    mock_message.usage.cache_creation_input_tokens = 300
+    prompt('Test message', context='main_loop')
+    mock_anthropic_client.messages.create.return_value = mock_message
+    prompt('Test message', caching=False, label='summarize')
+
+    assert PromptUsage.objects.count() == 3
+
+    report = {row['label']: row for row in cache_report()}
+    assert report['main_loop']['calls'] == 2
+    assert report['main_loop']['hit_rate'] == 0.5
+    assert report['main_loop']['read_rate'] == 0.375
+    # without caching, the cache tokens aren't counted
+    assert report['summarize']['cache_write_tokens'] == 0
+
+    call_command('cache_report', days=1)
+
+def test_client_is_shared(mocker, mock_config, mock_anthropic_client):
+    mocker.patch('games.prompting.calculate_price', return_value=0.01)
+    mock_message = mocker.Mock()
+    mock_message.content = [mocker.Mock(text='Response text')]
+    mock_anthropic_client.beta.prompt_caching.messages.create.return_value = mock_message
+
+    prompt('Test message', context='create_crash')
+    prompt('Test message', context='create_crash')
+
+    # one client for both calls
+    assert games.prompting.anthropic.Anthropic.call_count == 1
+    assert get_client() is mock_anthropic_client
+
+def test_async_client_per_event_loop(mocker, mock_config):
+    mocker.patch('anthropic.AsyncAnthropic', side_effect=lambda **kwargs: mocker.Mock())
+    reset_clients()
+
+    async def get_twice():
+        return get_async_client(), get_async_client()
+
+    first, second = asyncio.run(get_twice())
+    other, _ = asyncio.run(get_twice())
+
+    assert first is second
+    assert other is not first
+
+def test_connection_stats(mocker):
+    reset_clients()
+
+    for new_connection in [True, False, False, True]:
+        request = mocker.Mock(extensions={})
+        count_request(request)
+        if new_connection:
+            request.extensions['trace']('connection.connect_tcp.complete', {})
+        request.extensions['trace']('http11.send_request_headers.complete', {})
+
+    assert get_connection_stats() == {'requests': 4, 'new_connections': 2, 'reused_connections': 2, 'reuse_rate': 0.5}
+    reset_clients()
+
+@pytest.fixture
+def mock_async_anthropic_client(mocker):
+    mock_client = mocker.Mock()
+    mocker.patch('anthropic.AsyncAnthropic', return_value=mock_client)
+    reset_clients()
+    yield mock_client
+    reset_clients()
+
+# the usage is recorded in the io pool, which closes its old database connections
+@pytest.mark.django_db
+def test_aprompt(mocker, mock_config, mock_async_anthropic_client):
+    mocker.patch('games.prompting.calculate_price', return_value=0.01)
+    mock_message = mocker.Mock()
+    mock_message.content = [mocker.Mock(text='Response text')]
+    mock_async_anthropic_client.messages.create = mocker.AsyncMock(return_value=mock_message)
+
+    text, cost = asyncio.run(aprompt('Test message', context='create_crash', caching=False))
+
+    assert text == 'Response text'
+    assert cost == 0.01
+    sent = mock_async_anthropic_client.messages.create.call_args.kwargs
+    assert sent['messages'] == [{'role': 'user', 'content': [{'type': 'text', 'text': 'Test message'}]}]
+
+# the usage is recorded in the io pool, which closes its old database connections
+@pytest.mark.django_db
+def test_aprompt_stream(mocker, mock_config, mock_async_anthropic_client):
+    mocker.patch('games.prompting.calculate_price', return_value=0.01)
+
+    # a text event and the message stop event, as the async stream gives them
+    stop_event = mocker.Mock(spec=games.prompting.CacheMessageStopEvent)
+    stop_event.message = mocker.Mock()
+    stop_event.message.usage.input_tokens = 100
+    stop_event.message.usage.cache_creation_input_tokens = 20
+    stop_event.message.usage.cache_read_input_tokens = 10
+    events = [CacheTextEvent(type='text', text='Once', snapshot='Once'), stop_event]
+
+    class Stream:
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, *args):
+            return False
+        async def __aiter__(self):
+            for event in events:
+                yield event
+
+    mock_async_anthropic_client.beta.prompt_caching.messages.stream.return_value = Stream()
+
+    async def collect():
+        return [chunk async for chunk in await aprompt('Test message', context='create_crash', stream=True)]
+
+    assert asyncio.run(collect()) == [{'type': 'text', 'text': 'Once'}, {'type': 'message_stop', 'cost': 0.01, 'input_tokens': 130}]
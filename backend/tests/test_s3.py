@@ -1,5 +1,5 @@
 import pytest
-from games.s3 import list_objects, aws_client
+from games.s3 import list_objects, aws_client, reset_clients
 
 @pytest.fixture
 def mock_aws_client(mocker):
@@ -7,47 +7,79 @@ def mock_aws_client(mocker):
     mocker.patch('games.s3.aws_client', return_value=mock_client)
     return mock_client
 
+def mock_pages(mock_client, pages):
+    mock_paginate = mock_client.get_paginator.return_value.paginate
+    mock_paginate.return_value = pages
+    return mock_paginate
+
 def test_list_objects_no_client(mocker, mock_aws_client):
-    mock_list_objects = mock_aws_client.list_objects
-    mock_list_objects.return_value = {'Contents': [{'Key': 'prefix/file1.txt'}, {'Key': 'prefix/file2.txt'}]}
+    mock_paginate = mock_pages(mock_aws_client, [{'Contents': [{'Key': 'prefix/file1.txt'}, {'Key': 'prefix/file2.txt'}]}])
     
     bucket = 'dummy_bucket'
     prefix = 'prefix'
     result = list_objects(bucket, prefix)
     
     assert result == ['file1.txt', 'file2.txt']
-    mock_list_objects.assert_called_once_with(Bucket=bucket, Prefix=prefix)
+    mock_aws_client.get_paginator.assert_called_once_with('list_objects_v2')
+    mock_paginate.assert_called_once_with(Bucket=bucket, Prefix=prefix)
 
 def test_list_objects_with_client(mocker):
     mock_client = mocker.Mock()
-    mock_list_objects = mock_client.list_objects
-    mock_list_objects.return_value = {'Contents': [{'Key': 'prefix/file1.txt'}, {'Key': 'prefix/file2.txt'}]}
+    mock_paginate = mock_pages(mock_client, [{'Contents': [{'Key': 'prefix/file1.txt'}, {'Key': 'prefix/file2.txt'}]}])
     
     bucket = 'dummy_bucket'
     prefix = 'prefix'
     result = list_objects(bucket, prefix, client=mock_client)
     
     assert result == ['file1.txt', 'file2.txt']
-    mock_list_objects.assert_called_once_with(Bucket=bucket, Prefix=prefix)
+    mock_paginate.assert_called_once_with(Bucket=bucket, Prefix=prefix)
 
 def test_list_objects_empty_prefix(mocker, mock_aws_client):
-    mock_list_objects = mock_aws_client.list_objects
-    mock_list_objects.return_value = {'Contents': [{'Key': 'prefix/'}]}
+    mock_paginate = mock_pages(mock_aws_client, [{'Contents': [{'Key': 'prefix/'}]}])
     
     bucket = 'dummy_bucket'
     prefix = 'prefix'
     result = list_objects(bucket, prefix)
     
     assert result == []
-    mock_list_objects.assert_called_once_with(Bucket=bucket, Prefix=prefix)
+    mock_paginate.assert_called_once_with(Bucket=bucket, Prefix=prefix)
 
-def test_list_objects_key_error(mocker, mock_aws_client):
-    mock_list_objects = mock_aws_client.list_objects
-    mock_list_objects.side_effect = KeyError
+def test_list_objects_missing_prefix(mocker, mock_aws_client):
+    mock_paginate = mock_pages(mock_aws_client, [{'KeyCount': 0}])
     
     bucket = 'dummy_bucket'
     prefix = 'prefix'
     result = list_objects(bucket, prefix)
     
     assert result == []
-    mock_list_objects.assert_called_once_with(Bucket=bucket, Prefix=prefix)
\ No newline at end of file
+    mock_paginate.assert_called_once_with(Bucket=bucket, Prefix=prefix)
+
+def test_list_objects_over_many_pages(mocker, mock_aws_client):
+    # s3 returns at most 1000 objects a page
+    pages = [{'Contents': [{'Key': f'prefix/{page * 1000 + i}.jsonl'} for i in range(1000)]} for page in range(2)]
+    pages.append({'Contents': [{'Key': 'prefix/2000.jsonl'}]})
+    mock_pages(mock_aws_client, pages)
+
+    result = list_objects('dummy_bucket', 'prefix')
+
+    assert result == [f'{i}.jsonl' for i in range(2001)]
+
+def test_aws_client_is_shared(mocker):
+    mocker.patch('games.s3.clients', {})
+    mock_session = mocker.patch('games.s3.aws_session')
+
+    first = aws_client('s3')
+    second = aws_client('s3')
+
+    assert first is second
+    mock_session.assert_called_once()
+
+def test_reset_clients(mocker):
+    mocker.patch('games.s3.clients', {})
+    mock_session = mocker.patch('games.s3.aws_session')
+
+    aws_client('s3')
+    reset_clients()
+    aws_client('s3')
+
+    assert mock_session.call_count == 2
@@ -0,0 +1,139 @@
+import pytest
+import os
+import config
+
+import games.save_game
+
+from games.load_game import load_history, load_latest_file, load_manifest, parse_records
+from games.save_game import save_text, remove_turn, commit_turn
+
+
+@pytest.fixture
+def mock_file_save(mocker, tmp_path):
+    mocker.patch('config.ENV', 'DEV')
+    mocker.patch.dict(config.file_save, {'path': str(tmp_path), 'max_size': 200})
+    return tmp_path
+
+def test_parse_records_legacy():
+    raw = b'[{"writer": "ai", "text": "hello", "turn": "crash"}]'
+    assert parse_records(raw) == [{'writer': 'ai', 'text': 'hello', 'turn': 'crash'}]
+
+def test_parse_records_lines():
+    raw = b'{"writer": "user", "text": "hi", "turn": 1}\n{"writer": "ai", "text": "hello", "turn": 1}\n'
+    assert parse_records(raw) == [{'writer': 'user', 'text': 'hi', 'turn': 1}, 
+                                  {'writer': 'ai', 'text': 'hello', 'turn': 1}]
+
+def test_save_text_appends(mock_file_save):
+    save_text(1, 'first', turn=1, writer='user')
+    save_text(1, 'second', turn=1, writer='ai')
+
+    files = os.listdir(os.path.join(mock_file_save, '1', 'full_text'))
+    assert files == ['0.jsonl']
+    assert load_history(1) == [{'writer': 'user', 'text': 'first', 'turn': 1}, 
+                               {'writer': 'ai', 'text': 'second', 'turn': 1}]
+
+def test_save_text_rolls_over(mock_file_save):
+    for turn in range(1, 13):
+        save_text(1, 'x' * 50, turn=turn, writer='ai')
+
+    files = os.listdir(os.path.join(mock_file_save, '1', 'full_text'))
+    assert len(files) > 1
+    assert [item['turn'] for item in load_history(1)] == list(range(1, 13))
+    assert load_latest_file(1)[-1]['turn'] == 12
+
+def test_remove_turn(mock_file_save):
+    for turn in range(1, 4):
+        for type in ['full_text', 'summaries']:
+            save_text(1, 'user', turn=turn, writer='user', type=type)
+            save_text(1, 'ai', turn=turn, writer='ai', type=type)
+
+    remove_turn(1, 3)
+
+    assert [item['turn'] for item in load_history(1)] == [1, 1, 2, 2]
+    assert [item['turn'] for item in load_history(1, summaries=True)] == [1, 1, 2, 2]
+
+def test_overwrite_after_tombstone(mock_file_save):
+    commit_turn(1, 1, 'response', 'short', user_input='input')
+    save_text(1, 'dangling', turn=2, writer='user')
+    remove_turn(1, 2, types=('full_text',))
+
+    # the latest chunk is rewritten with what's visible - the tombstone mustn't hide the turn saved after it
+    save_text(1, load_latest_file(1), save_type='overwrite')
+    commit_turn(1, 2, 'response 2', 'short 2', user_input='input 2')
+
+    assert [item['turn'] for item in load_history(1)] == [1, 1, 2, 2]
+
+def test_manifest_tracks_chunks(mock_file_save):
+    save_text(1, 'first', turn='crash', writer='ai')
+    save_text(1, 'second', turn=1, writer='user')
+
+    manifest = load_manifest(1)
+    assert manifest['full_text'] == [{
+        'name': '0.jsonl',
+        'size': os.path.getsize(os.path.join(mock_file_save, '1', 'full_text', '0.jsonl')),
+        'records': 2,
+        'first_turn': 'crash',
+        'last_turn': 1,
+        'codec': config.file_save['codec'],
+    }]
+    assert manifest['summaries'] == []
+
+def test_save_text_uses_manifest(mocker, mock_file_save):
+    save_text(1, 'first', turn=1, writer='user')
+
+    # once there's a manifest, saving and loading shouldn't list any directories
+    mock_listdir = mocker.patch('games.save_game.get_gamefile_listdir')
+    mocker.patch('games.load_game.get_gamefile_listdir', mock_listdir)
+
+    save_text(1, 'second', turn=1, writer='ai')
+    remove_turn(1, 1)
+    save_text(1, 'third', turn=1, writer='ai')
+
+    assert load_history(1) == [{'writer': 'ai', 'text': 'third', 'turn': 1}]
+    mock_listdir.assert_not_called()
+
+def test_manifest_built_for_legacy_game(mock_file_save):
+    legacy_dir = os.path.join(mock_file_save, '1', 'full_text')
+    os.makedirs(legacy_dir)
+    with open(os.path.join(legacy_dir, '0.json'), 'w') as f:
+        f.write('[{"writer": "ai", "text": "legacy", "turn": "crash"}]')
+
+    save_text(1, 'new', turn=1, writer='user')
+
+    assert [chunk['name'] for chunk in load_manifest(1)['full_text']] == ['0.json', '1.jsonl']
+    assert [item['text'] for item in load_history(1)] == ['legacy', 'new']
+
+def test_commit_turn(mock_file_save):
+    commit_turn(1, 'crash', 'crash story', 'crash summary', summary_input='crash them')
+    commit_turn(1, 1, 'they go left', 'left', user_input='go left')
+
+    assert load_history(1) == [{'writer': 'ai', 'text': 'crash story', 'turn': 'crash'},
+                               {'writer': 'user', 'text': 'go left', 'turn': 1},
+                               {'writer': 'ai', 'text': 'they go left', 'turn': 1}]
+    assert load_history(1, summaries=True) == [{'writer': 'user', 'text': 'crash them', 'turn': 'crash'},
+                                               {'writer': 'ai', 'text': 'crash summary', 'turn': 'crash'},
+                                               {'writer': 'user', 'text': 'go left', 'turn': 1},
+                                               {'writer': 'ai', 'text': 'left', 'turn': 1}]
+
+def test_commit_turn_failure_leaves_nothing(mocker, mock_file_save):
+    commit_turn(1, 1, 'they go left', 'left', user_input='go left')
+
+    # full text gets written, then summaries fail
+    add_records = games.save_game.add_records
+    failures = ['summaries']
+    def fail_on_summaries(game_id, manifest, type, records):
+        if type in failures:
+            failures.remove(type)
+            raise IOError('Storage is down.')
+        add_records(game_id, manifest, type, records)
+    mocker.patch('games.save_game.add_records', side_effect=fail_on_summaries)
+
+    with pytest.raises(IOError):
+        commit_turn(1, 2, 'they go right', 'right', user_input='go right')
+
+    assert [item['turn'] for item in load_history(1)] == [1, 1]
+    assert [item['turn'] for item in load_history(1, summaries=True)] == [1, 1]
+
+    # the next commit isn't affected by what was left behind
+    commit_turn(1, 2, 'they go right', 'right', user_input='go right')
+    assert [item['text'] for item in load_history(1)] == ['go left', 'they go left', 'go right', 'they go right']
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+import config
+
+from games.load_game import load_history
+from games.save_game import save_text, remove_turn
+from games.storage import LocalStorage, MemoryStorage, get_storage, run_in_background, run_io
+
+
+@pytest.fixture(params=['local', 'memory'])
+def storage(request, tmp_path):
+    if request.param == 'local':
+        return LocalStorage(), str(tmp_path)
+    return MemoryStorage(), 'games'
+
+def test_write_and_read(storage):
+    backend, root = storage
+    backend.write(f'{root}/1/full_text/0.jsonl', b'hello')
+
+    assert backend.read(f'{root}/1/full_text/0.jsonl') == b'hello'
+    assert backend.exists(f'{root}/1/full_text/0.jsonl')
+    assert backend.size(f'{root}/1/full_text/0.jsonl') == 5
+    assert backend.list(f'{root}/1/full_text') == ['0.jsonl']
+
+def test_append_and_read_range(storage):
+    backend, root = storage
+    backend.append(f'{root}/1/full_text/0.jsonl', b'hello')
+    backend.append(f'{root}/1/full_text/0.jsonl', b' world')
+
+    assert backend.read(f'{root}/1/full_text/0.jsonl') == b'hello world'
+    assert backend.read_range(f'{root}/1/full_text/0.jsonl', 0, 5) == b'hello'
+    assert backend.read_range(f'{root}/1/full_text/0.jsonl', 6, 11) == b'world'
+
+def test_missing_files(storage):
+    backend, root = storage
+
+    assert backend.read_if_exists(f'{root}/1/manifest.json') is None
+    assert not backend.exists(f'{root}/1/manifest.json')
+    assert backend.list(f'{root}/1/full_text') == []
+
+    backend.write(f'{root}/1/manifest.json', b'{}')
+    backend.delete(f'{root}/1/manifest.json')
+    assert not backend.exists(f'{root}/1/manifest.json')
+
+def test_local_write_replaces_in_one_step(mocker, tmp_path):
+    backend = LocalStorage()
+    backend.write(f'{tmp_path}/1/manifest.json', b'{"chunks": []}')
+
+    # a crash part way through writing leaves the old file as it was
+    mocker.patch('games.storage.os.fsync', side_effect=OSError('disk full'))
+    with pytest.raises(OSError):
+        backend.write(f'{tmp_path}/1/manifest.json', b'{"chunks": [')
+
+    assert backend.read(f'{tmp_path}/1/manifest.json') == b'{"chunks": []}'
+    assert backend.list(f'{tmp_path}/1') == ['manifest.json']
+
+def test_get_storage_invalid(mocker):
+    mocker.patch.dict(config.file_save, {'backend': 'floppy'})
+    with pytest.raises(ValueError):
+        get_storage()
+
+def test_turn_pipeline_in_memory(memory_storage):
+    save_text(1, 'crash story', turn='crash', writer='ai')
+    save_text(1, 'go left', turn=1, writer='user')
+    save_text(1, 'they go left', turn=1, writer='ai')
+    remove_turn(1, 1)
+
+    assert load_history(1) == [{'writer': 'ai', 'text': 'crash story', 'turn': 'crash'}]
+    assert memory_storage.exists('games/1/manifest.json')
+
+# the io pool closes its old database connections around each call
+@pytest.mark.django_db
+def test_run_io_off_the_event_loop(memory_storage):
+    async def save_and_load():
+        loop_thread = threading.current_thread()
+        # the blocking calls run in the io pool, not on the event loop's thread
+        thread = await run_io(threading.current_thread)
+        await run_io(save_text, 1, 'crash story', turn='crash', writer='ai')
+        return thread is not loop_thread, await run_io(load_history, 1)
+
+    off_loop, history = asyncio.run(save_and_load())
+
+    assert off_loop
+    assert history == [{'writer': 'ai', 'text': 'crash story', 'turn': 'crash'}]
+
+def test_run_in_background_closes_old_connections(mocker):
+    close_old_connections = mocker.patch('games.storage.close_old_connections')
+
+    assert run_in_background(lambda x: x + 1, 1) == 2
+    assert close_old_connections.call_count == 2
+
+    # even if the call fails
+    with pytest.raises(ValueError):
+        run_in_background(int, 'one')
+    assert close_old_connections.call_count == 4
@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+import config
+
+from games.load_game import load_history, load_last_record, load_prompt_state
+from games.models import Game
+from games.prompt_state import build_messages, fixed_message
+from games.save_game import remove_turn
+from games.summarize import (after_story, defer_summary, describe_story, find_unsummarized, fold_story, 
+                             resubmit_summaries, stand_in_records, start, summary_saved, wait_for_summaries)
+from games.write_behind import save_turn
+
+
+@pytest.fixture
+def game(memory_storage):
+    return Game.objects.create(save_key='00000000-0000-0000-0000-000000000001')
+
+def mock_summarize(mocker, delays=None):
+    # summaries take the given time, by turn
+    async def summarize(text, target_words=50):
+        await asyncio.sleep((delays or {}).get(text, 0))
+        return f'summary of {text}', 0.5
+    return mocker.patch('games.summarize.summarize', side_effect=summarize)
+
+@pytest.mark.django_db(transaction=True)
+def test_summary_saved_in_the_background(mocker, game):
+    mock_summarize(mocker)
+
+    save_turn(game.id, 1, 'they go left', None, user_input='go left')
+    # the full text is saved straight away, the summaries once they've been written
+    assert [item['text'] for item in load_history(game.id, summaries=True)] == []
+
+    defer_summary(game.id, 1, 'they go left', user_input='go left').result(timeout=5)
+
+    assert [item['text'] for item in load_history(game.id)] == ['go left', 'they go left']
+    assert [item['text'] for item in load_history(game.id, summaries=True)] == ['go left', 'summary of they go left']
+    game.refresh_from_db()
+    assert game.total_dollar_cost == 0.5
+
+@pytest.mark.django_db(transaction=True)
+def test_summaries_saved_in_turn_order(mocker, game):
+    # the first turn's summary takes longer than the second's
+    mock_summarize(mocker, delays={'they crash': 0.2})
+
+    save_turn(game.id, 'crash', 'they crash', None)
+    first = defer_summary(game.id, 'crash', 'they crash', summary_input='start')
+    save_turn(game.id, 1, 'they go left', None, user_input='go left')
+    second = defer_summary(game.id, 1, 'they go left', user_input='go left')
+
+    second.result(timeout=5)
+    assert first.done()
+    assert [item['turn'] for item in load_history(game.id, summaries=True)] == ['crash', 'crash', 1, 1]
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_summary_saves_the_full_text(mocker, game):
+    mocker.patch('games.summarize.summarize', side_effect=Exception('overloaded'))
+
+    save_turn(game.id, 1, 'they go left', None, user_input='go left')
+    defer_summary(game.id, 1, 'they go left', user_input='go left').result(timeout=5)
+
+    assert [item['text'] for item in load_history(game.id, summaries=True)] == ['go left', 'they go left']
+
+@pytest.mark.django_db(transaction=True)
+def test_wait_for_summaries(mocker, game):
+    mock_summarize(mocker, delays={'they crash': 0.1, 'they go left': 0.5})
+
+    first = defer_summary(game.id, 'crash', 'they crash', summary_input='start')
+    second = defer_summary(game.id, 1, 'they go left', user_input='go left')
+
+    # the earlier summary is waited for - the latest one stands in with its full text
+    pending = asyncio.run(wait_for_summaries(game.id, timeout=5))
+
+    assert first.done() and not second.done()
+    assert stand_in_records(pending, {'writer': 'ai', 'text': 'summary of they crash', 'turn': 'crash'}) == [
+        {'writer': 'user', 'text': 'go left', 'turn': 1},
+        {'writer': 'ai', 'text': 'they go left', 'turn': 1},
+    ]
+    second.result(timeout=5)
+
+@pytest.mark.django_db(transaction=True)
+def test_summaries_missing_from_another_process(mocker, game):
+    mock_summarize(mocker)
+
+    # the last turn's summary was being written by a process that has since stopped
+    save_turn(game.id, 'crash', 'they crash', 'crash', summary_input='start')
+    for turn in range(1, 4):
+        save_turn(game.id, turn, f'resp {turn}', f'summary {turn}', user_input=f'in {turn}')
+    save_turn(game.id, 4, 'resp 4', None, user_input='in 4')
+
+    prompt_state = load_prompt_state(game.id)
+    unsummarized = find_unsummarized(game.id, prompt_state['last'])
+    assert [turn['turn'] for turn in unsummarized] == [4]
+
+    # the full text stands in for the missing summary
+    messages = build_messages(prompt_state['messages'], prompt_state['last'], load_last_record(game.id),
+                              {'writer': 'user', 'text': 'in 5'}, 
+                              pending=stand_in_records(unsummarized, prompt_state['last']))
+    assert [message['content'][0]['text'] for message in messages][-4:] == ['summary 3', 'in 4', 'resp 4', 'in 5']
+
+    # and the summary is written again
+    for future in resubmit_summaries(game.id, unsummarized):
+        future.result(timeout=5)
+    assert [item['text'] for item in load_history(game.id, summaries=True)][-2:] == ['in 4', 'summary of resp 4']
+    assert find_unsummarized(game.id, load_prompt_state(game.id)['last']) == []
+
+    # unless this process is already writing it
+    save_turn(game.id, 5, 'resp 5', None, user_input='in 5')
+    future = defer_summary(game.id, 5, 'resp 5', user_input='in 5')
+    assert resubmit_summaries(game.id, find_unsummarized(game.id, load_prompt_state(game.id)['last'])) == []
+    future.result(timeout=5)
+
+@pytest.mark.django_db(transaction=True)
+def test_summary_resubmitted_after_later_turns_saved(mocker, game):
+    mock_summarize(mocker)
+
+    # another process found turns 5 and 6 unsummarized, but the first process has since saved them both
+    unsummarized = [{'turn': turn, 'response': f'resp {turn}', 'user_input': f'in {turn}'} for turn in [5, 6]]
+    save_turn(game.id, 'crash', 'they crash', 'crash', summary_input='start')
+    for turn in range(1, 7):
+        save_turn(game.id, turn, f'resp {turn}', f'summary {turn}', user_input=f'in {turn}')
+
+    assert summary_saved(game.id, 5) and summary_saved(game.id, 'crash')
+    assert not summary_saved(game.id, 7)
+
+    for future in resubmit_summaries(game.id, unsummarized):
+        future.result(timeout=5)
+
+    # neither is saved again
+    assert [item['turn'] for item in load_history(game.id, summaries=True)][-4:] == [5, 5, 6, 6]
+
+def play(game, turns):
+    # turns with their summaries already written
+    save_turn(game.id, 'crash', 'they crash', 'crash', summary_input='start')
+    for turn in range(1, turns + 1):
+        save_turn(game.id, turn, f'response {turn}', f'summary {turn}', user_input=f'input {turn}')
+
+def fold(game):
+    return asyncio.run_coroutine_threadsafe(fold_story(game.id), start()).result(timeout=5)
+
+@pytest.mark.django_db(transaction=True)
+def test_story_folded_into_acts_and_arc(mocker, game):
+    mocker.patch.dict(config.llm, {'act_turns': 2, 'recent_turns': 2, 'recent_acts': 1})
+    summarize = mock_summarize(mocker)
+
+    # nothing to fold until there are more turns than an act and the recent turns
+    play(game, 3)
+    assert fold(game) is None
+
+    for turn in range(4, 8):
+        save_turn(game.id, turn, f'response {turn}', f'summary {turn}', user_input=f'input {turn}')
+    story = fold(game)
+
+    # 8 turns - the first 4 are folded into 2 acts, and all but the latest act into the arc
+    assert summarize.call_count == 3
+    assert story['turn'] == 3
+    assert story['arc']['last_turn'] == 1
+    assert [(act['first_turn'], act['last_turn']) for act in story['acts']] == [(2, 3)]
+
+    game.refresh_from_db()
+    assert game.story_summary == story
+    assert game.total_dollar_cost == 1.5
+
+    # the prompt has the turns after the folded ones
+    records = load_history(game.id, summaries=True)
+    assert [record['turn'] for record in after_story(story, records)] == [4, 4, 5, 5, 6, 6, 7, 7]
+    assert after_story(story, load_prompt_state(game.id)['messages'], messages=True) == [
+        fixed_message(record) for record in after_story(story, records)[:-1]]
+    assert 'summary of Player: input 2' in describe_story(story)
+
+    # nothing more to fold
+    assert fold(game) is None
+
+@pytest.mark.django_db(transaction=True)
+def test_story_folded_again_after_a_rollback(mocker, game):
+    mocker.patch.dict(config.llm, {'act_turns': 2, 'recent_turns': 1, 'recent_acts': 2})
+    mock_summarize(mocker)
+
+    play(game, 3)
+    story = fold(game)
+    assert story['turn'] == 1
+
+    # the folded turns are rolled back, and played differently
+    for turn in [3, 2, 1]:
+        remove_turn(game.id, turn)
+    assert after_story(story, load_history(game.id, summaries=True)) is None
+
+    for turn in [1, 2, 3]:
+        save_turn(game.id, turn, f'response {turn}b', f'summary {turn}b', user_input=f'input {turn}b')
+    story = fold(game)
+
+    assert 'summary 1b' in story['acts'][0]['text']
@@ -0,0 +1,58 @@
+import pytest
+
+import games.journal as journal
+from games.load_game import load_history
+from games.write_behind import save_turn, flush_game
+
+
+@pytest.fixture
+def storage_config(tmp_path):
+    return {'write_behind': True, 'journal_path': str(tmp_path / 'journal.sqlite3')}
+
+@pytest.fixture
+def mock_write_behind(mocker, memory_storage):
+    # flush by hand, rather than in the background
+    return mocker.patch('games.write_behind.schedule_flush')
+
+def test_pending_turns_are_read_through(mock_write_behind):
+    save_turn(1, 1, 'they go left', 'left', user_input='go left')
+
+    mock_write_behind.assert_called_once_with(1)
+    assert [item['text'] for item in load_history(1)] == ['go left', 'they go left']
+    assert [item['text'] for item in load_history(1, summaries=True)] == ['go left', 'left']
+
+def test_flush_game(mock_write_behind):
+    save_turn(1, 1, 'they go left', 'left', user_input='go left')
+    save_turn(1, 2, 'they go right', 'right', user_input='go right')
+
+    flush_game('1')
+
+    assert journal.get_pending_turns(1) == []
+    assert [item['turn'] for item in load_history(1)] == [1, 1, 2, 2]
+
+def test_flush_game_is_idempotent(mocker, mock_write_behind):
+    save_turn(1, 1, 'they go left', 'left', user_input='go left')
+    remove_turns = journal.remove_turns
+
+    # the commit succeeds, but the turn can't be removed from the journal
+    mocker.patch('games.journal.remove_turns', side_effect=IOError('Disk is full.'))
+    mocker.patch('games.journal.record_failure')
+    flush_game('1')
+    assert len(journal.get_pending_turns(1)) == 1
+    assert [item['turn'] for item in load_history(1)] == [1, 1]
+
+    # so the next flush doesn't write it again
+    mocker.patch('games.journal.remove_turns', side_effect=remove_turns)
+    flush_game('1')
+    assert journal.get_pending_turns(1) == []
+    assert [item['turn'] for item in load_history(1)] == [1, 1]
+
+def test_flush_game_failure_is_retried(mocker, mock_write_behind):
+    save_turn(1, 1, 'they go left', 'left', user_input='go left')
+
+    mocker.patch('games.write_behind.save_manifest', side_effect=IOError('Storage is down.'))
+    flush_game('1')
+
+    assert len(journal.get_pending_turns(1)) == 1
+    assert journal.get_due_games() == []
+    assert [item['turn'] for item in load_history(1)] == [1, 1]
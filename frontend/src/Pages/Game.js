@@ -29,6 +29,8 @@ const reducer = (state, action) => {
             return { ...state, currentStream: state.currentStream + action.payload };
         case 'appendHistory':
             return { ...state, history: [...state.history, action.payload] };
+        case 'prependHistory':
+            return { ...state, history: [action.payload, ...state.history] };
         case 'popHistory':
             let tempHistory = [...state.history];
             tempHistory.pop();
@@ -124,7 +126,8 @@ const Game = (props) => {
                     // set the current stream to the text
                     //dispatch({ type: 'setCurrentStream', payload: chunk.item.text });
                     // add the chunk to history
-                    dispatch({ type: 'appendHistory', payload: {
+                    // if the newest items are sent first, each one goes before the ones already there
+                    dispatch({ type: chunk.newest_first ? 'prependHistory' : 'appendHistory', payload: {
                         writer: chunk.item.writer,
                         text: chunk.item.text,
                         turn: chunk.item.turn,